@@ -1,5 +1,6 @@
 import sys, os, time, json
-from acpki.aci import ACISession
+from acpki.aci import ACISession, QueryExecutor
+from acpki.aci.events import decode_frame
 from acpki.models import Tenant, AP, EPG, EPGUpdate, Contract
 from acpki.config import CONFIG
 from acpki.util.exceptions import RequestError, NotFoundError, ConnectionError
@@ -19,8 +20,9 @@ class ACIAdapter:
         self.tenant_name = CONFIG["apic"]["tn-name"]
         self.ap_name = CONFIG["apic"]["ap-name"]
 
-        # Create session
+        # Create session and executor for concurrent queries
         self.session = ACISession(verbose=self.verbose)
+        self.executor = QueryExecutor(CONFIG["apic"]["max-concurrency"])
 
     def connect(self, auto_prepare):
         """
@@ -34,8 +36,13 @@ class ACIAdapter:
             self.prepare_environment()
 
     def prepare_environment(self):
+        # Get the tenant and the AP concurrently
+        res, res1 = self.executor.run([
+            (self.session.get, ("node/mo/uni/tn-{0}".format(self.tenant_name),), {}),
+            (self.session.get, ("node/mo/uni/tn-{0}/ap-{1}".format(self.tenant_name, self.ap_name),), {}),
+        ])
+
         # Check if the tenant exists
-        res = self.session.get("node/mo/uni/tn-{0}".format(self.tenant_name))
         if res.ok:
             content = json.loads(res.content)
             if int(content["totalCount"]) == 0:
@@ -51,7 +58,6 @@ class ACIAdapter:
             raise ConnectionError("Could not get tenant from the APIC. ({0} {1}".format(res.status_code, res.reason))
 
         # Check if the AP exists
-        res1 = self.session.get("node/mo/uni/tn-{0}/ap-{1}".format(self.tenant_name, self.ap_name))
         if res1.ok:
             # 200 OK
             content = json.loads(res1.content)
@@ -69,6 +75,7 @@ class ACIAdapter:
             raise ConnectionError("Could not get AP from the APIC. ({0} {1}".format(res1.status_code, res1.reason))
 
     def disconnect(self):
+        self.executor.close()
         self.session.disconnect()
 
     def get_epgs(self, sub_cb):
@@ -79,6 +86,15 @@ class ACIAdapter:
                             (Default: None)
         :return:            All EPGs that exist at request time
         """
+        return list(self.iter_epgs(sub_cb))
+
+    def iter_epgs(self, sub_cb, page_size=None):
+        """
+        Query the EPGs one page at a time and yield them as they are received. See get_epgs().
+        :param sub_cb:      Callback method to which subscription events will be sent
+        :param page_size:   Number of EPGs per page (Default: As defined in the configuration)
+        :return:            Generator of EPGs
+        """
         # Define params and url
         params = {
             "query-target": "children",
@@ -89,21 +105,9 @@ class ACIAdapter:
 
         url = "node/mo/uni/tn-{0}/ap-{1}".format(self.tenant_name, self.ap_name)
 
-        # Send request and verify response
-        resp = self.session.get(url, "json", sub_cb=sub_cb, subscribe=True, params=params)
-        if resp.ok:
-            # Load initial EPGs in the current AP
-            content = json.loads(resp.content)
-            epgs = []
-            for item in content["imdata"]:
-                # Add each EPG to the epgs array
-                json_epg = item["fvAEPg"]["attributes"]
-                epg = EPG(json_epg["dn"], json_epg["name"])
-                epgs.append(epg)
-            return epgs
-        else:
-            raise RequestError("Could not get EPGs from the APIC. Please check the request URL, GET parameters, "
-                               "configuration and that the APIC is available before trying again.")
+        for item in self.session.iter_query(url, params, page_size, subscribe=True, sub_cb=sub_cb, silent=False):
+            json_epg = item["fvAEPg"]["attributes"]
+            yield EPG(json_epg["dn"], json_epg["name"])
 
     def get_contracts(self, provider, cls, callback):
         """
@@ -113,6 +117,17 @@ class ACIAdapter:
         :param callback:    The callback method to which subscription data will be forwarded
         :return:
         """
+        return list(self.iter_contracts(provider, cls, callback))
+
+    def iter_contracts(self, provider, cls, callback, page_size=None):
+        """
+        Query the contracts of an EPG one page at a time and yield them as they are received. See get_contracts().
+        :param provider:    The providing EPG
+        :param cls:         Subtree class, must be fvRsProv for provided contracts or fvRsCons for consumed contracts
+        :param callback:    The callback method to which subscription data will be forwarded
+        :param page_size:   Number of contracts per page (Default: As defined in the configuration)
+        :return:            Generator of contracts
+        """
         if cls != "fvRsProv" and cls != "fvRsCons":
             raise ValueError("Invalid value for argument cls")
 
@@ -122,17 +137,28 @@ class ACIAdapter:
             "target-subtree-class": cls
         }
         subscribe = callback is not None
-        contracts = []
-
-        json_resp = self.session.get(path, "json", subscribe=subscribe, params=params, silent=True, sub_cb=callback)
-        content = json.loads(json_resp.content)
 
-        for item in content["imdata"]:
+        for item in self.session.iter_query(path, params, page_size, subscribe=subscribe, sub_cb=callback):
             json_contract = item[cls]["attributes"]
-            contract = Contract(json_contract["uid"], json_contract["tnVzBrCPName"], json_contract["dn"])
-            contracts.append(contract)
+            yield Contract(json_contract["uid"], json_contract["tnVzBrCPName"], json_contract["dn"])
 
-        return contracts
+    def get_contracts_for_epgs(self, epgs, callback=None):
+        """
+        Get the provided and consumed contracts of several EPGs, running the queries concurrently. The provides and
+        consumes lists of each EPG are replaced with the contracts found.
+        :param epgs:        List of EPGs
+        :param callback:    The callback method to which subscription data will be forwarded
+        :return:
+        """
+        calls = []
+        for epg in epgs:
+            calls.append((self.get_consumed_contracts, (epg.name, callback), {}))
+            calls.append((self.get_provided_contracts, (epg.name, callback), {}))
+
+        results = self.executor.run(calls)
+        for i, epg in enumerate(epgs):
+            epg.consumes = results[2 * i]
+            epg.provides = results[2 * i + 1]
 
     def get_provided_contracts(self, provider, callback=None):
         return self.get_contracts(provider, "fvRsProv", callback)
@@ -140,11 +166,88 @@ class ACIAdapter:
     def get_consumed_contracts(self, provider, callback=None):
         return self.get_contracts(provider, "fvRsCons", callback)
 
+    def get_epgs_and_contracts(self, sub_cb):
+        """
+        Get all EPGs in the AP along with their provided and consumed contracts using a single subtree query. The query
+        is covered by one subscription, so changes to any of the EPGs or contracts will be sent to the same callback.
+        :param sub_cb:      Callback method for the subscription (Default: None, which disables the subscription)
+        :return:            All EPGs that exist at request time, with their provides and consumes lists populated
+        """
+        params = {
+            "query-target": "subtree",
+            "target-subtree-class": "fvAEPg,fvRsProv,fvRsCons",
+        }
+
+        url = "node/mo/uni/tn-{0}/ap-{1}".format(self.tenant_name, self.ap_name)
+
+        items = self.session.iter_query(url, params, subscribe=sub_cb is not None, sub_cb=sub_cb, silent=False)
+        return self.build_epgs(items)
+
+    def get_epg_subtree(self, epg_dn):
+        """
+        Get one EPG along with its provided and consumed contracts using a subtree query of the EPG. No subscription is
+        created, since changes to the EPG are covered by the subscription of get_epgs_and_contracts.
+        :param epg_dn:      DN of the EPG
+        :return:            The EPG with its provides and consumes lists populated, or None if it does not exist
+        """
+        params = {
+            "query-target": "subtree",
+            "target-subtree-class": "fvAEPg,fvRsProv,fvRsCons",
+        }
+        epgs = self.build_epgs(self.session.iter_query("node/mo/{0}".format(epg_dn), params))
+        return epgs[0] if epgs else None
+
+    def build_epgs(self, items):
+        """
+        Build EPGs from the objects returned by a subtree query.
+        :param items:       Iterable of objects, e.g. {"fvAEPg": {"attributes": {...}}}
+        :return:            List of EPGs sorted by name, with their provides and consumes lists populated
+        """
+        # The subtree is returned as a flat list, so EPGs are collected before contracts are attached to them
+        epgs = {}
+        relations = []
+        for item in items:
+            if "fvAEPg" in item:
+                json_epg = item["fvAEPg"]["attributes"]
+                epgs[json_epg["dn"]] = EPG(json_epg["dn"], json_epg["name"])
+            elif "fvRsProv" in item or "fvRsCons" in item:
+                cls = "fvRsProv" if "fvRsProv" in item else "fvRsCons"
+                json_contract = item[cls]["attributes"]
+                contract = Contract(json_contract["uid"], json_contract["tnVzBrCPName"], json_contract["dn"])
+                relations.append((cls, contract))
+
+        for cls, contract in relations:
+            epg = epgs.get(self.get_parent_dn(contract.dn))
+            if epg is None:
+                if self.verbose:
+                    print("Warning: Skipped contract {0} without a known EPG.".format(contract.dn))
+                continue
+            if cls == "fvRsProv":
+                epg.provides.append(contract)
+            else:
+                epg.consumes.append(contract)
+
+        return sorted(epgs.values(), key=lambda e: e.name)
+
+    @staticmethod
+    def get_parent_dn(dn):
+        """
+        Get the DN of the parent object, e.g. the EPG DN of a fvRsProv or fvRsCons object.
+        :param dn:          DN of the child object
+        :return:            DN of the parent object
+        """
+        return dn.rsplit("/", 1)[0]
+
     def load_epgs(self):
         raise NotImplementedError
 
     def json_to_epg_update(self, json_update):
-        update = json.loads(json_update)
+        """
+        Decode subscription data into EPG updates.
+        :param json_update: Subscription data as a JSON string
+        :return:            List of EPGUpdate objects
+        """
+        return [event for event in decode_frame(json_update)[1] if isinstance(event, EPGUpdate)]
 
 
 if __name__ == "__main__":
@@ -1,8 +1,10 @@
-import requests, pickle, sys, os, json, thread, time
+import requests, sys, os, json, thread, time
 import urllib3
 import websocket
-from acpki.util.exceptions import SessionError, SubscriptionError
-from acpki.aci import Subscriber, Subscription
+from acpki.util.exceptions import SubscriptionError, RequestError
+from acpki.aci import Subscriber, Subscription, Transport, ResponseCache, SingleFlight, RateLimiter, TokenManager
+from acpki.aci.streaming import iter_imdata
+from acpki.aci.events import decode_frame
 from acpki.config import CONFIG
 
 
@@ -18,25 +20,43 @@ class ACISession:
         :param verbose:     Verbose mode (provides more output)
         """
         # Configuration
-        self.secure = True
+        self.secure = CONFIG["apic"]["use-tls"]
         self.connected = False
         self.verbose = verbose
-        self.apic_base_url = "sandboxapicdc.cisco.com"
+        self.apic_base_url = CONFIG["apic"]["base-url"]
         self.apic_web_url = self.get_web_url(self.apic_base_url)
 
         # Credentials and authentication
-        self.username = "admin"
-        self.password = "ciscopsdt"
-        self.cookie_file = os.path.join(CONFIG["base-dir"], CONFIG["apic"]["cookie-file"])
+        self.username = CONFIG["apic"]["username"]
+        self.password = CONFIG["apic"]["password"]
         self.token_file = os.path.join(CONFIG["base-dir"], CONFIG["apic"]["token-file"])
+        self.tokens = TokenManager(self, self.token_file, CONFIG["apic"]["token-refresh-margin"])
 
         # Set initial values
-        self.crt_file = None
+        self.crt_file = CONFIG["apic"]["crt-file"]
         self.verify = self.crt_file is not None
-        self.token = None
-        self.session = None
+        self.limiter = None
+        if CONFIG["apic"]["rate-limit"]:
+            self.limiter = RateLimiter(rate=CONFIG["apic"]["rate-limit"], burst=CONFIG["apic"]["rate-burst"],
+                                       min_limit=CONFIG["apic"]["rate-min-concurrency"],
+                                       max_limit=CONFIG["apic"]["http-pool-size"],
+                                       max_queue=CONFIG["apic"]["rate-queue-size"],
+                                       max_wait=CONFIG["apic"]["rate-max-wait"])
+        self.session = Transport(pool_size=CONFIG["apic"]["http-pool-size"],
+                                 connect_timeout=CONFIG["apic"]["http-connect-timeout"],
+                                 read_timeout=CONFIG["apic"]["http-read-timeout"],
+                                 retries=CONFIG["apic"]["http-retries"],
+                                 backoff=CONFIG["apic"]["http-backoff"],
+                                 backoff_max=CONFIG["apic"]["http-backoff-max"],
+                                 verify=self.verify,
+                                 limiter=self.limiter)
         self.subscriber = None
         self.cb_methods = {}
+        self.resubscribe_cb = None  # Recreates the subscriptions after logging in again, see resubscribe()
+        self.cache = None
+        if CONFIG["apic"]["cache-size"] > 0:
+            self.cache = ResponseCache(CONFIG["apic"]["cache-size"], CONFIG["apic"]["cache-ttl"])
+        self.single_flight = SingleFlight()
 
         # Setup and connect
         self.setup()
@@ -48,6 +68,10 @@ class ACISession:
                   "file in the configuration. ")
             urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+    @property
+    def token(self):
+        return self.tokens.token
+
     def get_method_url(self, method, file_format="json"):
         return self.apic_web_url + "/api/" + method + "." + file_format
 
@@ -60,8 +84,8 @@ class ACISession:
 
     def connect(self, force_auth=False):
         """
-        Standard method for connecting with the APIC. Attempts to resume session based on the stored session cookie. If
-        the cookie does not exist or has expired it authenticates.
+        Standard method for connecting with the APIC. Attempts to resume session based on the stored token state. If
+        the token does not exist or has expired it authenticates. The token is then refreshed in the background.
         :param sub_cb:      Callback method for any subscription created in this session (Default: None)
         :param force_auth:  Will not attempt to resume session, and authenticate even with a valid session cookie
         :return:
@@ -77,66 +101,81 @@ class ACISession:
             if not res.ok:
                 print("Could not log in... Please check the above status code.")
                 sys.exit(1)
+        self.tokens.start()
 
         # Create subscriber
         self.subscriber = Subscriber(self, sub_cb=self.callback)
 
     def callback(self, opcode, data):
         """
-        When receiving WebSocket data, this method maps the subscription to its assigned callback method and forwards
-        the data to that method. If the method is not found it executes default code.
+        When receiving WebSocket data, this method decodes it into typed events once, maps the subscriptions to their
+        assigned callback methods and forwards the events to those methods. A callback method that is assigned to
+        several of the subscriptions receives the events only once. If no method is found it executes default code.
         :param opcode:      Op code, i.e. reference to the related WebSocket
-        :param data:        Subscription data, JSON or XML data that describes the changes
+        :param data:        Subscription data, JSON data that describes the changes
         :return:
         """
-        content = json.loads(data)
-        sub_id = content["subscriptionId"][0]
-        if sub_id in self.cb_methods.keys():
-            # Callback method found
+        sub_ids, events = decode_frame(data)
+        self.invalidate_cache(events)
+
+        found = False
+        callbacks = []
+        for sub_id in sub_ids:
+            if sub_id not in self.cb_methods:
+                continue
+            found = True
             cb = self.cb_methods[sub_id]
-            if cb is None:
-                print("Callback method was set to None. Ignoring data!")
-                return
-            print("Found matching callback method. Forwarding data to that...")
-            cb(opcode, data)
-        else:
+            if cb is not None and cb not in callbacks:
+                callbacks.append(cb)
+
+        if not found:
             # Callback method not found, default
             print("No matching CB method. Using default:")
             print("Callback WS-{0}: {1}".format(opcode, data))
+        elif not callbacks:
+            print("Callback method was set to None. Ignoring data!")
+        for cb in callbacks:
+            cb(opcode, events)
+
+    def invalidate_cache(self, events):
+        """
+        Remove cached responses affected by the objects in subscription data.
+        :param events:      Events decoded from the subscription data
+        :return:
+        """
+        if self.cache is None:
+            return
+        for event in events:
+            self.cache.invalidate(event.dn, event.cls)
 
     def disconnect(self):
         if self.verbose:
             print("Disconnecting...")
-        self.subscriber.disconnect()
+        self.tokens.stop()
+        if self.subscriber is not None:
+            self.subscriber.disconnect()
         self.connected = False
 
     def resume_session(self):
         """
-        If AC-PKI has recently been logged in, this method will resume the session by loading the current cookies from
-        file. Otherwise, it will authenticate and create a new session.
+        If AC-PKI has recently been logged in, this method will resume the session by loading the token state from
+        file. A token that is known to be fresh is used without validating it with the APIC, and a token that is about
+        to expire is refreshed.
         :return:    True if successful, False otherwise
         """
-        # Load cookies
-        if self.cookie_file and os.path.exists(self.cookie_file):
-            # Load cookies from file
-            session = requests.session()
-            with open(self.cookie_file, "rb") as f:
-                session.cookies.update(pickle.load(f))
-
-            self.session = session
-        else:
+        if not self.tokens.load():
             # Abort session resumption
             return False
 
-        # Load token
-        if self.token_file and os.path.exists(self.token_file):
-            with open(self.token_file, "r") as f:
-                self.token = f.readline()
+        self.session.reset()
+        self.tokens.apply(self.session.cookies)
+        if self.tokens.is_fresh():
+            self.connected = True
+        elif self.tokens.is_valid():
+            self.connected = self.tokens.refresh()
         else:
-            # Abort session resumption
-            return False
-
-        return self.check_connection()
+            self.connected = False
+        return self.connected
 
     def authenticate(self):
         """
@@ -144,47 +183,83 @@ class ACISession:
         optional session resumption.
         :return:
         """
-        # Prepare and send auth request
-        self.session = requests.Session()
-        login = {"aaaUser":{"attributes": {"name": self.username, "pwd": self.password}}}
-        path = self.get_method_url("aaaLogin")
-        resp = self.session.post(path, json=login, verify=False)
+        resp = self.login()
 
         # Verify response from APIC
-        if self.verbose and resp.ok:
-            print("Successfully logged in.")
-        else:
+        if not resp.ok:
             print("Error: {0} {1}".format(resp.status_code, resp.reason))
             print("Authentication with the Cisco APIC failed. Terminating...")
             sys.exit(1)
+        elif self.verbose:
+            print("Successfully logged in.")
+        return resp
 
-        # Save cookie
-        if self.cookie_file:
-            try:
-                with open(self.cookie_file, "wb") as f:
-                    pickle.dump(self.session.cookies, f)
-            except IOError:
-                print("Could not save session. Continuing without persistency...")
-
-        # Save token
-        self.token = self.extract_token(resp)
-        if self.token_file:
-            try:
-                with open(self.token_file, "w") as f:
-                    f.write(self.token)
-                    print("Token saved in file.")
-            except IOError as e:
-                raise SystemError("Could not save token to file: {}".format(e))
+    def login(self):
+        """
+        Log in with aaaLogin and update the token state, keeping the open connections of the transport.
+        :return:    A requests response object
+        """
+        self.session.reset()
+        login = {"aaaUser":{"attributes": {"name": self.username, "pwd": self.password}}}
+        path = self.get_method_url("aaaLogin")
+        resp = self.session.post(path, endpoint="aaaLogin", priority=RateLimiter.PRIORITY_REFRESH, json=login)
+        if resp.ok:
+            self.tokens.update(resp, login=True)
+            self.connected = True
+        return resp
+
+    def renew_token(self, token):
+        """
+        Log in again after a request with the given token was refused, unless the token has already been renewed since,
+        e.g. by another request that was refused at the same time.
+        :param token:   The token the refused request was sent with
+        :return:        True if a new token is available, False otherwise
+        """
+        if self.token != token:
+            return True
+        return self.relogin().ok
 
+    def relogin(self):
+        """
+        Log in again after the token was invalidated or could not be refreshed. The WebSocket and the subscriptions
+        belong to the old token, so they are created again in the background once the login has succeeded.
+        :return:    A requests response object
+        """
+        resp = self.login()
+        if resp.ok and self.subscriber is not None and self.subscriber.connected:
+            thread.start_new_thread(self.resubscribe, ())
         return resp
 
+    def resubscribe(self):
+        """
+        Reconnect the WebSocket with the current token and create the subscriptions again. If resubscribe_cb is set it
+        is called to create them, e.g. by reloading the information that was subscribed to, as changes made while the
+        subscriptions were lost are not sent. Otherwise the subscribing queries are sent again.
+        :return:
+        """
+        subscriptions = self.subscriber.reconnect()
+        self.cb_methods = {}
+        try:
+            if self.resubscribe_cb is not None:
+                self.resubscribe_cb()
+                return
+            for sub in subscriptions:
+                resp = self.get(sub.method, silent=True, subscribe=True, sub_cb=sub.callback, params=sub.params or {})
+                resp.close()
+                if not resp.ok:
+                    print("Could not subscribe to {0} again. Status: {1} {2}"
+                          .format(sub.method, resp.status_code, resp.reason))
+        except Exception as e:
+            print("Could not create the subscriptions again: {}".format(e))
+
     def check_connection(self):
         """
         Checks whether the class is successfully connected with the APIC and sets the self.connected parameter
         accordingly.
         :return:    Current connection status (True or False)
         """
-        resp = self.get("mo/uni/tn-common", silent=True)  # Get common tenant (which should always exist in Cisco ACI)
+        # Get common tenant (which should always exist in Cisco ACI), bypassing the cache to reach the APIC
+        resp = self.get("mo/uni/tn-common", silent=True, cached=False)
         self.connected = resp.ok is True
         if self.verbose:
             print("Connection status: {0} {1}".format(resp.status_code, resp.reason))
@@ -193,7 +268,8 @@ class ACISession:
     def get_cookies(self):
         return self.session.cookies
 
-    def get(self, method, file_format=None, silent=False, subscribe=False, sub_cb=None, params={}):
+    def get(self, method, file_format=None, silent=False, subscribe=False, sub_cb=None, params={}, stream=False,
+            cached=True, priority=RateLimiter.PRIORITY_INTERACTIVE):
         """
         Get method that adds the necessary parameters and URL.
         :param method:          ACI method name, i.e. what is following apic-url/api/, excluding .json and .xml
@@ -203,6 +279,12 @@ class ACISession:
         :param sub_cb:          Callback method to which subscription data will be sent
         :param params:          Dictionary of GET parameters to add to URL, excluding "subscription" which is enabled by
                                 setting the "subscribe" attribute (above)
+        :param stream:          Do not download the response body until it is read, e.g. with resp.iter_content(). A
+                                subscription is then not registered until add_subscription() is called with the
+                                subscriptionId of the response.
+        :param cached:          Serve the response from the cache if possible. Subscriptions and streamed responses
+                                are never cached.
+        :param priority:        Priority of the request for the rate limiter, e.g. RateLimiter.PRIORITY_BULK
         :return:                A requests response object
         """
         # Get file format
@@ -212,6 +294,7 @@ class ACISession:
             path = self.get_method_url(method, file_format)
 
         # Add GET parameters to path
+        params = dict(params)
         if subscribe:
             params["subscription"] = "yes"
 
@@ -219,34 +302,150 @@ class ACISession:
             path += "?" if i == 0 else "&"
             path += key + "=" + params[key]
 
-        # Check current session and subscription
-        if self.session is None:
-            raise SessionError("Cannot send GET request without a session!")
-
+        # Check subscription
         if subscribe and self.subscriber is None:
             raise SubscriptionError("Could not subscribe as no Subscriber was found for session")
         elif subscribe and not self.subscriber.connected:
             raise SubscriptionError("Could not subscribe as Subscriber was disconnected.")
 
+        # Serve response from cache
+        use_cache = (cached and self.cache is not None and not subscribe and not stream and
+                     ResponseCache.is_cacheable(method))
+        if use_cache:
+            key = ResponseCache.make_key(method, file_format, params, (self.username, self.apic_base_url))
+            resp = self.cache.get(key)
+            if resp is not None:
+                if self.verbose and not silent:
+                    print("GET {0} (cached)".format(path))
+                return resp
+
+        # Send request, sharing the response with identical requests in flight. Subscriptions are not shared, as each
+        # subscription is registered with its own callback, and neither are streamed responses that can only be read
+        # once. Subscriptions are not retried either, as the APIC may have created a subscription for a request whose
+        # response was lost.
+        endpoint = self.get_endpoint_name(method)
+        shared = not subscribe and not stream
+        retry = False if subscribe else None
+        token = self.token
+        resp = self.send_get(path, endpoint, priority, shared, stream, retry)
+
+        # The token may have been invalidated by the APIC, e.g. if a session was resumed without validating the token
+        if resp.status_code == 403 and token is not None:
+            resp.close()
+            if self.single_flight.do("aaaLogin", self.renew_token, token):
+                resp = self.send_get(path, endpoint, priority, shared, stream, retry)
+
         # Analyse and print response (if verbose mode)
-        resp = self.session.get(path, verify=self.verify)
         if self.verbose and not silent:
             print("GET {0}".format(path))
             print("Reponse: {0} {1}".format(resp.status_code, resp.reason))
 
+        if use_cache and resp.ok:
+            self.cache.put(key, resp)
+
         # Create subscription
-        if subscribe and resp.ok:
-            if self.verbose:
-                print("Creating new subscription")
+        if subscribe and resp.ok and not stream:
             json_resp = json.loads(resp.content)
+            self.add_subscription(json_resp["subscriptionId"], method, sub_cb, params)
+
+        return resp
 
-            # Subscribe and save reference to subscription callback
-            sub = self.subscriber.subscribe(json_resp["subscriptionId"], method, callback=sub_cb)
-            self.cb_methods[sub.sub_id] = sub.callback
+    def add_subscription(self, sub_id, method, sub_cb=None, params=None):
+        """
+        Register a subscription created by a GET request, so that its data is sent to its callback and it is refreshed.
+        :param sub_id:          Subscription ID from the response
+        :param method:          ACI method of the request
+        :param sub_cb:          Callback method to which subscription data will be sent
+        :param params:          GET parameters of the request, used to subscribe again after logging in again
+        :return:                The Subscription
+        """
+        if self.verbose:
+            print("Creating new subscription")
 
+        # Subscribe and save reference to subscription callback
+        sub = self.subscriber.subscribe(sub_id, method, callback=sub_cb, params=params)
+        self.cb_methods[sub.sub_id] = sub.callback
+        return sub
+
+    def send_get(self, path, endpoint, priority, shared, stream, retry=None):
+        if shared:
+            return self.single_flight.do(path, self.fetch, path, endpoint, priority)
+        return self.session.get(path, endpoint=endpoint, retry=retry, priority=priority, stream=stream)
+
+    def fetch(self, path, endpoint, priority):
+        resp = self.session.get(path, endpoint=endpoint, priority=priority)
+        resp.content  # Read the body before the response is shared between threads
         return resp
 
-    def post(self, method, jsn):
+    def run_once(self, key, method, *args, **kwargs):
+        """
+        Merge repeated requests for the same operation, e.g. a full reload of EPGs and contracts. The method is run at
+        least once after this call was made, but callers that arrive while a run is pending share that run.
+        :param key:         Key identifying the operation
+        :param method:      The method to run
+        :param args:        Positional arguments for the method
+        :param kwargs:      Keyword arguments for the method
+        :return:            The result of the method
+        """
+        return self.single_flight.do_fresh(key, method, *args, **kwargs)
+
+    def iter_query(self, method, params=None, page_size=None, subscribe=False, sub_cb=None, silent=True,
+                   priority=RateLimiter.PRIORITY_BULK):
+        """
+        Query the APIC one page at a time and yield the objects in the imdata of each page as they are received. Pages
+        are parsed incrementally, so memory use does not depend on the size of the result. Unless the parameters order
+        the result, it is ordered by DN, so that objects are neither skipped nor repeated between pages.
+        :param method:          ACI method name, i.e. what is following apic-url/api/, excluding .json and .xml
+        :param params:          Dictionary of GET parameters, excluding "page" and "page-size"
+        :param page_size:       Number of objects per page (Default: As defined in the configuration)
+        :param subscribe:       Subscribe to updates in the information queried. The subscription is created with the
+                                first page and covers the whole query.
+        :param sub_cb:          Callback method to which subscription data will be sent
+        :param silent:          Packets will be sent silently, overriding self.verbose
+        :param priority:        Priority of the requests for the rate limiter
+        :return:                Generator of imdata objects, e.g. {"fvAEPg": {"attributes": {...}}}
+        """
+        if page_size is None:
+            page_size = CONFIG["apic"]["page-size"]
+        params = dict(params or {})
+        order = self.get_order(method, params)
+        if order is not None:
+            params.setdefault("order-by", order)
+
+        page = 0
+        while True:
+            params["page"] = str(page)
+            params["page-size"] = str(page_size)
+            subscribing = subscribe and page == 0
+            resp = self.get(method, "json", silent=silent, subscribe=subscribing, params=params, stream=True,
+                            priority=priority)
+            if not resp.ok:
+                resp.close()
+                raise RequestError("Could not get page {0} of {1} from the APIC. ({2} {3})"
+                                   .format(page, method, resp.status_code, resp.reason))
+
+            # The subscription is registered as soon as its ID has been read, before the objects of the page
+            subscriptions = []
+
+            def fields_cb(fields):
+                if subscribing and not subscriptions and "subscriptionId" in fields:
+                    subscriptions.append(self.add_subscription(fields["subscriptionId"], method, sub_cb, params))
+
+            count = 0
+            try:
+                for item in iter_imdata(resp.iter_content(chunk_size=65536), fields_cb):
+                    count += 1
+                    yield item
+            finally:
+                resp.close()
+            if subscribing and not subscriptions:
+                raise SubscriptionError("No subscription ID in the response from {0}.".format(method))
+
+            if count < page_size:
+                return
+            page += 1
+
+    def post(self, method, jsn, priority=RateLimiter.PRIORITY_INTERACTIVE):
         url = self.get_method_url(method, "json")  # JSON is only supported file_format for POST requests
 
         headers = {
@@ -254,10 +453,60 @@ class ACISession:
             'cache-control': "no-cache"
         }
 
-        response = self.session.request("POST", url, data=jsn, headers=headers, verify=self.verify)
+        response = self.session.post(url, endpoint=self.get_endpoint_name(method), priority=priority, data=jsn,
+                                     headers=headers)
+        if self.cache is not None:
+            self.cache.invalidate(ResponseCache.get_dn(method))
         return response
 
+    def get_stats(self):
+        """
+        Get latency statistics for each APIC endpoint used in this session.
+        :return:    Dictionary of {endpoint: statistics}
+        """
+        return self.session.get_stats()
+
+    def get_coalescing_stats(self):
+        """
+        Get the number of requests that were executed and the number that were coalesced with an identical request.
+        :return:    Dictionary of statistics
+        """
+        return self.single_flight.get_stats()
+
+    def get_rate_limit_stats(self):
+        """
+        Get statistics for the rate limiter, including queued and rejected requests per priority.
+        :return:    Dictionary of statistics, or None if rate limiting is disabled
+        """
+        if self.limiter is None:
+            return None
+        return self.limiter.get_stats()
+
     @staticmethod
-    def extract_token(response):
-        content = json.loads(response.content)
-        return content["imdata"][0]["aaaLogin"]["attributes"]["token"]
+    def get_order(method, params):
+        """
+        Get a stable order for a paged query, by DN of the classes queried.
+        :param method:      ACI method name
+        :param params:      Dictionary of GET parameters
+        :return:            Value of the order-by parameter, e.g. fvAEPg.dn|asc, or None if the class is not known
+        """
+        classes = params.get("target-subtree-class")
+        if classes is None:
+            classes = ResponseCache.get_class(method)
+        if not classes:
+            return None
+        return ",".join("{0}.dn|asc".format(cls) for cls in classes.split(","))
+
+    @staticmethod
+    def get_endpoint_name(method):
+        """
+        Get the name under which statistics are recorded for an ACI method. Queries for managed objects are grouped
+        together, as there is one method per DN.
+        :param method:      ACI method name, e.g. node/mo/uni/tn-common or subscriptionRefresh
+        :return:            Endpoint name, e.g. mo or subscriptionRefresh
+        """
+        if method.startswith("node/"):
+            method = method[5:]
+        if method.startswith("mo/"):
+            return "mo"
+        return method
@@ -0,0 +1,66 @@
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+from acpki.util.exceptions import IllegalStateError
+
+
+class QueryExecutor:
+    """
+    Runs APIC queries concurrently on a bounded pool of threads, so that independent queries do not have to wait for
+    each other. The number of queries in flight never exceeds the concurrency limit.
+    """
+    def __init__(self, max_concurrency=8):
+        """
+        :param max_concurrency:     Maximum number of queries running at the same time
+        """
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.pool = None
+        self.closed = False
+        self.lock = Lock()
+
+    def submit(self, method, *args, **kwargs):
+        """
+        Run a method in the pool.
+        :param method:      The method to run, e.g. ACISession.get
+        :param args:        Positional arguments for the method
+        :param kwargs:      Keyword arguments for the method
+        :return:            AsyncResult, call get() to wait for the result
+        """
+        with self.lock:
+            if self.closed:
+                raise IllegalStateError("Cannot run a method in a closed QueryExecutor.")
+            if self.pool is None:
+                self.pool = ThreadPool(self.max_concurrency)
+            return self.pool.apply_async(method, args, kwargs)
+
+    def run(self, calls):
+        """
+        Run several methods concurrently and wait for all of them to finish.
+        :param calls:       List of (method, args, kwargs) tuples
+        :return:            List of results in the same order as the calls. If a method raised an exception, the first
+                            such exception is raised after all methods have finished.
+        """
+        results = [self.submit(method, *args, **kwargs) for method, args, kwargs in calls]
+        for result in results:
+            result.wait()
+        return [result.get() for result in results]
+
+    def map(self, method, items):
+        """
+        Run a method concurrently for each item.
+        :param method:      The method to run, taking one item as argument
+        :param items:       The items
+        :return:            List of results in the same order as the items
+        """
+        return self.run([(method, (item,), {}) for item in items])
+
+    def close(self):
+        """
+        Wait for the methods running in the pool to finish and stop its threads. No more methods can be run afterwards.
+        :return:
+        """
+        with self.lock:
+            self.closed = True
+            pool, self.pool = self.pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
@@ -0,0 +1,147 @@
+import time
+from threading import Condition
+from acpki.util.exceptions import RateLimitError
+
+
+class RateLimiter:
+    """
+    Client-side limiter for requests to the APIC, which throttles API clients under load. Requests are limited both by a
+    token bucket (requests per second) and by an adaptive limit on the number of requests in flight, which is increased
+    additively while requests succeed and decreased multiplicatively when the APIC responds with 429 or 503 (AIMD).
+    Waiting requests are admitted by priority, so that subscription refreshes and interactive queries are not stuck
+    behind bulk reloads. One RateLimiter may be used from several threads at once.
+    """
+    PRIORITY_REFRESH = 0
+    PRIORITY_INTERACTIVE = 1
+    PRIORITY_BULK = 2
+    priority_names = ("refresh", "interactive", "bulk")
+
+    def __init__(self, rate=20, burst=40, min_limit=1, max_limit=10, decrease=0.5, max_queue=100, max_wait=10):
+        """
+        :param rate:        Requests per second allowed by the token bucket, 0 or None disables the token bucket
+        :param burst:       Maximum number of requests that can be sent at once after a quiet period
+        :param min_limit:   Lowest limit of requests in flight
+        :param max_limit:   Highest limit of requests in flight, and the initial limit
+        :param decrease:    Factor the limit of requests in flight is multiplied with when the APIC throttles a request
+        :param max_queue:   Maximum number of waiting requests, further requests are rejected. Refreshes are never
+                            rejected because the queue is full.
+        :param max_wait:    Seconds a request may wait before it is rejected
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.decrease = decrease
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self.cond = Condition()
+        self.tokens = float(self.burst)
+        self.updated = time.time()
+        self.limit = float(self.max_limit)
+        self.in_flight = 0
+        self.paused_until = 0
+        self.waiting = [0] * len(self.priority_names)
+
+        # Statistics
+        self.queued = [0] * len(self.priority_names)
+        self.rejected = [0] * len(self.priority_names)
+        self.throttled = 0
+
+    def acquire(self, priority=PRIORITY_INTERACTIVE, timeout=None):
+        """
+        Wait until a request may be sent. Every successful call must be followed by a call to release().
+        :param priority:    Priority of the request, e.g. RateLimiter.PRIORITY_BULK
+        :param timeout:     Seconds to wait before the request is rejected (Default: max_wait)
+        :return:
+        """
+        deadline = time.time() + (self.max_wait if timeout is None else timeout)
+        with self.cond:
+            if priority != self.PRIORITY_REFRESH and sum(self.waiting) >= self.max_queue:
+                self.rejected[priority] += 1
+                raise RateLimitError("Request rejected as {0} requests to the APIC are already waiting."
+                                     .format(sum(self.waiting)))
+
+            self.waiting[priority] += 1
+            queued = False
+            try:
+                while True:
+                    now = time.time()
+                    self.refill(now)
+                    wait = self.get_wait(priority, now)
+                    if wait == 0:
+                        if self.rate:
+                            self.tokens -= 1
+                        self.in_flight += 1
+                        return
+
+                    if not queued:
+                        queued = True
+                        self.queued[priority] += 1
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self.rejected[priority] += 1
+                        raise RateLimitError("Request rejected after waiting {0} seconds for the APIC rate limit."
+                                             .format(self.max_wait if timeout is None else timeout))
+                    self.cond.wait(remaining if wait is None else min(wait, remaining))
+            finally:
+                self.waiting[priority] -= 1
+                self.cond.notify_all()
+
+    def release(self, throttled=False, retry_after=None, succeeded=True):
+        """
+        Release a request acquired with acquire() and adapt the limit to its outcome.
+        :param throttled:       The APIC throttled the request, i.e. responded with 429 or 503
+        :param retry_after:     Seconds to wait before any request is sent, as given by the Retry-After header
+        :param succeeded:       The request succeeded. Failures that were not throttling leave the limit unchanged.
+        :return:
+        """
+        with self.cond:
+            self.in_flight -= 1
+            if throttled:
+                self.throttled += 1
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+                if retry_after:
+                    self.paused_until = max(self.paused_until, time.time() + retry_after)
+            elif succeeded:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self.cond.notify_all()
+
+    def refill(self, now):
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def get_wait(self, priority, now):
+        """
+        Get the time a request must wait before it may be sent. Must be called while holding the lock.
+        :param priority:    Priority of the request
+        :param now:         Current time
+        :return:            0 if the request may be sent now, the number of seconds to wait, or None to wait until
+                            another request is released
+        """
+        if now < self.paused_until:
+            return self.paused_until - now
+        if any(self.waiting[:priority]):
+            return None  # Requests with higher priority go first
+        if self.in_flight >= int(self.limit):
+            return None
+        if self.rate and self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        return 0
+
+    def get_stats(self):
+        """
+        Get statistics for the limiter, including the number of queued and rejected requests per priority.
+        :return:    Dictionary of statistics
+        """
+        with self.cond:
+            return {
+                "limit": int(self.limit),
+                "in-flight": self.in_flight,
+                "paused": max(0.0, self.paused_until - time.time()),
+                "throttled": self.throttled,
+                "waiting": dict(zip(self.priority_names, self.waiting)),
+                "queued": dict(zip(self.priority_names, self.queued)),
+                "rejected": dict(zip(self.priority_names, self.rejected)),
+            }
@@ -0,0 +1,278 @@
+import time, random, heapq, itertools
+from threading import Thread, Condition, current_thread
+from acpki.aci import QueryExecutor
+from acpki.util.exceptions import SubscriptionError
+
+
+class RefreshScheduler:
+    """
+    Refreshes subscriptions before they expire. Each subscription has its own expiry, and refreshes are scheduled from
+    a heap ordered by due time, so that the subscriptions closest to expiring are refreshed first. Refreshes run
+    concurrently on a bounded pool of workers, and random jitter spreads out subscriptions that were created together.
+    The scheduler thread sleeps until the next refresh is due instead of polling.
+    """
+    retry_interval = 5  # Maximum seconds before a failed refresh is retried
+
+    def __init__(self, refresh_cb, timeout=60, interval=45, workers=4, jitter=5, keepalive_cb=None,
+                 keepalive_interval=None, max_failures=3, dropped_cb=None, start=True):
+        """
+        :param refresh_cb:          Method that refreshes a subscription, called with the subscription and returning
+                                    True if successful
+        :param timeout:             Seconds a subscription lives after it was created or refreshed
+        :param interval:            Seconds from a subscription was created or refreshed until it is refreshed
+        :param workers:             Maximum number of refreshes running at the same time
+        :param jitter:              Maximum random number of seconds a refresh is moved earlier
+        :param keepalive_cb:        Method called every keepalive_interval, e.g. to ping the WebSocket
+        :param keepalive_interval:  Seconds between calls to keepalive_cb (Default: interval)
+        :param max_failures:        Failed refreshes in a row before a subscription is dropped
+        :param dropped_cb:          Method called with the subscription and a SubscriptionError when a subscription is
+                                    dropped, because it expired or could not be refreshed
+        :param start:               Whether to start the scheduler upon creation
+        """
+        self.refresh_cb = refresh_cb
+        self.timeout = timeout
+        self.interval = min(interval, timeout)
+        self.workers = max(1, int(workers))
+        self.jitter = jitter
+        self.keepalive_cb = keepalive_cb
+        self.keepalive_interval = keepalive_interval or interval
+        self.max_failures = max_failures
+        self.dropped_cb = dropped_cb
+
+        self.cond = Condition()
+        self.heap = []          # (due time, sequence number, subscription ID)
+        self.entries = {}       # Subscription ID -> ScheduleEntry
+        self.counter = itertools.count()
+        self.in_flight = 0
+        self.running = False
+        self.next_keepalive = time.time() + self.keepalive_interval
+        self.executor = QueryExecutor(self.workers)
+        self.thread = None
+
+        # Statistics
+        self.refreshed = 0
+        self.failed = 0
+        self.missed = 0
+        self.expired = 0
+        self.dropped = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = 0.0
+
+        if start:
+            self.start()
+
+    def start(self):
+        with self.cond:
+            if self.running:
+                return
+            self.running = True
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the scheduler and wait for the refreshes in flight to finish.
+        :return:
+        """
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        # The scheduler thread may be about to submit a refresh, so it must finish before the executor is closed
+        if self.thread is not None and self.thread is not current_thread():
+            self.thread.join()
+        self.executor.close()
+
+    def add(self, subscription):
+        """
+        Schedule refreshes of a subscription that was just created.
+        :param subscription:    The Subscription
+        :return:
+        """
+        entry = ScheduleEntry(subscription, time.time() + self.timeout)
+        with self.cond:
+            self.entries[subscription.sub_id] = entry
+            self.schedule(entry, self.get_due(entry.expires))
+
+    def remove(self, subscription):
+        with self.cond:
+            self.entries.pop(subscription.sub_id, None)  # Its heap items are skipped when they come up
+
+    def clear(self):
+        with self.cond:
+            self.entries.clear()
+            self.heap = []
+
+    def refresh_all(self):
+        """
+        Refresh all subscriptions as soon as possible, in order of expiry.
+        :return:
+        """
+        with self.cond:
+            now = time.time()
+            for entry in self.entries.itervalues():
+                if not entry.in_flight:
+                    self.schedule(entry, now)
+
+    def get_due(self, expires):
+        return expires - (self.timeout - self.interval) - random.uniform(0, self.jitter)
+
+    def schedule(self, entry, due):
+        # Must be called while holding the lock. Earlier heap items of the entry become stale.
+        entry.due = due
+        heapq.heappush(self.heap, (due, next(self.counter), entry.subscription.sub_id))
+        self.cond.notify_all()
+
+    def run(self):
+        while True:
+            with self.cond:
+                entry = None
+                while self.running:
+                    now = time.time()
+                    if now >= self.next_keepalive:
+                        break
+                    entry = self.pop_due(now)
+                    if entry is not None:
+                        break
+                    self.cond.wait(self.get_wait(now))
+                if not self.running:
+                    return
+
+                if entry is not None:
+                    entry.in_flight = True
+                    self.in_flight += 1
+
+            if entry is None:
+                self.keepalive()
+            else:
+                self.executor.submit(self.refresh, entry)
+
+    def pop_due(self, now):
+        """
+        Get the next subscription that is due for a refresh, if a worker is free. Must be called while holding the lock.
+        :return:    The ScheduleEntry, or None
+        """
+        if self.in_flight >= self.workers:
+            return None
+        while self.heap:
+            due, _, sub_id = self.heap[0]
+            entry = self.entries.get(sub_id)
+            if entry is None or entry.in_flight or entry.due != due:
+                heapq.heappop(self.heap)  # Stale item
+                continue
+            if due > now:
+                return None
+            heapq.heappop(self.heap)
+            return entry
+        return None
+
+    def get_wait(self, now):
+        wait = self.next_keepalive - now
+        if self.heap and self.in_flight < self.workers:
+            wait = min(wait, self.heap[0][0] - now)
+        return max(0.01, wait)
+
+    def keepalive(self):
+        self.next_keepalive = time.time() + self.keepalive_interval
+        if self.keepalive_cb is None:
+            return
+        try:
+            self.keepalive_cb()
+        except Exception as e:
+            print("Keepalive failed: {}".format(e))
+
+    def refresh(self, entry):
+        start = time.time()
+        try:
+            ok = self.refresh_cb(entry.subscription)
+        except Exception as e:
+            print("Could not refresh subscription {0}: {1}".format(entry.subscription.sub_id, e))
+            ok = False
+        end = time.time()
+        self.complete(entry, ok, start, end)
+
+    def complete(self, entry, ok, start, end):
+        error = None
+        with self.cond:
+            self.in_flight -= 1
+            entry.in_flight = False
+            latency = end - start
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self.last_latency = latency
+
+            missed = end > entry.expires
+            if missed:
+                self.missed += 1
+                print("Subscription {0} was not refreshed before its deadline.".format(entry.subscription.sub_id))
+
+            if self.entries.get(entry.subscription.sub_id) is not entry:
+                self.cond.notify_all()
+                return  # Removed while refreshing
+
+            if ok:
+                self.refreshed += 1
+                entry.failures = 0
+                entry.expires = start + self.timeout
+                self.schedule(entry, self.get_due(entry.expires))
+            else:
+                self.failed += 1
+                entry.failures += 1
+                if missed:
+                    # The subscription has expired on the APIC and can no longer be refreshed
+                    self.expired += 1
+                    error = SubscriptionError("Subscription {0} expired before it was refreshed."
+                                              .format(entry.subscription.sub_id))
+                elif entry.failures >= self.max_failures:
+                    error = SubscriptionError("Failed to refresh subscription {0} {1} times in a row."
+                                              .format(entry.subscription.sub_id, entry.failures))
+                else:
+                    remaining = entry.expires - end
+                    self.schedule(entry, end + min(self.retry_interval * entry.failures, remaining / 2))
+
+                if error is not None:
+                    self.dropped += 1
+                    entry.subscription.active = False
+                    del self.entries[entry.subscription.sub_id]
+                    self.cond.notify_all()
+
+        if error is not None:
+            print(error.value)
+            if self.dropped_cb is not None:
+                try:
+                    self.dropped_cb(entry.subscription, error)
+                except Exception as e:
+                    print("Dropped subscription callback failed: {}".format(e))
+
+    def get_stats(self):
+        """
+        Get statistics for the scheduler, including refresh latency and missed deadlines.
+        :return:    Dictionary of statistics
+        """
+        with self.cond:
+            completed = self.refreshed + self.failed
+            now = time.time()
+            next_due = min([e.due for e in self.entries.itervalues() if not e.in_flight] or [None])
+            return {
+                "subscriptions": len(self.entries),
+                "in-flight": self.in_flight,
+                "refreshed": self.refreshed,
+                "failed": self.failed,
+                "missed-deadlines": self.missed,
+                "expired": self.expired,
+                "dropped": self.dropped,
+                "avg-latency": self.total_latency / completed if completed else 0.0,
+                "max-latency": self.max_latency,
+                "last-latency": self.last_latency,
+                "next-due": max(0.0, next_due - now) if next_due is not None else None,
+            }
+
+
+class ScheduleEntry:
+    def __init__(self, subscription, expires):
+        self.subscription = subscription
+        self.expires = expires
+        self.due = None
+        self.in_flight = False
+        self.failures = 0
@@ -0,0 +1,145 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class ResponseCache:
+    """
+    LRU cache of APIC responses with a time to live (TTL). Responses are keyed by ACI method, GET parameters and the
+    identity of the session, and entries are invalidated when a subscription event or POST request concerns the DN or
+    class that was queried.
+    """
+    def __init__(self, max_size=256, ttl=30):
+        """
+        :param max_size:    Maximum number of cached responses, the least recently used response is evicted first
+        :param ttl:         Seconds a response is kept in the cache
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # Key -> CacheEntry
+        self.lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(method, file_format, params, identity=None):
+        """
+        :param method:          ACI method name
+        :param file_format:     Format of the response, e.g. "json"
+        :param params:          Dictionary of GET parameters
+        :param identity:        Identity of the session, e.g. the user and APIC, as responses depend on the user's
+                                access rights
+        :return:                Cache key
+        """
+        return method, file_format, tuple(sorted(params.items())), identity
+
+    @staticmethod
+    def is_cacheable(method):
+        """
+        Only queries for managed objects and classes are cached, not e.g. aaaLogin or subscriptionRefresh.
+        :param method:      ACI method name
+        :return:            True if responses for the method may be cached
+        """
+        return ResponseCache.get_dn(method) is not None or ResponseCache.get_class(method) is not None
+
+    @staticmethod
+    def get_dn(method):
+        """
+        Get the DN queried by an ACI method, e.g. uni/tn-common for node/mo/uni/tn-common.
+        :param method:      ACI method name
+        :return:            The DN, or None if the method is not a managed object query
+        """
+        if method.startswith("node/"):
+            method = method[5:]
+        if method.startswith("mo/"):
+            return method[3:]
+        return None
+
+    @staticmethod
+    def get_class(method):
+        """
+        Get the class queried by an ACI method, e.g. fvAEPg for node/class/fvAEPg.
+        :param method:      ACI method name
+        :return:            The class, or None if the method is not a class query
+        """
+        if method.startswith("node/"):
+            method = method[5:]
+        if method.startswith("class/"):
+            return method[6:]
+        return None
+
+    def get(self, key):
+        """
+        Get a cached response.
+        :param key:     Key from make_key()
+        :return:        The response, or None if it is not cached or has expired
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry.expires < time.time():
+                self.misses += 1
+                return None
+            self.entries[key] = entry  # Reinsert as most recently used
+            self.hits += 1
+            return entry.response
+
+    def put(self, key, response):
+        """
+        Cache a response. The response body is read before it is cached.
+        :param key:         Key from make_key()
+        :param response:    A successful requests response object
+        :return:
+        """
+        method = key[0]
+        response.content  # Ensure that the body is read, so that the response can be shared
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = CacheEntry(response, time.time() + self.ttl, self.get_dn(method),
+                                           self.get_class(method))
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, dn=None, cls=None):
+        """
+        Remove cached responses affected by a change to an object. Queries for the object itself, its ancestors (which
+        may include it as a child) and its descendants are removed, as well as queries for its class.
+        :param dn:      DN of the changed object
+        :param cls:     Class of the changed object
+        :return:        Number of removed responses
+        """
+        with self.lock:
+            keys = [key for key, entry in self.entries.iteritems() if entry.affected_by(dn, cls)]
+            for key in keys:
+                del self.entries[key]
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
+
+
+class CacheEntry:
+    def __init__(self, response, expires, dn, cls):
+        self.response = response
+        self.expires = expires
+        self.dn = dn
+        self.cls = cls
+
+    def affected_by(self, dn, cls):
+        if cls is not None and self.cls == cls:
+            return True
+        if dn is None or self.dn is None:
+            return False
+        return self.dn == dn or dn.startswith(self.dn + "/") or self.dn.startswith(dn + "/")
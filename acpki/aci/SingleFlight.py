@@ -0,0 +1,120 @@
+from threading import Lock, Event
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls, so that only one of them is executed and the others share its result. This is
+    used to avoid sending the same request to the APIC several times at once, e.g. when many subscription events arrive
+    together.
+    """
+    def __init__(self):
+        self.calls = {}     # Key -> Call in flight
+        self.fresh = {}     # Key -> [running Call, pending Call]
+        self.lock = Lock()
+
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, method, *args, **kwargs):
+        """
+        Execute the method, unless an identical call is already in flight, in which case its result is shared.
+        :param key:         Key identifying identical calls, e.g. the request URL
+        :param method:      The method to execute
+        :param args:        Positional arguments for the method
+        :param kwargs:      Keyword arguments for the method
+        :return:            The result of the method. Exceptions are raised to all callers sharing the call.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self.calls[key] = Call()
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            return call.wait()
+
+        try:
+            call.run(method, args, kwargs)
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+        return call.wait()
+
+    def do_fresh(self, key, method, *args, **kwargs):
+        """
+        Execute the method at least once after this call was made, merging concurrent requests. If a call is running,
+        one more call is queued to run after it, and any further requests share the queued call. This is used for full
+        reloads, where a reload that started before the request may have missed the change that caused it.
+        :param key:         Key identifying identical calls
+        :param method:      The method to execute
+        :param args:        Positional arguments for the method
+        :param kwargs:      Keyword arguments for the method
+        :return:            The result of the method
+        """
+        with self.lock:
+            state = self.fresh.get(key)
+            if state is None:
+                state = self.fresh[key] = [None, None]
+
+            previous = None
+            if state[0] is None:
+                call = state[0] = Call()
+                leader = True
+            elif state[1] is None:
+                previous = state[0]
+                call = state[1] = Call()
+                leader = True
+            else:
+                call = state[1]
+                leader = False
+                self.coalesced += 1
+            if leader:
+                self.executed += 1
+
+        if not leader:
+            return call.wait()
+
+        if previous is not None:
+            previous.event.wait()  # The previous call promotes this call when it finishes
+
+        try:
+            call.run(method, args, kwargs)
+        finally:
+            with self.lock:
+                state[0], state[1] = state[1], None
+                if state[0] is None:
+                    del self.fresh[key]
+            call.event.set()
+        return call.wait()
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "executed": self.executed,
+                "coalesced": self.coalesced,
+                "in-flight": len(self.calls) + len(self.fresh),
+            }
+
+
+class Call:
+    def __init__(self):
+        self.event = Event()
+        self.result = None
+        self.error = None
+
+    def run(self, method, args, kwargs):
+        try:
+            self.result = method(*args, **kwargs)
+        except Exception as e:
+            self.error = e
+
+    def wait(self):
+        self.event.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
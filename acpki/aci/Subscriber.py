@@ -1,7 +1,8 @@
 import websocket, ssl, time, thread, threading
-from acpki.aci import Subscription
-from work_threads import WSThread, RefreshThread
+from acpki.aci import Subscription, RateLimiter, RefreshScheduler
+from work_threads import WSThread
 from acpki.util.exceptions import SubscriptionError
+from acpki.config import CONFIG
 
 
 class Subscriber:
@@ -17,9 +18,15 @@ class Subscriber:
         self.session = aci_session
         self.ws = None
         self.ws_thread = None
-        self.refresh_thread = None
-        self.refresh_interval = 45
-        self.refresh_failed = 0
+        self.scheduler = None
+        self.refresh_interval = CONFIG["apic"]["refresh-interval"]
+        self.subscription_timeout = CONFIG["apic"]["subscription-timeout"]
+        self.refresh_workers = CONFIG["apic"]["refresh-workers"]
+        self.refresh_jitter = CONFIG["apic"]["refresh-jitter"]
+        self.refresh_max_failures = CONFIG["apic"]["refresh-max-failures"]
+        self.ws_timeout = CONFIG["apic"]["ws-timeout"]
+        self.ws_workers = CONFIG["apic"]["ws-workers"]
+        self.ws_queue_size = CONFIG["apic"]["ws-queue-size"]
         self.connected = False
         self.subscriptions = []
 
@@ -27,6 +34,10 @@ class Subscriber:
         self.connect(sub_cb)
 
     def connect(self, sub_cb=None):
+        # The token may have been refreshed since the Subscriber was created
+        self.token = self.session.token
+        self.url = self.get_ws_url(self.session.apic_base_url)
+
         # Security options
         if self.secure and self.crt_file is not None:
             # Verify certificate
@@ -46,19 +57,40 @@ class Subscriber:
 
         # Connect
         self.ws = websocket.WebSocket(sslopt=options)
-        self.ws.settimeout(60)
+        self.ws.settimeout(self.ws_timeout)
         self.ws.connect(self.url)
         print("Websocket connected successfully.")
         self.connected = True
 
         # Create WS work threads
-        self.ws_thread = WSThread(self.ws, self.sub_cb)
-        self.refresh_thread = RefreshThread(self.ws, self.refresh_subscriptions, self.refresh_interval)
+        self.ws_thread = WSThread(self.ws, self.sub_cb, workers=self.ws_workers, queue_size=self.ws_queue_size)
+        self.scheduler = RefreshScheduler(self.refresh_subscription, timeout=self.subscription_timeout,
+                                          interval=self.refresh_interval, workers=self.refresh_workers,
+                                          jitter=self.refresh_jitter, keepalive_cb=self.ping,
+                                          max_failures=self.refresh_max_failures, dropped_cb=self.drop_subscription)
 
         print("WS opened: {}".format(self.url))
 
         return
 
+    def get_stats(self):
+        """
+        Get statistics for the WebSocket, including queue depth and event lag, which indicate backpressure.
+        :return:    Dictionary of statistics, or None if not connected
+        """
+        if self.ws_thread is None:
+            return None
+        return self.ws_thread.get_stats()
+
+    def get_refresh_stats(self):
+        """
+        Get statistics for subscription refreshes, including refresh latency and missed deadlines.
+        :return:    Dictionary of statistics, or None if not connected
+        """
+        if self.scheduler is None:
+            return None
+        return self.scheduler.get_stats()
+
     def def_sub_cb(self, opcode, data):
         """
         This method maps incoming subscription data to its respective callback method.
@@ -76,12 +108,12 @@ class Subscriber:
             print("You are not connected.")
             return True
 
-        # Exit threads
+        # Exit threads. New subscriptions are refused from now on.
+        self.connected = False
         self.ws_thread.stop()
         self.ws_thread = None
-        self.refresh_thread.stop()
-        self.refresh_thread = None
-        self.refresh_failed = 0
+        self.scheduler.stop()
+        self.scheduler = None
 
         # Clear subscriptions
         self.subscriptions = []
@@ -92,38 +124,78 @@ class Subscriber:
         return True
 
     def reconnect(self):
+        """
+        Close the WebSocket and open it again, e.g. with a new token. The subscriptions are cleared, as they cannot be
+        refreshed with a new token.
+        :return:    List of the subscriptions that were cleared
+        """
+        subscriptions = self.subscriptions
         self.disconnect()
-        self.connect()
+        self.connect(self.sub_cb)
+        return subscriptions
 
     def refresh_subscriptions(self):
-        for subscription in self.subscriptions:
-            if self.verbose:
-                print("Refreshing subscription {}".format(subscription.sub_id))
-            if not isinstance(subscription, Subscription):
-                if self.verbose:
-                    raise SystemError("Encountered object inside Subscriber.subscriptions that was not of type "
-                                      "Subscription. I do not know what to do with that. ")
-            resp = self.session.get("subscriptionRefresh", params={"id": subscription.sub_id})
-            if resp.ok:
-                print("Subscription {0} was successfully refreshed.".format(subscription.sub_id))
-                self.refresh_failed = 0
-            else:
-                print("Could not refresh session. Status: {0} {1}".format(resp.status_code, resp.reason))
-                self.refresh_failed += 1
-                if self.refresh_failed >= 3:
-                    raise SubscriptionError("Failed to refresh subscription 3 times in a row.")
-
-    def subscribe(self, sub_id, method, callback=None):
+        """
+        Refresh all subscriptions as soon as possible. Subscriptions are otherwise refreshed by the scheduler before
+        they expire.
+        :return:
+        """
+        self.scheduler.refresh_all()
+
+    def refresh_subscription(self, subscription):
+        """
+        Refresh a single subscription. Called by the scheduler.
+        :param subscription:    The Subscription
+        :return:                True if successful, False otherwise
+        """
+        if self.verbose:
+            print("Refreshing subscription {}".format(subscription.sub_id))
+        resp = self.session.get("subscriptionRefresh", params={"id": subscription.sub_id}, cached=False,
+                                priority=RateLimiter.PRIORITY_REFRESH)
+        if not resp.ok:
+            print("Could not refresh subscription {0}. Status: {1} {2}"
+                  .format(subscription.sub_id, resp.status_code, resp.reason))
+        elif self.verbose:
+            print("Subscription {0} was successfully refreshed.".format(subscription.sub_id))
+        return resp.ok
+
+    def drop_subscription(self, subscription, error):
+        """
+        Forget a subscription that was dropped by the scheduler, as it expired or could not be refreshed. Called by the
+        scheduler.
+        :param subscription:    The Subscription
+        :param error:           SubscriptionError describing why it was dropped
+        :return:
+        """
+        if subscription in self.subscriptions:
+            self.subscriptions.remove(subscription)
+        self.session.cb_methods.pop(subscription.sub_id, None)
+
+    def ping(self):
+        if self.verbose:
+            print("Pinging WS to keep connection alive")
+        self.ws.ping()
+
+    def subscribe(self, sub_id, method, callback=None, params=None):
         """
         This method is called when a new subscription IS generated. To create a new subscription, use the
         ACISession.get() method with subscription=True as an optional parameter.
         :param sub_id:      Subscription ID of the generated subscription
         :param method:      Method for which the subscription is created, i.e. what is following apic/api/...
         :param callback:    Callback method to which the result will be passed for given subscription
+        :param params:      GET parameters of the subscribing query
         :return:
         """
-        subscription = Subscription(self, sub_id, method, callback)
+        # The Subscriber may be reconnecting, e.g. after logging in again, and then the subscription is recreated by
+        # ACISession.resubscribe() if it is needed
+        scheduler = self.scheduler
+        if scheduler is None or not self.connected:
+            raise SubscriptionError("Could not register subscription {0} as Subscriber was disconnected."
+                                    .format(sub_id))
+
+        subscription = Subscription(self, sub_id, method, callback, params=params)
         self.subscriptions.append(subscription)
+        scheduler.add(subscription)
 
         return subscription
 
@@ -1,9 +1,10 @@
 
 
 class Subscription:
-    def __init__(self, subscriber, sub_id, method, callback=None, active=True):
+    def __init__(self, subscriber, sub_id, method, callback=None, active=True, params=None):
         self.subscriber = subscriber
         self.sub_id = sub_id
         self.method = method
         self.callback = callback
-        self.active = active
\ No newline at end of file
+        self.active = active
+        self.params = params  # GET parameters of the subscribing query
@@ -0,0 +1,237 @@
+import json, os, time, tempfile
+from threading import Thread, Event, Lock
+from acpki.aci import RateLimiter
+
+
+class TokenManager:
+    """
+    Manages the lifecycle of the APIC token of an ACISession. The expiry returned by aaaLogin and aaaRefresh is tracked,
+    the token is refreshed with aaaRefresh in the background before it expires, and the token state is saved atomically
+    to disk, so that a restarted process can resume the session without logging in or validating the token again.
+    """
+    default_refresh_timeout = 600   # Used if the APIC does not return refreshTimeoutSeconds
+    retry_interval = 5              # Seconds between attempts when refreshing fails
+
+    def __init__(self, aci_session, state_file=None, refresh_margin=60):
+        """
+        :param aci_session:     The ACISession whose token is managed
+        :param state_file:      JSON file the token state is saved to, None disables persistence
+        :param refresh_margin:  Seconds before the token expires that it is refreshed. At most half of the refresh
+                                timeout of the token is used.
+        """
+        self.session = aci_session
+        self.state_file = state_file
+        self.refresh_margin = refresh_margin
+        self.lock = Lock()
+        self.thread = None
+
+        # Token state
+        self.token = None
+        self.cookies = {}
+        self.refresh_timeout = None
+        self.expires = 0                # Time the token expires unless it is refreshed
+        self.lifetime_expires = None    # Time the token expires even if it is refreshed
+
+        # Statistics
+        self.logins = 0
+        self.refreshes = 0
+        self.failures = 0
+
+    def update(self, response, login=False):
+        """
+        Update the token state from an aaaLogin or aaaRefresh response and save it.
+        :param response:    A successful requests response object
+        :param login:       True if the response is from aaaLogin, which starts the maximum lifetime of the token
+        :return:            The new token
+        """
+        attrs = json.loads(response.content)["imdata"][0]["aaaLogin"]["attributes"]
+        now = time.time()
+        with self.lock:
+            self.token = attrs["token"]
+            self.cookies = dict(response.cookies) or {"APIC-cookie": self.token}
+            self.refresh_timeout = int(attrs.get("refreshTimeoutSeconds") or self.default_refresh_timeout)
+            self.expires = now + self.refresh_timeout
+            if login:
+                self.logins += 1
+                lifetime = attrs.get("maximumLifetimeSeconds")
+                self.lifetime_expires = now + int(lifetime) if lifetime else None
+            else:
+                self.refreshes += 1
+        self.save()
+        return self.token
+
+    def apply(self, cookies):
+        """
+        Set the session cookies of the token in a cookie jar.
+        :param cookies:     Cookie jar, e.g. Transport.cookies
+        :return:
+        """
+        with self.lock:
+            for name, value in self.cookies.iteritems():
+                cookies.set(name, value)
+
+    def get_margin(self):
+        if self.refresh_timeout is None:
+            return self.refresh_margin
+        return min(self.refresh_margin, self.refresh_timeout / 2.0)
+
+    def is_valid(self):
+        """
+        :return:    True if the token has not expired
+        """
+        now = time.time()
+        return (self.token is not None and self.expires > now and
+                (self.lifetime_expires is None or self.lifetime_expires > now))
+
+    def is_fresh(self):
+        """
+        :return:    True if the token is valid and does not have to be refreshed yet
+        """
+        now = time.time() + self.get_margin()
+        return (self.token is not None and self.expires > now and
+                (self.lifetime_expires is None or self.lifetime_expires > now))
+
+    def get_refresh_delay(self):
+        """
+        :return:    Seconds until the token should be refreshed
+        """
+        return max(0.0, self.expires - self.get_margin() - time.time())
+
+    def refresh(self):
+        """
+        Refresh the token with aaaRefresh.
+        :return:    True if successful, False otherwise
+        """
+        path = self.session.get_method_url("aaaRefresh")
+        try:
+            resp = self.session.session.get(path, endpoint="aaaRefresh", priority=RateLimiter.PRIORITY_REFRESH)
+        except Exception as e:
+            print("Could not refresh APIC token: {}".format(e))
+            resp = None
+        if resp is None or not resp.ok:
+            if resp is not None:
+                print("Could not refresh APIC token. Status: {0} {1}".format(resp.status_code, resp.reason))
+            with self.lock:
+                self.failures += 1
+            return False
+        self.update(resp)
+        return True
+
+    def ensure_fresh(self):
+        """
+        Refresh the token if it is about to expire. If the token cannot be refreshed, e.g. because it has reached its
+        maximum lifetime, a new token is requested with aaaLogin.
+        :return:    True if the token is fresh, False otherwise
+        """
+        if self.is_fresh():
+            return True
+        lifetime_left = self.lifetime_expires is None or self.lifetime_expires - self.get_margin() > time.time()
+        if self.is_valid() and lifetime_left and self.refresh():
+            return True
+        print("APIC token expired or could not be refreshed. Logging in again...")
+        return self.session.relogin().ok
+
+    def load(self):
+        """
+        Load the token state from disk.
+        :return:    True if a token was loaded, False otherwise
+        """
+        if not self.state_file or not os.path.exists(self.state_file):
+            return False
+        try:
+            with open(self.state_file, "r") as f:
+                state = json.load(f)
+            with self.lock:
+                self.token = state["token"]
+                self.cookies = state.get("cookies") or {"APIC-cookie": self.token}
+                self.refresh_timeout = state.get("refresh-timeout")
+                self.expires = state["expires"]
+                self.lifetime_expires = state.get("lifetime-expires")
+        except (IOError, ValueError, KeyError, TypeError) as e:
+            print("Could not load APIC token state: {}".format(e))
+            return False
+        return True
+
+    def save(self):
+        """
+        Save the token state to disk. The state is written to a temporary file that replaces the state file, so the
+        state file is never partially written.
+        :return:    True if successful, False otherwise
+        """
+        if not self.state_file:
+            return False
+        with self.lock:
+            state = {
+                "token": self.token,
+                "cookies": self.cookies,
+                "refresh-timeout": self.refresh_timeout,
+                "expires": self.expires,
+                "lifetime-expires": self.lifetime_expires,
+            }
+        directory = os.path.dirname(self.state_file) or "."
+        tmp_path = None
+        try:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".token-")
+            with os.fdopen(fd, "w") as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp_path, self.state_file)
+            return True
+        except (IOError, OSError) as e:
+            print("Could not save APIC token state. Continuing without persistency... ({})".format(e))
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+
+    def start(self):
+        """
+        Start refreshing the token in the background.
+        :return:
+        """
+        if self.thread is None:
+            self.thread = TokenRefreshThread(self)
+
+    def stop(self):
+        if self.thread is not None:
+            self.thread.stop()
+            self.thread = None
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "valid": self.is_valid(),
+                "expires-in": max(0.0, self.expires - time.time()),
+                "logins": self.logins,
+                "refreshes": self.refreshes,
+                "failures": self.failures,
+            }
+
+
+class TokenRefreshThread(Thread):
+    """
+    This thread refreshes the APIC token shortly before it expires.
+    """
+    def __init__(self, manager, start=True):
+        super(TokenRefreshThread, self).__init__()
+        self.daemon = True
+        self.manager = manager
+        self.stopped = Event()
+
+        if start:
+            self.start()
+
+    def run(self):
+        while not self.stopped.wait(self.manager.get_refresh_delay()):
+            try:
+                fresh = self.manager.ensure_fresh()
+            except Exception as e:
+                print("Could not refresh APIC token: {}".format(e))
+                fresh = False
+            if not fresh and self.stopped.wait(self.manager.retry_interval):
+                break
+
+    def stop(self):
+        self.stopped.set()
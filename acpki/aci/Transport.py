@@ -0,0 +1,191 @@
+import time, random
+from email.utils import parsedate_tz, mktime_tz
+from threading import Lock
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class Transport:
+    """
+    HTTP transport used by ACISession to communicate with the APIC. It keeps a sized pool of keep-alive connections,
+    applies connect and read timeouts to every request, retries idempotent requests with jittered exponential backoff
+    and keeps latency statistics per endpoint. If a RateLimiter is given, every attempt waits for the limiter, and 429
+    and 503 responses are reported to it together with their Retry-After header. One Transport may be used from several
+    threads at once.
+    """
+    idempotent_methods = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+    retry_status_codes = (429, 502, 503, 504)
+    throttle_status_codes = (429, 503)
+
+    def __init__(self, pool_size=10, connect_timeout=5, read_timeout=30, retries=3, backoff=0.5, backoff_max=10,
+                 verify=False, limiter=None):
+        """
+        :param pool_size:           Maximum number of connections kept open to the APIC. Threads wait for a free
+                                    connection instead of opening new ones when all are in use.
+        :param connect_timeout:     Seconds to wait for a connection to be established
+        :param read_timeout:        Seconds to wait for data from the APIC
+        :param retries:             Number of times an idempotent request is retried after a connection error, timeout
+                                    or 429, 502, 503 or 504 response
+        :param backoff:             Base of the exponential backoff between retries, in seconds
+        :param backoff_max:         Maximum backoff between retries, in seconds
+        :param verify:              Verify the APIC certificate (boolean or path to CA bundle)
+        :param limiter:             RateLimiter for requests to the APIC, None disables rate limiting
+        """
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.verify = verify
+        self.limiter = limiter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.stats = {}  # Endpoint -> EndpointStats
+        self.stats_lock = Lock()
+
+    @property
+    def cookies(self):
+        return self.session.cookies
+
+    def reset(self):
+        """
+        Clear the cookies of the session, e.g. before authenticating again. Open connections are kept.
+        :return:
+        """
+        self.session.cookies.clear()
+
+    def get(self, url, endpoint=None, **kwargs):
+        return self.request("GET", url, endpoint, **kwargs)
+
+    def post(self, url, endpoint=None, **kwargs):
+        return self.request("POST", url, endpoint, **kwargs)
+
+    def request(self, method, url, endpoint=None, retry=None, priority=None, **kwargs):
+        """
+        Send a request to the APIC.
+        :param method:      HTTP method
+        :param url:         Full URL of the request
+        :param endpoint:    Name under which latency statistics are recorded (Default: the URL without parameters)
+        :param retry:       Retry the request on failure. Default: True for idempotent methods, False otherwise
+        :param priority:    Priority of the request for the rate limiter (Default: RateLimiter.PRIORITY_INTERACTIVE)
+        :param kwargs:      Additional arguments for requests, e.g. data, json or headers
+        :return:            A requests response object
+        """
+        if endpoint is None:
+            endpoint = url.split("?", 1)[0]
+        if retry is None:
+            retry = method.upper() in self.idempotent_methods
+        kwargs.setdefault("timeout", self.timeout)
+        kwargs.setdefault("verify", self.verify)
+
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                if priority is None:
+                    self.limiter.acquire()
+                else:
+                    self.limiter.acquire(priority)
+
+            start = time.time()
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self.record(endpoint, time.time() - start, error=True)
+                if self.limiter is not None:
+                    self.limiter.release(succeeded=False)
+                if not retry or attempt >= self.retries:
+                    raise
+                delay = self.get_backoff(attempt)
+            except BaseException:
+                # Other errors, e.g. too many redirects or an invalid URL, are not retried. The limiter slot is released
+                # so that it is not lost.
+                self.record(endpoint, time.time() - start, error=True)
+                if self.limiter is not None:
+                    self.limiter.release(succeeded=False)
+                raise
+            else:
+                self.record(endpoint, time.time() - start, error=not resp.ok)
+                throttled = resp.status_code in self.throttle_status_codes
+                retry_after = self.get_retry_after(resp) if throttled else None
+                if self.limiter is not None:
+                    self.limiter.release(throttled=throttled, retry_after=retry_after, succeeded=resp.ok)
+                if not retry or attempt >= self.retries or resp.status_code not in self.retry_status_codes:
+                    return resp
+                resp.close()
+                delay = max(self.get_backoff(attempt), retry_after or 0)
+
+            time.sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    def get_retry_after(resp):
+        """
+        Get the time to wait before the next request from the Retry-After header of a response.
+        :param resp:    A requests response object
+        :return:        Seconds to wait, or None if the header is missing or invalid
+        """
+        value = resp.headers.get("Retry-After")
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return int(value)
+
+        # The header may also be an HTTP date
+        date = parsedate_tz(value)
+        if date is None:
+            return None
+        return max(0, mktime_tz(date) - time.time())
+
+    def get_backoff(self, attempt):
+        """
+        Get the time to wait before a retry, using exponential backoff with full jitter.
+        :param attempt:     Number of the attempt that failed, starting at 0
+        :return:            Seconds to wait
+        """
+        return random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+
+    def record(self, endpoint, latency, error=False):
+        with self.stats_lock:
+            stats = self.stats.get(endpoint)
+            if stats is None:
+                stats = self.stats[endpoint] = EndpointStats()
+            stats.add(latency, error)
+
+    def get_stats(self):
+        """
+        Get latency statistics for each endpoint.
+        :return:    Dictionary of {endpoint: statistics}
+        """
+        with self.stats_lock:
+            return dict((endpoint, stats.to_dict()) for endpoint, stats in self.stats.iteritems())
+
+
+class EndpointStats:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def add(self, latency, error=False):
+        self.count += 1
+        if error:
+            self.errors += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+        self.last = latency
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "avg": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "last": self.last,
+        }
@@ -1,4 +1,11 @@
 from Subscription import Subscription
+from RateLimiter import RateLimiter
+from Transport import Transport
+from QueryExecutor import QueryExecutor
+from ResponseCache import ResponseCache
+from SingleFlight import SingleFlight
+from TokenManager import TokenManager
+from RefreshScheduler import RefreshScheduler
 from Subscriber import Subscriber
 from ACISession import ACISession
 from ACIAdapter import ACIAdapter
\ No newline at end of file
@@ -0,0 +1,71 @@
+import json
+from acpki.models import EPGUpdate, ContractUpdate
+from acpki.models.EPG import merge_sub_ids
+
+# Use a faster JSON codec if one is installed
+try:
+    import ujson as codec
+except ImportError:
+    try:
+        import simplejson as codec
+    except ImportError:
+        codec = json
+
+
+class ObjectUpdate(object):
+    """
+    A change to an object of a class that has no specific event type
+    """
+    __slots__ = ("dn", "cls", "status", "mod_ts", "sub_ids", "attrs")
+
+    def __init__(self, dn, cls, status, mod_ts, sub_ids, attrs):
+        self.dn = dn
+        self.cls = cls
+        self.status = status
+        self.mod_ts = mod_ts
+        self.sub_ids = sub_ids
+        self.attrs = attrs
+
+    def merge(self, update, status):
+        attrs = dict(self.attrs)
+        attrs.update(update.attrs)
+        return ObjectUpdate(self.dn, self.cls, status, update.mod_ts or self.mod_ts,
+                            merge_sub_ids(self.sub_ids, update.sub_ids), attrs)
+
+
+def decode_epg(cls, attrs, sub_ids):
+    return EPGUpdate(attrs.get("dn"), attrs.get("name"), attrs.get("modTs"), attrs.get("status"), sub_ids)
+
+
+def decode_contract(cls, attrs, sub_ids):
+    return ContractUpdate(attrs.get("dn"), cls, attrs.get("uid"), attrs.get("tnVzBrCPName"), attrs.get("modTs"),
+                          attrs.get("status"), sub_ids)
+
+
+def decode_object(cls, attrs, sub_ids):
+    return ObjectUpdate(attrs.get("dn"), cls, attrs.get("status"), attrs.get("modTs"), sub_ids, attrs)
+
+
+decoders = {
+    "fvAEPg": decode_epg,
+    "fvRsProv": decode_contract,
+    "fvRsCons": decode_contract,
+}
+
+
+def decode_frame(data):
+    """
+    Parse subscription data from the WebSocket into typed events. The data is parsed only once, and only the attributes
+    used by the handlers are kept for EPGs and contracts.
+    :param data:        Subscription data as a JSON string
+    :return:            Tuple of the subscription IDs and a list of events, i.e. EPGUpdate, ContractUpdate or
+                        ObjectUpdate objects
+    """
+    content = codec.loads(data)
+    sub_ids = tuple(content.get("subscriptionId") or ())
+    events = []
+    for item in content.get("imdata") or ():
+        for cls, obj in item.iteritems():
+            decoder = decoders.get(cls, decode_object)
+            events.append(decoder(cls, obj.get("attributes") or {}, sub_ids))
+    return sub_ids, events
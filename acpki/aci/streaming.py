@@ -0,0 +1,72 @@
+import json, re
+
+_decoder = json.JSONDecoder()
+_whitespace = " \t\n\r,"
+_field = re.compile(r'"([^"\\]+)"\s*:\s*("(?:[^"\\]|\\.)*"|[-+.\w]+)')
+
+
+def iter_imdata(chunks, fields_cb=None):
+    """
+    Incrementally parse an APIC JSON response and yield the objects in its "imdata" list one at a time, as soon as each
+    object has been received. Only the object being parsed is kept in memory, not the whole response.
+    :param chunks:      Iterable of strings with the response body, e.g. response.iter_content()
+    :param fields_cb:   Method called with a dictionary of the other top-level fields of the response, e.g. totalCount
+                        and subscriptionId. It is called before the first object with the fields preceding the imdata
+                        list, and again after the list if more fields follow it.
+    :return:            Generator of dictionaries, e.g. {"fvAEPg": {"attributes": {...}}}
+    """
+    chunks = iter(chunks)
+    buf = ""
+    in_list = False
+    for chunk in chunks:
+        buf += chunk
+        if not in_list:
+            # Skip everything up to the start of the imdata list. Only scalar fields precede it, so it is short.
+            start = buf.find('"imdata"')
+            if start < 0:
+                continue
+            list_start = buf.find("[", start)
+            if list_start < 0:
+                continue
+            if fields_cb is not None:
+                fields_cb(parse_fields(buf[:start]))
+            buf = buf[list_start + 1:]
+            in_list = True
+
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in _whitespace:
+                pos += 1
+            if pos >= len(buf):
+                break
+            if buf[pos] == "]":
+                if fields_cb is not None:
+                    tail = buf[pos + 1:] + "".join(chunks)
+                    fields = parse_fields(tail)
+                    if fields:
+                        fields_cb(fields)
+                return
+            try:
+                obj, pos = _decoder.raw_decode(buf, pos)
+            except ValueError:
+                break  # The object is incomplete, wait for the next chunk
+            yield obj
+        buf = buf[pos:]
+
+    # The end of the imdata list was never reached
+    raise ValueError("Incomplete or invalid imdata in APIC response.")
+
+
+def parse_fields(text):
+    """
+    Parse the scalar fields in a part of an APIC JSON response outside the imdata list.
+    :param text:    Part of the response, e.g. '{"totalCount":"2","subscriptionId":"72057594037927937",'
+    :return:        Dictionary of field name -> value
+    """
+    fields = {}
+    for match in _field.finditer(text):
+        try:
+            fields[match.group(1)] = json.loads(match.group(2))
+        except ValueError:
+            continue
+    return fields
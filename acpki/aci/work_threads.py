@@ -1,5 +1,6 @@
-import time, sys
-from threading import Thread
+import time, sys, socket, Queue
+import websocket
+from threading import Thread, Lock
 from acpki.util.exceptions import SubscriptionError
 
 
@@ -9,74 +10,152 @@ class StoppableThread(Thread):
         self.running = False
 
     def start(self):
+        self.running = True  # Set before starting to ensure that run() does not exit immediately
         super(StoppableThread, self).start()
-        self.running = True
 
     def stop(self):
         self.running = False
 
 
 class WSThread(StoppableThread):
-    def __init__(self, ws, callback, sleep_length=1, start=True):
+    """
+    This thread blocks on the WebSocket and reads frames as soon as they arrive. Frames are put in a bounded queue that
+    is drained by a pool of DispatchThreads, which forward the frames to the callback method. If the queue is full the
+    WebSocket is not read until there is space again, i.e. the APIC will experience backpressure.
+    """
+    def __init__(self, ws, callback, workers=1, queue_size=1000, start=True):
         """
         Create a new WebSocket Thread.
         :param ws:              WebSocket
-        :param sub_cb:          Subscription callback method to which received data will be sent
-        :param sleep_length:    Time to sleep between each check of the WebSocket
+        :param callback:        Subscription callback method to which received data will be sent
+        :param workers:         Number of threads that forward data to the callback method. Note that frames may be
+                                handled out of order if this is more than 1.
+        :param queue_size:      Maximum number of received frames waiting to be handled
         :param start:           Whether to start the thread upon creation
         """
-        self.deamon = True
+        super(WSThread, self).__init__()
+        self.daemon = True
         self.ws = ws
         self.cb = callback
-        self.sleep_length = float(sleep_length)
+        self.queue = Queue.Queue(maxsize=queue_size)
 
+        # Statistics
         self.updated = time.time()
-        super(WSThread, self).__init__()
+        self.received = 0
+        self.dispatched = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.stats_lock = Lock()
+
+        self.workers = [DispatchThread(self) for _ in range(max(1, int(workers)))]
+
+        if start:
+            self.start()
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        super(WSThread, self).start()
 
-        self.start()
+    def stop(self):
+        super(WSThread, self).stop()
+        for worker in self.workers:
+            worker.stop()
+        # Wake up idle workers, which will exit when they find the stop signal
+        for _ in self.workers:
+            try:
+                self.queue.put_nowait(None)
+            except Queue.Full:
+                break
 
     def run(self):
-        while True:
+        while self.running:
             try:
-                time.sleep(self.sleep_length)
+                opcode, data = self.ws.recv_data()
+            except websocket.WebSocketTimeoutException:
+                continue  # No data within the timeout, check whether the thread is still running
+            except (websocket.WebSocketConnectionClosedException, socket.error) as e:
                 if self.running:
-                    opcode, data = self.ws.recv_data()
-                    if opcode and data:
-                        self.cb(opcode, data)
+                    print("WebSocket connection was lost: {}".format(e))
+                break
             except KeyboardInterrupt:
                 sys.exit()
 
+            if opcode and data:
+                self.updated = time.time()
+                self.received += 1
+                self.enqueue((self.updated, opcode, data))
 
-class RefreshThread(StoppableThread):
-    """
-    This thread class ensures that the WebSocket is refreshed at a regular interval.
-    """
-    def __init__(self, ws, refresh_cb, interval, start=True):
-        self.ws = ws
-        self.cb = refresh_cb
-        self.sub_interval = interval
+        self.running = False
 
-        self.ws_ttl = self.ws.gettimeout()
-        self.updated = time.time()
+    def enqueue(self, item):
+        """
+        Put an item in the queue, waiting while the queue is full for as long as the thread is running.
+        :param item:    Tuple containing (received time, opcode, data)
+        :return:
+        """
+        while self.running:
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except Queue.Full:
+                continue
+
+    def record_lag(self, lag):
+        with self.stats_lock:
+            self.dispatched += 1
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            self.total_lag += lag
+
+    @property
+    def queue_depth(self):
+        """
+        Number of received frames that are waiting to be handled.
+        """
+        return self.queue.qsize()
 
-        # Check time limits for errors
-        if self.ws_ttl < self.sub_interval:
-            raise SubscriptionError("WebSocket TTL cannot be shorter than refresh interval!")
-        elif self.ws_ttl < self.sub_interval - 5:
-            print("WARNING: Your subscription interval is less than 5 seconds below the WebSocket TTL. This could lead"
-                  "to a WebSocket expiration before it is refreshed.")
+    @property
+    def event_lag(self):
+        """
+        Time in seconds from the last handled frame was received until it was forwarded to the callback method.
+        """
+        return self.last_lag
+
+    def get_stats(self):
+        with self.stats_lock:
+            return {
+                "received": self.received,
+                "dispatched": self.dispatched,
+                "queue-depth": self.queue_depth,
+                "last-lag": self.last_lag,
+                "max-lag": self.max_lag,
+                "avg-lag": self.total_lag / self.dispatched if self.dispatched else 0.0,
+            }
 
-        super(RefreshThread, self).__init__()
 
-        self.start()
+class DispatchThread(StoppableThread):
+    """
+    Worker thread that takes frames from the queue of a WSThread and forwards them to its callback method.
+    """
+    def __init__(self, ws_thread):
+        super(DispatchThread, self).__init__()
+        self.daemon = True
+        self.ws_thread = ws_thread
 
     def run(self):
-        while True:
-            if self.running:
-                time_diff = time.time() - self.updated
-                if time_diff >= self.sub_interval:
-                    self.cb()
-                    self.updated = time.time()
-                    print("Pinging WS to keep connection alive")
-                    self.ws.ping()
-            time.sleep(1)
+        while self.running:
+            try:
+                item = self.ws_thread.queue.get(timeout=1)
+            except Queue.Empty:
+                continue
+            if item is None:
+                continue  # Stop signal, the loop exits if the thread has been stopped
+
+            received, opcode, data = item
+            self.ws_thread.record_lag(time.time() - received)
+            try:
+                self.ws_thread.cb(opcode, data)
+            except Exception as e:
+                print("Subscription callback failed: {}".format(e))
@@ -4,18 +4,39 @@ base_dir = os.path.dirname(__file__)
 CONFIG = {
     "apic": {
         "name": "sandbox-apic",
-        "base-url": "sandboxapic.cisco.com",  # Should not include http://, https:// etc.
+        "base-url": "sandboxapicdc.cisco.com",  # Should not include http://, https:// etc. May include a port.
         "tn-name": "acpki_prototype",
         "ap-name": "prototype",
         "use-tls": True,
         "username": "admin",
         "password": "ciscopsdt",
-        "cookie-file": "aci/private/cookie.txt",
-        "token-file": "aci/private/token.txt",
+        "token-file": "aci/private/token.json",  # Token state, saved to resume the session after a restart
+        "token-refresh-margin": 60,  # Seconds before the APIC token expires that it is refreshed with aaaRefresh
         "crt-file": None,   # Setting this to None disables certificate validation, even if "use-tls" is True. This is
                             # required when using the APIC Sandbox from Cisco.
-        "refresh-interval": 45,
+        "refresh-interval": 45,     # Seconds from a subscription is created or refreshed until it is refreshed
+        "subscription-timeout": 60,  # Seconds a subscription lives on the APIC unless it is refreshed
+        "refresh-workers": 4,       # Maximum number of subscriptions refreshed at the same time
+        "refresh-jitter": 5,        # Maximum random number of seconds a subscription refresh is moved earlier
+        "refresh-max-failures": 3,  # Failed refreshes in a row before a subscription is dropped
         "ws-timeout": 60,
+        "http-pool-size": 10,       # Maximum number of open connections to the APIC
+        "cache-size": 0,            # Maximum number of cached APIC responses, 0 disables the cache (e.g. 256)
+        "cache-ttl": 30,            # Seconds an APIC response is cached, unless a subscription event invalidates it
+        "page-size": 1000,          # Number of objects per page when the APIC is queried one page at a time
+        "max-concurrency": 8,       # Maximum number of APIC queries run concurrently, should not exceed http-pool-size
+        "http-connect-timeout": 5,  # Seconds to wait for a connection to the APIC
+        "http-read-timeout": 30,    # Seconds to wait for data from the APIC
+        "http-retries": 3,          # Retries of idempotent requests after connection errors, timeouts or 502-504
+        "http-backoff": 0.5,        # Base of the exponential backoff between retries, in seconds
+        "http-backoff-max": 10,     # Maximum backoff between retries, in seconds
+        "rate-limit": 20,           # Requests per second sent to the APIC, 0 disables rate limiting
+        "rate-burst": 40,           # Requests that may be sent at once after a quiet period
+        "rate-min-concurrency": 1,  # Lowest limit of requests in flight when the APIC throttles requests
+        "rate-queue-size": 100,     # Requests waiting for the rate limit before further requests are rejected
+        "rate-max-wait": 10,        # Seconds a request waits for the rate limit before it is rejected
+        "ws-workers": 1,    # Threads handling subscription data. Data may be handled out of order if more than 1.
+        "ws-queue-size": 1000,  # Received WebSocket frames waiting to be handled before the socket is no longer read
         },
     "base-dir": base_dir,
     "verbose": True,
@@ -30,6 +51,13 @@ CONFIG = {
         "server-cert-name": "server.cert",
         "server-pkey-name": "server.pkey",
         "default-validity-days": 365,
+        "material-check-interval": 5,   # Seconds between each check for changes to cached certificate and key files
+        "key-pool-size": 0,             # Pre-generated RSA 2048 key pairs to keep ready, 0 disables the key pool
+        "key-pool-workers": 2,          # Worker processes generating key pairs for the key pool
+        "signing-workers": 4,           # Worker processes signing certificates for batch requests, 0 signs inline
+        "ocsp-validity": 3600,          # Seconds from an OCSP response is signed until its nextUpdate
+        "ocsp-refresh-margin": 600,     # Seconds before nextUpdate that a cached OCSP response is signed again
+        "ocsp-refresh-interval": 60,    # Seconds between each check for OCSP responses to refresh
     },
     "endpoints": {
         "client-name": "client-endpoint",
@@ -43,5 +71,27 @@ CONFIG = {
     },
     "psa": {
         "ous-file": os.path.join(base_dir, "psa/ous.txt"),
+        "ous-fsync-batch": 100,     # Maximum number of OU registrations before the OUs file is synced to disk
+        "ous-fsync-interval": 1.0,  # Maximum number of seconds before a registration is synced to disk
+        "ous-compact-ratio": 2.0,   # Compact the OUs file when it has more than this many lines per registered OU
+        "bulk-load": True,  # Load all EPGs and contracts in one query. Set to False to use one query per EPG instead.
+        "event-window": 0.05,       # Seconds subscription events are collected and combined before they are applied
+        "event-max-batch": 1000,    # Maximum number of objects changed by one batch of subscription events
+        "pending-timeout": 2.0,     # Seconds events for an unknown EPG are held before the EPG is fetched on its own
+        "decision-cache-size": 10000,   # Maximum number of cached certificate validations, 0 disables the cache
+        "decision-cache-ttl": 300,      # Seconds a validation is cached, unless EPGs, contracts or OUs change
+    },
+    "sim": {
+        "host": "127.0.0.1",
+        "port": 8480,               # Port of the fake APIC, 0 picks a free port
+        "epgs": 100,                # EPGs generated in the fake APIC, in addition to the EPGs of the endpoints
+        "contracts": 50,            # Contracts generated in the fake APIC
+        "relations-per-epg": 4,     # Contracts provided and consumed by each generated EPG, half of each
+        "seed": None,               # Seed for generating the fabric, set to generate the same fabric every time
+        "latency": 0.0,             # Seconds added to every request to the fake APIC
+        "latency-jitter": 0.0,      # Maximum random number of seconds added to the latency
+        "event-rate": 0.0,          # Random changes to the fabric per second, pushed as subscription events
+        "token-timeout": 600,       # Seconds a token is valid unless it is refreshed with aaaRefresh
+        "subscription-timeout": 60,  # Seconds a subscription is kept unless it is refreshed
     }
 }
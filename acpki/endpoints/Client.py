@@ -1,7 +1,7 @@
 import sys
 from socket import SOCK_STREAM, socket, AF_INET, error as SocketError
 from OpenSSL import SSL
-from acpki.pki import CertificateManager as CM
+from acpki.pki import CertificateManager as CM, OCSPResponder
 from acpki.util.exceptions import *
 from acpki.config import CONFIG
 from acpki.models import EP, EPG, CertificateRequest, CertificateValidationRequest
@@ -20,6 +20,7 @@ class Client(EP):
         self.keys = None
         self.cert = None
         self.ca_cert_name = None
+        self.ca_cert = None
 
         self.verbose = False
         self.peer = None
@@ -59,6 +60,8 @@ class Client(EP):
             self.keys = CM.load_pkey(client_pkey_name)
             self.cert = CM.load_cert(client_cert_name)
 
+        self.ca_cert = CM.load_cert(self.ca_cert_name)
+
         # Define context
         ctx = SSL.Context(SSL.TLSv1_2_METHOD)
         ctx.set_verify(SSL.VERIFY_PEER|SSL.VERIFY_FAIL_IF_NO_PEER_CERT, self.ssl_verify_cb)
@@ -121,13 +124,16 @@ class Client(EP):
         """
         Callback method for the OCSP certificate revocation check
         :param conn:    Connection object
-        :param ocsp:    Serial number of server certificate (deviates from documented stapled OCSP assertion)
+        :param ocsp:    DER encoded OCSP response stapled by the server
         :param data:    Data that was defined when setting the callback method, i.e. the EP name
-        :return:
+        :return:        True if the response is valid and the certificate is not revoked, False otherwise
         """
         print("OCSP callback: {}".format(data))
-        print("Server serial number: {}".format(ocsp))
-        return not self.ocsp_responder.is_revoked(ocsp)  # Return True if valid, False if revoked
+        peer_cert = conn.get_peer_certificate()
+        if peer_cert is None:
+            return False
+        print("Server serial number: {}".format(peer_cert.get_serial_number()))
+        return OCSPResponder.verify_response(ocsp, peer_cert.get_serial_number(), self.ca_cert)
 
     def ssl_verify_cb(self, conn, cert, errno, errdepth, rcode):
         print("SSL Client verify callback")
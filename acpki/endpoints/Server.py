@@ -22,6 +22,7 @@ class Server(EP):
         self.ca = ca
 
         self.ra = self.ca.get_ra()
+        self.ocsp_responder = self.ca.get_ocsp_responder()
         self.peer = None
         self.verbose = True
         self.cert = None
@@ -74,6 +75,9 @@ class Server(EP):
             self.keys = CM.load_pkey(server_pkey_name)
             self.cert = CM.load_cert(server_cert_name)
 
+        # Sign the OCSP response in advance, so that it is cached before the first handshake
+        self.ocsp_responder.get_response(self.cert)
+
         # Create context
         self.context = SSL.Context(SSL.TLSv1_2_METHOD)
         self.context.set_options(SSL.OP_NO_TLSv1_2)
@@ -182,14 +186,14 @@ class Server(EP):
 
     def ocsp_server_cb(self, conn, data=None):
         """
-        The OCSP callback method is responsible for ensuring that the certificate is still valid. The request should be
-
-        :param conn:
-        :param data:
-        :return:
+        The OCSP callback method staples the signed OCSP response for the server certificate. The response is cached and
+        refreshed in the background by the OCSP responder, so the handshake does not wait for a signature.
+        :param conn:    Connection object
+        :param data:    Data that was defined when setting the callback method, i.e. the EP name
+        :return:        DER encoded OCSP response
         """
         print("OCSP callback: {}".format(data))
-        return str(self.cert.get_serial_number()).encode()
+        return self.ocsp_responder.get_response(self.cert)
 
     def ssl_verify_cb(self, conn, cert, errno, errdepth, rcode):
         print("SSL Server verify callback")
@@ -15,4 +15,22 @@ class CertificateValidationRequest(object):
     def __init__(self, client, server, certificate):
         self.origin = client
         self.destination = server
-        self.cert = certificate
\ No newline at end of file
+        self.cert = certificate
+
+
+class CertificateResponse(object):
+    def __init__(self, request, cert=None, refused=False, error=None):
+        """
+        :param request:     The CertificateRequest that was handled
+        :param cert:        The issued certificate, or None if no certificate was issued
+        :param refused:     True if the request was refused by the PSA
+        :param error:       Exception raised while handling the request, if any
+        """
+        self.request = request
+        self.cert = cert
+        self.refused = refused
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.cert is not None
@@ -1,3 +1,6 @@
+from EPG import merge_sub_ids
+
+
 class Contract:
     """
     Model class representing a Cisco ACI Contract
@@ -9,3 +12,38 @@ class Contract:
 
     def equals(self, con):
         return self.dn == con.dn
+
+
+class ContractUpdate(object):
+    """
+    A change to a contract provided or consumed by an EPG, decoded from subscription data
+    """
+    __slots__ = ("dn", "cls", "uid", "name", "mod_ts", "status", "sub_ids")
+    actions = {"fvRsProv": "prov", "fvRsCons": "cons"}
+
+    def __init__(self, dn, cls, uid, name, mod_ts, status, sub_ids):
+        self.dn = dn
+        self.cls = cls
+        self.uid = uid
+        self.name = name
+        self.mod_ts = mod_ts
+        self.status = status
+        self.sub_ids = sub_ids
+
+    @property
+    def action(self):
+        return self.actions[self.cls]
+
+    @property
+    def epg_dn(self):
+        return self.dn.rsplit("/", 1)[0]
+
+    def merge(self, update, status):
+        """
+        Combine this update with a later update of the same contract.
+        :param update:  The later ContractUpdate
+        :param status:  Status of the combined update
+        :return:        New ContractUpdate
+        """
+        return ContractUpdate(self.dn, self.cls, update.uid or self.uid, update.name or self.name,
+                              update.mod_ts or self.mod_ts, status, merge_sub_ids(self.sub_ids, update.sub_ids))
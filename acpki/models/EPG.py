@@ -19,11 +19,44 @@ class EPG(object):
     def equals(self, epg):
         return self.dn == epg.dn
 
+    def copy(self):
+        """
+        :return:    A copy of the EPG with its own provides and consumes lists
+        """
+        epg = EPG(self.dn, self.name)
+        epg.descr = self.descr
+        epg.ap = self.ap
+        epg.provides = list(self.provides)
+        epg.consumes = list(self.consumes)
+        return epg
+
 
-class EPGUpdate:
-    def __init__(self, dn, name, mod_ts, status, sub_id):
+class EPGUpdate(object):
+    """
+    A change to an EPG, decoded from subscription data
+    """
+    __slots__ = ("dn", "name", "mod_ts", "status", "sub_ids")
+    cls = "fvAEPg"
+
+    def __init__(self, dn, name, mod_ts, status, sub_ids):
         self.dn = dn
         self.name = name
         self.mod_ts = mod_ts
         self.status = status
-        self.sub_id = sub_id
+        self.sub_ids = sub_ids
+
+    def merge(self, update, status):
+        """
+        Combine this update with a later update of the same EPG.
+        :param update:  The later EPGUpdate
+        :param status:  Status of the combined update
+        :return:        New EPGUpdate
+        """
+        return EPGUpdate(self.dn, update.name or self.name, update.mod_ts or self.mod_ts, status,
+                         merge_sub_ids(self.sub_ids, update.sub_ids))
+
+
+def merge_sub_ids(first, second):
+    if first == second:
+        return first
+    return first + tuple(sub_id for sub_id in second if sub_id not in first)
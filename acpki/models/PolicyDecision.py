@@ -0,0 +1,16 @@
+class PolicyDecision(object):
+    """
+    Result of a policy check by the PSA, tagged with the version of the policy snapshot that was used. The decision is
+    true if the connection or certificate was allowed, so it can be used in place of a boolean.
+    """
+    __slots__ = ("allowed", "version")
+
+    def __init__(self, allowed, version):
+        self.allowed = allowed
+        self.version = version
+
+    def __nonzero__(self):
+        return self.allowed
+
+    def __repr__(self):
+        return "PolicyDecision(allowed={0}, version={1})".format(self.allowed, self.version)
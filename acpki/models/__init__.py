@@ -1,6 +1,7 @@
-from CertificateRequest import CertificateRequest, CertificateValidationRequest
+from CertificateRequest import CertificateRequest, CertificateValidationRequest, CertificateResponse
 from Tenant import Tenant
 from AP import AP
 from EPG import EPG, EPGUpdate
 from EP import EP
-from Contract import Contract
\ No newline at end of file
+from Contract import Contract, ContractUpdate
+from PolicyDecision import PolicyDecision
\ No newline at end of file
@@ -1,5 +1,7 @@
-import os
+import os, time
+from threading import Lock
 from OpenSSL import crypto
+from acpki.pki.KeyPool import KeyPool
 from acpki.config import CONFIG
 
 
@@ -10,6 +12,12 @@ class CertificateManager:
     """
     default_validity = CONFIG["pki"]["default-validity-days"] * 86400  # 86400 seconds in a day
     certs_dir = CONFIG["pki"]["cert-dir"]
+    key_pool = None
+
+    # Parsed certificates and keys, keyed by file path. Files are checked for changes at most once per interval.
+    material_cache = {}     # Path -> (inode, mtime, size), time of last check, parsed object
+    material_check_interval = CONFIG["pki"]["material-check-interval"]
+    material_lock = Lock()
 
     def __init__(self):
         pass
@@ -103,14 +111,44 @@ class CertificateManager:
     def cert_file_exists(file_name):
         return os.path.isfile(CertificateManager.get_cert_path(file_name))
 
+    @staticmethod
+    def start_key_pool(watermarks=None, workers=None):
+        """
+        Start a pool of worker processes that pre-generate key pairs for create_key_pair().
+        :param watermarks:      Dictionary of {(key type, key size): number of keys to keep ready}. Default: RSA 2048 keys
+                                as defined in the configuration.
+        :param workers:         Number of worker processes. Default: As defined in the configuration.
+        :return:                The key pool
+        """
+        if watermarks is None:
+            watermarks = {(crypto.TYPE_RSA, 2048): CONFIG["pki"]["key-pool-size"]}
+        if workers is None:
+            workers = CONFIG["pki"]["key-pool-workers"]
+
+        CertificateManager.stop_key_pool()
+        CertificateManager.key_pool = KeyPool(watermarks, workers)
+        return CertificateManager.key_pool
+
+    @staticmethod
+    def stop_key_pool():
+        if CertificateManager.key_pool is not None:
+            CertificateManager.key_pool.stop()
+            CertificateManager.key_pool = None
+
     @staticmethod
     def create_key_pair(key_type=crypto.TYPE_RSA, key_size=2048):
         """
-        Generate a key pair for certificate generation.
+        Generate a key pair for certificate generation. If the key pool is started, a pre-generated key pair is used if
+        one is ready.
         :param key_type:        Valid key type, either crypto.TYPE_RSA or crypto.TYPE_DSA
         :param key_size:        Key size that is valid with respect to key type, e.g. 2048 for TYPE_RSA.
         :return:                The key pair that was generated.
         """
+        if CertificateManager.key_pool is not None:
+            pkey = CertificateManager.key_pool.get(key_type, key_size)
+            if pkey is not None:
+                return pkey
+
         pkey = crypto.PKey()
         pkey.generate_key(key_type, key_size)
         return pkey
@@ -137,7 +175,9 @@ class CertificateManager:
         """
         file_path = os.path.join(CertificateManager.certs_dir, file_name)
         print("Saving certificate to {0}".format(file_path))
-        open(file_path, "w").write((crypto.dump_certificate(crypto.FILETYPE_PEM, cert)))
+        with open(file_path, "w") as f:
+            f.write(crypto.dump_certificate(crypto.FILETYPE_PEM, cert))
+        CertificateManager.cache_material(file_path, cert)
 
     @staticmethod
     def save_pkey(pkey, file_name):
@@ -149,18 +189,86 @@ class CertificateManager:
         """
         file_path = os.path.join(CertificateManager.certs_dir, file_name)
         print("Saving private key to " + file_path)
-        open(file_path, "w").write((crypto.dump_privatekey(crypto.FILETYPE_PEM, pkey)))
+        with open(file_path, "w") as f:
+            f.write(crypto.dump_privatekey(crypto.FILETYPE_PEM, pkey))
+        CertificateManager.cache_material(file_path, pkey)
 
     @staticmethod
-    def load_cert(file_name):
+    def load_cert(file_name, cached=True):
+        """
+        Load an X.509 certificate from the certificates directory.
+        :param file_name:       File name of the certificate
+        :param cached:          Use the parsed certificate from the cache if the file has not changed
+        :return:                The certificate, or None if the file does not exist
+        """
+        if cached:
+            return CertificateManager.load_material(file_name, CertificateManager.read_cert)
         if not CertificateManager.cert_file_exists(file_name):
             return None
-        cert_file = open(CertificateManager.get_cert_path(file_name), "rt").read()
-        return crypto.load_certificate(crypto.FILETYPE_PEM, cert_file)
+        return CertificateManager.read_cert(CertificateManager.get_cert_path(file_name))
 
     @staticmethod
-    def load_pkey(file_name):
+    def load_pkey(file_name, cached=True):
+        """
+        Load a private key from the certificates directory.
+        :param file_name:       File name of the private key
+        :param cached:          Use the parsed key from the cache if the file has not changed
+        :return:                The private key, or None if the file does not exist
+        """
+        if cached:
+            return CertificateManager.load_material(file_name, CertificateManager.read_pkey)
         if not CertificateManager.cert_file_exists(file_name):
             return None
-        pkey_file = open(CertificateManager.get_cert_path(file_name), "rt").read()
-        return crypto.load_privatekey(crypto.FILETYPE_PEM, pkey_file)
+        return CertificateManager.read_pkey(CertificateManager.get_cert_path(file_name))
+
+    @staticmethod
+    def read_cert(file_path):
+        with open(file_path, "rt") as f:
+            return crypto.load_certificate(crypto.FILETYPE_PEM, f.read())
+
+    @staticmethod
+    def read_pkey(file_path):
+        with open(file_path, "rt") as f:
+            return crypto.load_privatekey(crypto.FILETYPE_PEM, f.read())
+
+    @staticmethod
+    def load_material(file_name, reader):
+        """
+        Load a certificate or key through the cache. The file is only checked for changes (inode, modification time and
+        size) once per check interval, and only read and parsed again if it has changed.
+        :param file_name:       File name in the certificates directory
+        :param reader:          Method that reads and parses the file, given its path
+        :return:                The parsed object, or None if the file does not exist
+        """
+        file_path = CertificateManager.get_cert_path(file_name)
+        entry = CertificateManager.material_cache.get(file_path)
+        now = time.time()
+        if entry is not None and now - entry[1] < CertificateManager.material_check_interval:
+            return entry[2]
+
+        with CertificateManager.material_lock:
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                CertificateManager.material_cache.pop(file_path, None)
+                return None
+
+            file_id = (st.st_ino, st.st_mtime, st.st_size)
+            if entry is not None and entry[0] == file_id:
+                material = entry[2]
+            else:
+                material = reader(file_path)
+            CertificateManager.material_cache[file_path] = (file_id, now, material)
+            return material
+
+    @staticmethod
+    def cache_material(file_path, material):
+        """
+        Put a certificate or key that was just saved in the cache, so that it does not have to be read again.
+        :param file_path:       Path of the saved file
+        :param material:        The certificate or key
+        :return:
+        """
+        with CertificateManager.material_lock:
+            st = os.stat(file_path)
+            CertificateManager.material_cache[file_path] = ((st.st_ino, st.st_mtime, st.st_size), time.time(), material)
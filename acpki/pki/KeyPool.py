@@ -0,0 +1,101 @@
+import multiprocessing
+from collections import deque
+from threading import Lock
+from OpenSSL import crypto
+
+
+def generate_key(key_type, key_size):
+    """
+    Generate a key pair in a worker process. Keys cannot be pickled, so the key is returned in PEM format.
+    :param key_type:    Valid key type, either crypto.TYPE_RSA or crypto.TYPE_DSA
+    :param key_size:    Key size that is valid with respect to key type
+    :return:            Tuple of (key type, key size, PEM encoded private key or None if generation failed)
+    """
+    try:
+        pkey = crypto.PKey()
+        pkey.generate_key(key_type, key_size)
+        return key_type, key_size, crypto.dump_privatekey(crypto.FILETYPE_PEM, pkey)
+    except Exception:
+        return key_type, key_size, None
+
+
+class KeyPool:
+    """
+    Pool of pre-generated key pairs. A pool of worker processes keeps the number of ready keys of each type and size at
+    its watermark, so that key pairs can be handed out without waiting for key generation.
+    """
+    def __init__(self, watermarks, workers=2):
+        """
+        :param watermarks:  Dictionary of {(key type, key size): number of keys to keep ready}
+        :param workers:     Number of worker processes generating keys
+        """
+        self.watermarks = dict(watermarks)
+        self.keys = dict((spec, deque()) for spec in self.watermarks)
+        self.pending = dict((spec, 0) for spec in self.watermarks)
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+        self.pool = multiprocessing.Pool(workers)
+
+        self.fill()
+
+    def get(self, key_type, key_size):
+        """
+        Get a ready key pair from the pool.
+        :param key_type:    Key type, e.g. crypto.TYPE_RSA
+        :param key_size:    Key size, e.g. 2048
+        :return:            A key pair, or None if no key of the given type and size is ready
+        """
+        spec = (key_type, key_size)
+        try:
+            pkey = self.keys[spec].popleft()
+        except (KeyError, IndexError):
+            with self.lock:
+                self.misses += 1
+            self.fill()
+            return None
+
+        with self.lock:
+            self.hits += 1
+        self.fill()
+        return pkey
+
+    def fill(self):
+        """
+        Request new keys from the worker processes for every key type and size below its watermark.
+        :return:
+        """
+        if self.pool is None:
+            return
+        with self.lock:
+            for spec, watermark in self.watermarks.iteritems():
+                for _ in range(watermark - len(self.keys[spec]) - self.pending[spec]):
+                    self.pending[spec] += 1
+                    self.pool.apply_async(generate_key, spec, callback=self.add)
+
+    def add(self, result):
+        """
+        Callback for keys generated by the worker processes.
+        :param result:      Result from generate_key()
+        :return:
+        """
+        key_type, key_size, pem = result
+        spec = (key_type, key_size)
+        with self.lock:
+            self.pending[spec] -= 1
+        if pem is not None:
+            self.keys[spec].append(crypto.load_privatekey(crypto.FILETYPE_PEM, pem))
+
+    def stop(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "ready": dict((spec, len(keys)) for spec, keys in self.keys.iteritems()),
+                "pending": dict(self.pending),
+            }
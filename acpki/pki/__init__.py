@@ -1,3 +1,5 @@
+from KeyPool import KeyPool
 from CertificateManager import CertificateManager
+from revocation import RevocationList
 from ocsp import OCSPResponder
 from authorities import CA, RA
@@ -1,12 +1,42 @@
-import uuid
+import uuid, multiprocessing
 from acpki.pki import CertificateManager, OCSPResponder
-from acpki.models import CertificateRequest, CertificateValidationRequest
+from acpki.models import CertificateRequest, CertificateValidationRequest, CertificateResponse
 from acpki.psa import PSA
 from acpki.config import CONFIG
 from acpki.util.exceptions import RequestError
 from OpenSSL import crypto
 
 
+# Signing material of the CA, loaded once in each signing worker process
+_signing_material = None
+
+
+def init_signing_worker(issuer_cert_pem, issuer_key_pem):
+    """
+    Initialise a signing worker process by loading the CA certificate and key.
+    :param issuer_cert_pem:     PEM encoded certificate of the CA
+    :param issuer_key_pem:      PEM encoded private key of the CA
+    :return:
+    """
+    global _signing_material
+    cert = crypto.load_certificate(crypto.FILETYPE_PEM, issuer_cert_pem)
+    key = crypto.load_privatekey(crypto.FILETYPE_PEM, issuer_key_pem)
+    _signing_material = (cert.get_issuer(), key)
+
+
+def sign_in_worker(csr_pem, serial_number):
+    """
+    Sign a certificate in a signing worker process. Certificates and CSRs cannot be pickled, so both are sent as PEM.
+    :param csr_pem:         PEM encoded CSR
+    :param serial_number:   Serial number of the certificate
+    :return:                PEM encoded certificate
+    """
+    issuer, key = _signing_material
+    csr = crypto.load_certificate_request(crypto.FILETYPE_PEM, csr_pem)
+    cert = CertificateManager.create_cert(csr, serial_number, issuer, key)
+    return crypto.dump_certificate(crypto.FILETYPE_PEM, cert)
+
+
 class RA:
     """
     The Registration Authority (RA) is responsible for issuing certificates to endpoints who are allowed to communicate.
@@ -18,6 +48,8 @@ class RA:
         self.psa = psa(self)
         self.cert = None
         self.verbose = CONFIG["verbose"]
+        self.signing_pool = None
+        self.signing_workers = CONFIG["pki"]["signing-workers"]
 
         # Config
         self.cert_dir = CertificateManager.get_cert_path()
@@ -71,15 +103,7 @@ class RA:
         if self.psa.connection_allowed(request.origin, request.destination):
             # Connection allowed
             ou = self.register_ou((request.origin.epg.name, request.destination.epg.name))
-            subject = request.csr.get_subject()
-
-            # Override attributes in the CSR (if they are defined)
-            setattr(subject, "C", "NO")
-            setattr(subject, "ST", "Oslo")
-            setattr(subject, "L", "Oslo")
-            setattr(subject, "O", "AC-PKI Corp")
-            setattr(subject, "OU", ou)
-            setattr(subject, "CN", request.origin.name)
+            self.set_subject(request, ou)
 
             crt = CertificateManager.create_cert(request.csr, self.get_next_serial(), self.ca.get_issuer(),
                                                  self.ca.get_keys())
@@ -91,6 +115,121 @@ class RA:
                   .format(request.origin, request.destination))
             return None
 
+    def request_certificates(self, requests):
+        """
+        Handle several certificate requests at once. Connections are checked with the PSA and OUs are registered in
+        bulk, and the certificates are signed in parallel by a pool of worker processes that load the CA key once.
+        :param requests:    List of CertificateRequest objects (AC-PKI model)
+        :return:            List of CertificateResponse objects in the same order as the requests
+        """
+        responses = [CertificateResponse(request) for request in requests]
+
+        # Check requests and connections. Errors are recorded on the response, so the other requests still proceed.
+        checked = []
+        for response in responses:
+            request = response.request
+            if not isinstance(request, CertificateRequest):
+                response.error = RequestError("Certificate request invalid. Must be of type CertificateRequest!")
+                continue
+            try:
+                if not self.psa.connection_allowed(request.origin, request.destination):
+                    print("Connection not allowed between {0} and {1}. Certificate refused."
+                          .format(request.origin, request.destination))
+                    response.refused = True
+                    continue
+                checked.append((response, (request.origin.epg.name, request.destination.epg.name)))
+            except Exception as e:
+                response.error = e
+
+        # Register OUs in bulk, or one at a time if the bulk registration fails
+        try:
+            registered = self.psa.register_ous([eps for _, eps in checked], with_created=True)
+        except Exception:
+            registered = []
+            for response, eps in checked:
+                try:
+                    registered.append(self.psa.register_ous([eps], with_created=True)[0])
+                except Exception as e:
+                    response.error = e
+                    registered.append((None, False))
+
+        # Prepare CSRs
+        allowed = []
+        for (response, _), (ou, _) in zip(checked, registered):
+            if ou is None:
+                continue
+            try:
+                self.set_subject(response.request, ou)
+                allowed.append(response)
+            except Exception as e:
+                response.error = e
+
+        # Sign certificates
+        if len(allowed) <= 1 or self.signing_workers < 1:
+            for response in allowed:
+                try:
+                    response.cert = CertificateManager.create_cert(response.request.csr, self.get_next_serial(),
+                                                                   self.ca.get_issuer(), self.ca.get_keys())
+                except Exception as e:
+                    response.error = e
+        else:
+            pool = self.get_signing_pool()
+            results = []
+            for response in allowed:
+                try:
+                    csr_pem = crypto.dump_certificate_request(crypto.FILETYPE_PEM, response.request.csr)
+                    results.append((response, pool.apply_async(sign_in_worker, (csr_pem, self.get_next_serial()))))
+                except Exception as e:
+                    response.error = e
+            for response, result in results:
+                try:
+                    response.cert = crypto.load_certificate(crypto.FILETYPE_PEM, result.get())
+                except Exception as e:
+                    response.error = e
+
+        # Remove the OUs created for this batch that no certificate was issued with, so that they cannot be used
+        issued = set(ou for (response, _), (ou, _) in zip(checked, registered) if response.cert is not None)
+        for ou, created in registered:
+            if created and ou not in issued:
+                try:
+                    self.psa.remove_ou(ou)
+                except Exception as e:
+                    print("Could not remove OU {0}: {1}".format(ou, e))
+
+        return responses
+
+    def get_signing_pool(self):
+        """
+        Get the pool of signing worker processes, which is created on first use.
+        :return:    The pool
+        """
+        if self.signing_pool is None:
+            cert_pem = crypto.dump_certificate(crypto.FILETYPE_PEM, self.ca.get_root_certificate())
+            key_pem = crypto.dump_privatekey(crypto.FILETYPE_PEM, self.ca.get_keys())
+            self.signing_pool = multiprocessing.Pool(self.signing_workers, init_signing_worker, (cert_pem, key_pem))
+        return self.signing_pool
+
+    def stop_signing_pool(self):
+        if self.signing_pool is not None:
+            self.signing_pool.terminate()
+            self.signing_pool = None
+
+    @staticmethod
+    def set_subject(request, ou):
+        """
+        Override the subject attributes of the CSR in a certificate request (if they are defined).
+        :param request:     The certificate request
+        :param ou:          The OU registered for the request
+        :return:
+        """
+        subject = request.csr.get_subject()
+        setattr(subject, "C", "NO")
+        setattr(subject, "ST", "Oslo")
+        setattr(subject, "L", "Oslo")
+        setattr(subject, "O", "AC-PKI Corp")
+        setattr(subject, "OU", ou)
+        setattr(subject, "CN", request.origin.name)
+
     def register_ou(self, eps):
         """
         Generate an OU reference for any given certificate. This will be used as a reference to that particular pair of
@@ -118,10 +257,12 @@ class CA:
     to look and act similarly to the architecture of a realistic CA implementation.
     """
     def __init__(self, psa):
+        if CONFIG["pki"]["key-pool-size"] > 0 and CertificateManager.key_pool is None:
+            CertificateManager.start_key_pool()
         self.root_cert = self.get_root_certificate()
         self.keys = self.get_keys()  # Must be called after get_root_certificate() to ensure synchronised
         self.psa = psa
-        self.ocsp_responder = OCSPResponder()  # Must be declared before calling the RA
+        self.ocsp_responder = OCSPResponder(self.root_cert, self.keys)  # Must be declared before calling the RA
         self.ra = RA(self, self.psa)
 
     def validate_cert(self, cvr):
@@ -138,7 +279,7 @@ class CA:
         Get the issuer object for the CA
         :return:
         """
-        return self.root_cert.get_issuer()
+        return self.get_root_certificate().get_issuer()
 
     def get_ra(self):
         """
@@ -155,12 +296,13 @@ class CA:
     @staticmethod
     def get_root_certificate():
         """
-        Get the certificate for the root CA
+        Get the certificate for the root CA. The certificate is served from the CertificateManager cache.
         :return:
         """
-        if CertificateManager.cert_file_exists(CONFIG["pki"]["ca-cert-name"]):
+        cert = CertificateManager.load_cert(CONFIG["pki"]["ca-cert-name"])
+        if cert is not None:
             # Certificate exists
-            return CertificateManager.load_cert(CONFIG["pki"]["ca-cert-name"])
+            return cert
         else:
             # Create CA certificate
             pkey = CertificateManager.create_key_pair()
@@ -176,9 +318,11 @@ class CA:
 
     @staticmethod
     def get_keys():
-        pkey_name = CONFIG["pki"]["ca-pkey-name"]
-        if CertificateManager.cert_file_exists(pkey_name):
-            return CertificateManager.load_pkey(pkey_name)
+        """
+        Get the private key of the root CA. The key is served from the CertificateManager cache.
+        :return:
+        """
+        return CertificateManager.load_pkey(CONFIG["pki"]["ca-pkey-name"])
 
 
 # Temporarily and for testing purposes only
@@ -1,36 +1,57 @@
-from acpki.pki import CertificateManager
-import os
+from acpki.pki import CertificateManager, RevocationList
+from acpki.config import CONFIG
+from cryptography.x509 import ocsp
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+from threading import Thread, Event, RLock
+import os, datetime
 
 
 class OCSPResponder:
     """
-    This class represents a simple OCSP responder. It will look a certificate serial number up in a simple text file
-    containing all revoked certificates, and refuse certificates found in the file.
+    This class represents a simple OCSP responder. Revoked certificate serial numbers are loaded from a simple text file
+    into an in-memory index once, and certificates found in the index are refused.
+
+    The responder signs RFC 6960 OCSP responses with the issuer key. Signed responses are cached per serial number and
+    refreshed in the background before they expire, so that servers can staple them without waiting for a signature.
     """
-    def __init__(self):
+    def __init__(self, issuer_cert=None, issuer_key=None):
+        """
+        :param issuer_cert:     Certificate of the CA issuing the certificates (pyOpenSSL X509)
+        :param issuer_key:      Private key of the CA, used to sign responses (pyOpenSSL PKey)
+        """
         self.revoked_file_path = os.path.join(CertificateManager.get_cert_path(), "revoked.txt")
+        self.issuer_cert = issuer_cert
+        self.issuer_key = issuer_key
+        self.validity = datetime.timedelta(seconds=CONFIG["pki"]["ocsp-validity"])
+        self.refresh_margin = datetime.timedelta(seconds=CONFIG["pki"]["ocsp-refresh-margin"])
+
+        self.revoked = None
+        self.responses = {}  # Serial number -> OCSPCacheEntry
+        self.lock = RLock()
+        self.refresh_thread = None
 
-        # Create the file if it does not exist
+        # Load revoked serial numbers, the file is created if it does not exist
         try:
-            if not os.path.exists(self.revoked_file_path):
-                revoked_file = open(self.revoked_file_path, "w")
-                revoked_file.close()
+            self.revoked = RevocationList(self.revoked_file_path)
         except IOError:
             self.revoked_file_path = None
             print("Error: OCSP responder could not be initiated.")
 
+        if self.issuer_cert is not None and self.issuer_key is not None:
+            self.refresh_thread = OCSPRefreshThread(self, CONFIG["pki"]["ocsp-refresh-interval"])
+
     def revoke_serial(self, serial_number):
-        if self.is_revoked(serial_number):
-            print("Certificate \"{0}\" is already revoked.".format(serial_number))
-            return None
         try:
-            revoked_file = open(self.revoked_file_path, "a")
-            revoked_file.write(serial_number + '\n')
-            revoked_file.close()
+            if not self.revoked.add(serial_number):
+                print("Certificate \"{0}\" is already revoked.".format(serial_number))
+                return None
         except IOError as e:
             print("Could not revoke certificate: {0}".format(e))
         else:
             print("Certificate \"{0}\" was revoked successfully.".format(serial_number))
+            self.invalidate(serial_number)
 
     def revoke_certificate(self, certificate):
         self.revoke_serial(certificate.get_serial_number())
@@ -38,28 +59,158 @@ class OCSPResponder:
     def unrevoke_serial(self, serial_number):
         found = False
         try:
-            with open(self.revoked_file_path, "r+") as f:
-                lines = f.readlines()
-                f.seek(0)
-                for line in lines:
-                    if line.strip() != serial_number:
-                        f.write(line)
-                    else:
-                        found = True
-                f.truncate()
+            found = self.revoked.remove(serial_number)
         except IOError as e:
             print("Error: Could not unrevoke certificate \"{0}\": {1}".format(serial_number, e))
 
         if found:
             print("Successfully unrevoked the certificate \"{0}\"".format(serial_number))
+            self.invalidate(serial_number)
         return found
 
     def unrevoke_certificate(self, certificate):
         self.unrevoke_serial(certificate.get_serial_number())
 
     def is_revoked(self, serial_number):
-        revoked_file = open(self.revoked_file_path, "r")
-        for line in revoked_file:
-            if line.strip() == serial_number:
-                return True
-        return False
+        return serial_number in self.revoked
+
+    def get_response(self, certificate):
+        """
+        Get a signed OCSP response for the certificate, which may be stapled in a TLS handshake. The response is served
+        from the cache if it is not about to expire, and signed otherwise. The certificate must be issued by the CA.
+        :param certificate:     Certificate to get the response for (pyOpenSSL X509)
+        :return:                DER encoded OCSP response
+        """
+        serial = str(certificate.get_serial_number())
+        entry = self.responses.get(serial)
+        if entry is not None and datetime.datetime.utcnow() < entry.next_update - self.refresh_margin:
+            return entry.response
+        return self.refresh(serial, certificate)
+
+    def refresh(self, serial, certificate=None):
+        """
+        Sign a new OCSP response for the serial number and put it in the cache.
+        :param serial:          Serial number of the certificate
+        :param certificate:     The certificate, or None to use the certificate of the cached response
+        :return:                DER encoded OCSP response, or None if the certificate is unknown
+        """
+        with self.lock:
+            if certificate is None:
+                entry = self.responses.get(serial)
+                if entry is None:
+                    return None
+                certificate = entry.certificate
+
+            this_update = datetime.datetime.utcnow()
+            next_update = this_update + self.validity
+            response = self.sign_response(certificate, this_update, next_update)
+            self.responses[serial] = OCSPCacheEntry(certificate, response, next_update)
+            return response
+
+    def refresh_expiring(self):
+        """
+        Refresh all cached responses that are about to expire.
+        :return:    Number of refreshed responses
+        """
+        limit = datetime.datetime.utcnow() + self.refresh_margin
+        expiring = [serial for serial, entry in self.responses.items() if entry.next_update <= limit]
+        for serial in expiring:
+            self.refresh(serial)
+        return len(expiring)
+
+    def invalidate(self, serial_number):
+        """
+        Sign a new response for a cached serial number after its revocation status has changed.
+        :param serial_number:   Serial number of the certificate
+        :return:
+        """
+        if str(serial_number) in self.responses:
+            self.refresh(str(serial_number))
+
+    def sign_response(self, certificate, this_update, next_update):
+        if self.issuer_cert is None or self.issuer_key is None:
+            raise ValueError("The OCSP responder needs the issuer certificate and key to sign responses.")
+
+        issuer = self.issuer_cert.to_cryptography()
+        revocation_time = self.revoked.get_revocation_time(certificate.get_serial_number())
+        if revocation_time is not None:
+            status = ocsp.OCSPCertStatus.REVOKED
+        else:
+            status = ocsp.OCSPCertStatus.GOOD
+
+        builder = ocsp.OCSPResponseBuilder()
+        builder = builder.add_response(cert=certificate.to_cryptography(), issuer=issuer, algorithm=hashes.SHA1(),
+                                       cert_status=status, this_update=this_update, next_update=next_update,
+                                       revocation_time=revocation_time, revocation_reason=None)
+        builder = builder.responder_id(ocsp.OCSPResponderEncoding.HASH, issuer)
+        response = builder.sign(self.issuer_key.to_cryptography_key(), hashes.SHA256())
+        return response.public_bytes(serialization.Encoding.DER)
+
+    def stop(self):
+        if self.refresh_thread is not None:
+            self.refresh_thread.stop()
+            self.refresh_thread = None
+
+    @staticmethod
+    def verify_response(data, serial_number, issuer_cert):
+        """
+        Verify a stapled OCSP response without contacting the responder.
+        :param data:            DER encoded OCSP response
+        :param serial_number:   Serial number of the certificate that the response should cover
+        :param issuer_cert:     Certificate of the CA that signed the response (pyOpenSSL X509)
+        :return:                True if the response is valid, signed by the CA and the certificate is not revoked
+        """
+        if not data:
+            return False
+        try:
+            response = ocsp.load_der_ocsp_response(data)
+        except ValueError:
+            return False
+
+        if response.response_status != ocsp.OCSPResponseStatus.SUCCESSFUL:
+            return False
+        if response.serial_number != serial_number or response.certificate_status != ocsp.OCSPCertStatus.GOOD:
+            return False
+
+        now = datetime.datetime.utcnow()
+        if response.this_update > now or (response.next_update is not None and response.next_update < now):
+            return False
+
+        try:
+            issuer_cert.to_cryptography().public_key().verify(response.signature, response.tbs_response_bytes,
+                                                              padding.PKCS1v15(), response.signature_hash_algorithm)
+        except InvalidSignature:
+            return False
+        return True
+
+
+class OCSPCacheEntry:
+    def __init__(self, certificate, response, next_update):
+        self.certificate = certificate
+        self.response = response
+        self.next_update = next_update
+
+
+class OCSPRefreshThread(Thread):
+    """
+    This thread refreshes cached OCSP responses before they expire.
+    """
+    def __init__(self, responder, interval, start=True):
+        super(OCSPRefreshThread, self).__init__()
+        self.daemon = True
+        self.responder = responder
+        self.interval = interval
+        self.stopped = Event()
+
+        if start:
+            self.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.responder.refresh_expiring()
+            except Exception as e:
+                print("Could not refresh OCSP responses: {}".format(e))
+
+    def stop(self):
+        self.stopped.set()
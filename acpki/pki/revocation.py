@@ -0,0 +1,142 @@
+import os, time, datetime
+from threading import RLock
+
+
+class RevocationList:
+    """
+    In-memory index of revoked certificate serial numbers and the time they were revoked, loaded once from file. Changes
+    are appended to the file, where each line is either a revoked serial number followed by the UNIX time it was revoked,
+    or a serial number prefixed with "-" if it was unrevoked. The file is compacted when it contains too many stale
+    lines. Lookups do not lock and the index may be shared across threads.
+    """
+    def __init__(self, file_path, compact_ratio=2.0, compact_min=1000):
+        """
+        :param file_path:           Path to the revocation file
+        :param compact_ratio:       The file is compacted when it has more than compact_ratio lines per revoked serial
+        :param compact_min:         The file is never compacted while it has fewer lines than this
+        """
+        self.file_path = file_path
+        self.compact_ratio = compact_ratio
+        self.compact_min = compact_min
+
+        self.serials = {}   # Serial number -> UNIX time it was revoked
+        self.log = None
+        self.log_lines = 0
+        self.lock = RLock()
+
+        self.load()
+
+    def load(self):
+        with self.lock:
+            serials = {}
+            self.log_lines = 0
+            terminated = True
+            untimed = False
+            if os.path.exists(self.file_path):
+                with open(self.file_path, "r") as f:
+                    for line in f:
+                        terminated = line.endswith("\n")
+                        fields = line.split()
+                        if not fields:
+                            continue
+                        self.log_lines += 1
+                        serial = fields[0]
+                        if serial.startswith("-"):
+                            serials.pop(serial[1:], None)
+                        elif len(fields) > 1 and fields[1].isdigit():
+                            serials[serial] = int(fields[1])
+                        else:
+                            # Written before revocation times were recorded, the time is recorded as of now
+                            serials[serial] = int(time.time())
+                            untimed = True
+
+            self.serials = serials
+            self.log = open(self.file_path, "a")
+            if not terminated:
+                self.log.write("\n")
+            if untimed:
+                self.compact()  # Record the revocation times, so that they do not change on the next load
+            else:
+                self.compact_if_needed()
+
+    def close(self):
+        with self.lock:
+            if self.log is not None:
+                self.log.close()
+                self.log = None
+
+    def add(self, serial):
+        """
+        Revoke a serial number.
+        :param serial:      Serial number
+        :return:            True if the serial number was revoked, False if it was already revoked
+        """
+        serial = str(serial)
+        with self.lock:
+            if serial in self.serials:
+                return False
+            revoked_at = int(time.time())
+            self.write("{0} {1}".format(serial, revoked_at))
+            self.serials[serial] = revoked_at
+        return True
+
+    def remove(self, serial):
+        """
+        Unrevoke a serial number.
+        :param serial:      Serial number
+        :return:            True if the serial number was revoked, False otherwise
+        """
+        serial = str(serial)
+        with self.lock:
+            if serial not in self.serials:
+                return False
+            self.write("-" + serial)
+            del self.serials[serial]
+            self.compact_if_needed()
+        return True
+
+    def write(self, line):
+        self.log.write(line + "\n")
+        self.log.flush()
+        os.fsync(self.log.fileno())
+        self.log_lines += 1
+
+    def compact_if_needed(self):
+        if self.log_lines >= self.compact_min and self.log_lines > self.compact_ratio * len(self.serials):
+            self.compact()
+
+    def compact(self):
+        """
+        Rewrite the file so that it only contains the revoked serial numbers.
+        :return:
+        """
+        with self.lock:
+            tmp_path = self.file_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                for serial, revoked_at in self.serials.iteritems():
+                    f.write("{0} {1}\n".format(serial, revoked_at))
+                f.flush()
+                os.fsync(f.fileno())
+
+            if self.log is not None:
+                self.log.close()
+            os.rename(tmp_path, self.file_path)
+            self.log = open(self.file_path, "a")
+            self.log_lines = len(self.serials)
+
+    def get_revocation_time(self, serial):
+        """
+        :param serial:      Serial number
+        :return:            The time the serial number was revoked as a naive UTC datetime, or None if it is not revoked
+        """
+        revoked_at = self.serials.get(str(serial))
+        if revoked_at is None:
+            return None
+        return datetime.datetime.utcfromtimestamp(revoked_at)
+
+    def __contains__(self, serial):
+        return str(serial) in self.serials
+
+    def __len__(self):
+        return len(self.serials)
+
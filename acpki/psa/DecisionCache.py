@@ -0,0 +1,91 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class DecisionCache:
+    """
+    LRU cache of certificate validation decisions with a time to live (TTL). Decisions are keyed by the subject OU of
+    the certificate, origin and destination, which are everything a decision depends on, and stamped with the policy
+    generation they were made in. A decision from an older generation is never returned, so every change to EPGs,
+    contracts or OUs invalidates the cache immediately.
+    """
+    def __init__(self, max_size=10000, ttl=300):
+        """
+        :param max_size:    Maximum number of cached decisions, the least recently used decision is evicted first
+        :param ttl:         Seconds a decision is kept in the cache
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # Key -> (generation, expiry time, decision)
+        self.lock = Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    @staticmethod
+    def make_key(ou, origin, destination):
+        """
+        :param ou:              Subject OU of the certificate
+        :param origin:          The origin endpoint
+        :param destination:     The destination endpoint
+        :return:                Cache key
+        """
+        return ou, origin.name, DecisionCache.get_epg_key(origin), destination.name, \
+            DecisionCache.get_epg_key(destination)
+
+    @staticmethod
+    def get_epg_key(ep):
+        # The EPG of an endpoint may be given either as an EPG or a name
+        return getattr(ep.epg, "dn", ep.epg)
+
+    def get(self, key, generation):
+        """
+        Get a cached decision.
+        :param key:         Key from make_key()
+        :param generation:  The current policy generation
+        :return:            The decision, or None if it is not cached, has expired or is from an older generation
+        """
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] != generation or entry[1] < time.time():
+                self.misses += 1
+                self.stale += 1
+                return None
+            self.entries[key] = entry  # Reinsert as most recently used
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key, generation, decision):
+        """
+        Cache a decision.
+        :param key:         Key from make_key()
+        :param generation:  The policy generation read before the decision was made
+        :param decision:    The PolicyDecision
+        :return:
+        """
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (generation, time.time() + self.ttl, decision)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max-size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "hit-rate": float(self.hits) / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,190 @@
+import time
+from collections import OrderedDict
+from threading import Thread, Condition, Lock
+from acpki.models import EPGUpdate
+
+
+class EventCoalescer:
+    """
+    Collects subscription events for a short window and combines the events of each DN, so that a burst of changes is
+    applied as one batch. An object that is created and deleted within the window is skipped, repeated modifications
+    are merged into one, and a modification of an object created within the window is merged into its creation. An
+    object that is deleted and created again within the window is deleted before it is created, so that it is replaced.
+    The batch is ordered so that contracts are deleted before their EPGs and EPGs are created before their contracts.
+    """
+    def __init__(self, apply_cb, window=0.05, max_batch=1000, start=True):
+        """
+        :param apply_cb:    Method that applies a batch, called with a list of events and returning the number of
+                            events applied, or None if all of them were applied
+        :param window:      Seconds from the first event of a batch is received until the batch is applied. 0 applies
+                            events immediately without coalescing them.
+        :param max_batch:   The batch is applied before the window has passed if it has events for this many DNs
+        :param start:       Whether to start the coalescer upon creation
+        """
+        self.apply_cb = apply_cb
+        self.window = window
+        self.max_batch = max_batch
+
+        self.cond = Condition()
+        self.apply_lock = Lock()    # Applies batches one at a time, in the order they were collected
+        self.pending = OrderedDict()  # DN -> (status of first event, deletion before a re-creation, combined event)
+        self.deadline = None
+        self.running = False
+        self.thread = None
+
+        # Statistics
+        self.received = 0
+        self.applied = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.batches = 0
+
+        if start:
+            self.start()
+
+    def start(self):
+        with self.cond:
+            if self.running or self.window <= 0:
+                return
+            self.running = True
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the coalescer after applying the pending events.
+        :return:
+        """
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        self.flush()
+
+    def add(self, events):
+        """
+        Add events to the current batch.
+        :param events:  List of events, e.g. EPGUpdate and ContractUpdate objects
+        :return:
+        """
+        if not self.running:
+            with self.apply_lock:
+                self.apply(self.combine(events))
+            return
+        with self.cond:
+            for event in events:
+                self.put(self.pending, event)
+            if self.deadline is None:
+                self.deadline = time.time() + self.window
+            if len(self.pending) >= self.max_batch:
+                self.deadline = 0
+            self.cond.notify_all()
+
+    def combine(self, events):
+        batch = OrderedDict()
+        with self.cond:
+            for event in events:
+                self.put(batch, event)
+        return self.order(batch)
+
+    def put(self, pending, event):
+        """
+        Combine an event with the earlier events of its DN. Must be called while holding the lock.
+        :param pending:     Dictionary of DN -> (status of first event, deletion before a re-creation, combined event)
+        :param event:       The event to add
+        :return:
+        """
+        self.received += 1
+        entry = pending.get(event.dn)
+        if entry is None:
+            pending[event.dn] = (event.status, None, event)
+            return
+
+        first_status, deletion, current = entry
+        if event.status == "deleted":
+            if first_status == "created":
+                # Created and deleted within the window, the object was never known
+                del pending[event.dn]
+                self.cancelled += 1
+                return
+            deletion = None
+            combined = event
+        elif event.status == "modified":
+            if current.status == "deleted":
+                return  # The object no longer exists
+            combined = current.merge(event, current.status)
+        else:
+            if current.status == "deleted":
+                # Deleted and created again, the deletion is kept so that the old object is removed along with its
+                # contracts and held events
+                deletion = current
+            combined = event
+        pending[event.dn] = (first_status, deletion, combined)
+
+    @staticmethod
+    def order(batch):
+        """
+        Order a batch so that deletions of contracts and other children come first, then EPGs are deleted, created and
+        modified, and finally contracts and other children are created and modified.
+        :param batch:   Dictionary of DN -> (status of first event, deletion before a re-creation, combined event)
+        :return:        List of events
+        """
+        phases = ([], [], [], [])
+        for _, deletion, event in batch.itervalues():
+            is_epg = isinstance(event, EPGUpdate)
+            if deletion is not None:
+                phases[1 if is_epg else 0].append(deletion)
+            if event.status == "deleted":
+                phases[1 if is_epg else 0].append(event)
+            else:
+                phases[2 if is_epg else 3].append(event)
+        return phases[0] + phases[1] + phases[2] + phases[3]
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.running and (self.deadline is None or self.deadline > time.time()):
+                    self.cond.wait(None if self.deadline is None else max(0.001, self.deadline - time.time()))
+                if not self.running:
+                    return
+            self.flush()
+
+    def flush(self):
+        """
+        Apply the pending events now.
+        :return:    Number of events applied
+        """
+        with self.apply_lock:
+            with self.cond:
+                batch, self.pending = self.pending, OrderedDict()
+                self.deadline = None
+            return self.apply(self.order(batch))
+
+    def apply(self, events):
+        # Must be called while holding the apply lock
+        if not events:
+            return 0
+        try:
+            applied = self.apply_cb(events)
+            if applied is None:
+                applied = len(events)
+        except Exception as e:
+            print("Could not apply subscription events: {}".format(e))
+            applied = 0
+        with self.cond:
+            self.applied += applied
+            self.failed += len(events) - applied
+            if applied:
+                self.batches += 1
+        return applied
+
+    def get_stats(self):
+        with self.cond:
+            return {
+                "pending": len(self.pending),
+                "received": self.received,
+                "applied": self.applied,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+                "batches": self.batches,
+            }
@@ -0,0 +1,213 @@
+import os, time
+from threading import RLock, Timer
+from acpki.util.randomness import random_string
+
+
+class OURegistry:
+    """
+    Bidirectional registry of OUs and the (origin, destination) tuples they were registered for, with lookups in both
+    directions. The registry is persisted in an append-only log where each line is either "ou;origin;destination" for a
+    registration or "ou;;" for a removal. The log is flushed on every write, but only synced to disk in batches, and it
+    is compacted when it contains too many stale lines compared to the number of registered OUs. A background timer
+    syncs the log when no further write arrives within the sync interval.
+    """
+    def __init__(self, file_path, fsync_batch=100, fsync_interval=1.0, compact_ratio=2.0, compact_min=1000):
+        """
+        :param file_path:       Path to the log file
+        :param fsync_batch:     Maximum number of writes before the log is synced to disk
+        :param fsync_interval:  Maximum number of seconds between a write and the log being synced to disk
+        :param compact_ratio:   The log is compacted when it has more than compact_ratio lines per registered OU
+        :param compact_min:     The log is never compacted while it has fewer lines than this
+        """
+        self.file_path = file_path
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.compact_ratio = compact_ratio
+        self.compact_min = compact_min
+
+        self.ous = {}       # OU -> (origin, destination)
+        self.pairs = {}     # (origin, destination) -> OU
+        self.log = None
+        self.log_lines = 0
+        self.unsynced = 0
+        self.synced = time.time()
+        self.sync_timer = None
+        self.version = 0    # Incremented whenever an OU is registered or removed
+        self.lock = RLock()
+
+        self.load()
+
+    def load(self):
+        """
+        Load the registry from the log file and open it for appending.
+        :return:
+        """
+        with self.lock:
+            self.ous = {}
+            self.pairs = {}
+            self.log_lines = 0
+            terminated = True
+            if os.path.exists(self.file_path):
+                with open(self.file_path, "r") as f:
+                    for line in f:
+                        terminated = line.endswith("\n")
+                        vals = line.rstrip("\r\n").split(";")
+                        if len(vals) != 3:
+                            continue
+                        self.log_lines += 1
+                        if vals[1] or vals[2]:
+                            self.put(vals[0], (vals[1], vals[2]))
+                        else:
+                            self.pop(vals[0])
+
+            self.log = open(self.file_path, "a")
+            if not terminated:
+                self.log.write("\n")  # Ensure that the next registration starts on a new line
+            self.compact_if_needed()
+
+    def close(self):
+        with self.lock:
+            if self.sync_timer is not None:
+                self.sync_timer.cancel()
+                self.sync_timer = None
+            if self.log is not None:
+                self.sync()
+                self.log.close()
+                self.log = None
+
+    def get(self, ou):
+        """
+        Get the (origin, destination) tuple that an OU was registered for.
+        :param ou:      The OU
+        :return:        Tuple of (origin, destination), or None if the OU is not registered
+        """
+        return self.ous.get(ou)
+
+    def get_ou(self, eps):
+        """
+        Get the OU registered for an (origin, destination) tuple.
+        :param eps:     Tuple of (origin, destination)
+        :return:        The OU, or None if the tuple is not registered
+        """
+        return self.pairs.get(eps)
+
+    def register(self, eps):
+        """
+        Register a new OU for the (origin, destination) tuple, unless one is already registered.
+        :param eps:     Tuple of (origin, destination)
+        :return:        Tuple of (OU, True if the OU was created or False if it was already registered)
+        """
+        return self.register_many([eps])[0]
+
+    def register_many(self, eps_list):
+        """
+        Register OUs for several (origin, destination) tuples, writing all new registrations to the log at once.
+        :param eps_list:    List of (origin, destination) tuples
+        :return:            List of (OU, created) tuples in the same order as eps_list
+        """
+        results = []
+        with self.lock:
+            for eps in eps_list:
+                ou = self.pairs.get(eps)
+                if ou is not None:
+                    results.append((ou, False))
+                    continue
+
+                ou = random_string(32)  # Generate random string, no need to check for duplicates
+                self.put(ou, eps)
+                self.write("{0};{1};{2}\n".format(ou, eps[0], eps[1]))
+                results.append((ou, True))
+
+            self.flush()
+        return results
+
+    def remove(self, ou):
+        """
+        Remove an OU from the registry.
+        :param ou:      OU to remove
+        :return:        True if the OU was found, False otherwise
+        """
+        with self.lock:
+            if self.pop(ou) is None:
+                return False
+            self.write("{0};;\n".format(ou))
+            self.flush()
+            self.compact_if_needed()
+        return True
+
+    def put(self, ou, eps):
+        self.pop(ou)
+        self.ous[ou] = eps
+        self.pairs[eps] = ou
+        self.version += 1
+
+    def pop(self, ou):
+        eps = self.ous.pop(ou, None)
+        if eps is not None:
+            if self.pairs.get(eps) == ou:
+                del self.pairs[eps]
+            self.version += 1
+        return eps
+
+    def write(self, line):
+        self.log.write(line)
+        self.log_lines += 1
+        self.unsynced += 1
+
+    def flush(self):
+        """
+        Flush the log to the operating system, and sync it to disk if the batch size or interval has been reached.
+        :return:
+        """
+        self.log.flush()
+        if self.unsynced >= self.fsync_batch or time.time() - self.synced >= self.fsync_interval:
+            self.sync()
+        elif self.unsynced and self.sync_timer is None:
+            # Sync within the interval even if no further write arrives
+            self.sync_timer = Timer(self.fsync_interval, self.sync_pending)
+            self.sync_timer.daemon = True
+            self.sync_timer.start()
+
+    def sync_pending(self):
+        with self.lock:
+            self.sync_timer = None
+            if self.unsynced and self.log is not None:
+                self.sync()
+
+    def sync(self):
+        self.log.flush()
+        os.fsync(self.log.fileno())
+        self.unsynced = 0
+        self.synced = time.time()
+
+    def compact_if_needed(self):
+        if self.log_lines >= self.compact_min and self.log_lines > self.compact_ratio * len(self.ous):
+            self.compact()
+
+    def compact(self):
+        """
+        Rewrite the log so that it only contains the registered OUs. The new log is written to a temporary file which
+        replaces the old log once it is synced to disk.
+        :return:
+        """
+        with self.lock:
+            tmp_path = self.file_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                for ou, eps in self.ous.iteritems():
+                    f.write("{0};{1};{2}\n".format(ou, eps[0], eps[1]))
+                f.flush()
+                os.fsync(f.fileno())
+
+            if self.log is not None:
+                self.log.close()
+            os.rename(tmp_path, self.file_path)
+            self.log = open(self.file_path, "a")
+            self.log_lines = len(self.ous)
+            self.unsynced = 0
+            self.synced = time.time()
+
+    def __len__(self):
+        return len(self.ous)
+
+    def __contains__(self, ou):
+        return ou in self.ous
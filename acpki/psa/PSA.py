@@ -1,8 +1,9 @@
-import json, string, random, os
+import string, random, os
+from threading import RLock
 from acpki.aci import ACIAdapter
-from acpki.models import EPG, CertificateValidationRequest, Contract
-from acpki.util.randomness import random_string
-from acpki.util.exceptions import NotFoundError
+from acpki.psa import PolicyStore, OURegistry, EventCoalescer, PendingEvents, DecisionCache
+from acpki.models import EPG, EPGUpdate, CertificateValidationRequest, Contract, ContractUpdate, PolicyDecision
+from acpki.util.exceptions import NotFoundError, RequestError
 from acpki.config import CONFIG
 
 
@@ -13,15 +14,30 @@ class PSA:
     an internal model of the most critical data in the Cisco APIC, so it can continue operations even if the APIC is
     unavailable for a while during runtime.
     """
-    def __init__(self, ca):
+    def __init__(self, ca=None):
+        """
+        :param ca:      The CA or RA using the PSA. May be None, e.g. when the PSA is benchmarked on its own.
+        """
         self.ca = ca
-        self.ra = ca.ra
-        self.ocsp_responder = ca.ocsp_responder
+        self.ra = getattr(ca, "ra", None)
+        self.ocsp_responder = getattr(ca, "ocsp_responder", None)
 
         self.verbose = CONFIG["verbose"]
-        self.epgs = []
-        self.ous = {}
+        self.store = PolicyStore()
+        self.lock = RLock()     # Held while the store is changed. Readers use the current snapshot without locking.
+        self.ous = None
         self.ous_file = CONFIG["psa"]["ous-file"]
+        self.bulk_load = CONFIG["psa"]["bulk-load"]
+        self.decisions = None
+        if CONFIG["psa"]["decision-cache-size"] > 0:
+            self.decisions = DecisionCache(CONFIG["psa"]["decision-cache-size"], CONFIG["psa"]["decision-cache-ttl"])
+        self.handlers = {
+            EPGUpdate: self.epg_cb,
+            ContractUpdate: self.contract_cb,
+        }
+        self.pending = PendingEvents(self.fetch_epg, timeout=CONFIG["psa"]["pending-timeout"])
+        self.coalescer = EventCoalescer(self.apply_events, window=CONFIG["psa"]["event-window"],
+                                        max_batch=CONFIG["psa"]["event-max-batch"])
 
         self.adapter = ACIAdapter()
         self.main()
@@ -32,36 +48,71 @@ class PSA:
 
         self.adapter.connect(auto_prepare=True)
 
+        # Changes are not sent while the subscriptions are created again after logging in again, so reload everything
+        self.adapter.session.resubscribe_cb = self.reload_epgs_and_contracts
         self.load_epgs_and_contracts()
 
     def setup(self):
-        # Check that OUs file exists and load
-        if os.path.exists(self.ous_file):
-            # Load OUs
-            with open(self.ous_file, "r") as f:
-                data = f.readlines()
-                for line in data:
-                    vals = line.split(";")
-                    if len(vals) != 3:
-                        continue
-                    self.ous[vals[0]] = (vals[1], vals[2])
-        else:
-            open(self.ous_file, "w")
+        # Load OUs, the file is created if it does not exist
+        self.ous = OURegistry(self.ous_file, fsync_batch=CONFIG["psa"]["ous-fsync-batch"],
+                              fsync_interval=CONFIG["psa"]["ous-fsync-interval"],
+                              compact_ratio=CONFIG["psa"]["ous-compact-ratio"])
+
+    @property
+    def epgs(self):
+        return self.store.snapshot.get_epgs()
 
     def get_epg(self, epg_name):
-        for epg in self.epgs:
-            if epg.name == epg_name:
-                return epg
-        if self.verbose:
+        epg = self.store.snapshot.get_epg_by_name(epg_name)
+        if epg is None and self.verbose:
             print("Warning: Did not find the EPG: {}".format(epg_name))
-        return None
+        return epg
+
+    @staticmethod
+    def resolve_epg(ep, snapshot):
+        """
+        Get the EPG of an endpoint from a policy snapshot. The EPG of the endpoint may be given either as an EPG or a
+        name.
+        :param ep:          The endpoint
+        :param snapshot:    The PolicySnapshot
+        :return:            The EPG, or None if the endpoint has no known EPG
+        """
+        if ep.epg is None:
+            return None
+        if isinstance(ep.epg, EPG):
+            return snapshot.get_epg(ep.epg.dn)
+        return snapshot.get_epg_by_name(ep.epg)
 
     def load_epgs_and_contracts(self):
+        """
+        Load all EPGs and their contracts from the APIC. The bulk query is used by default, and the per-EPG queries are
+        used if bulk loading is disabled in the configuration or fails.
+        :return:
+        """
+        if self.bulk_load:
+            try:
+                epgs = self.adapter.get_epgs_and_contracts(self.sub_cb)
+                with self.lock:
+                    self.store.load(epgs)
+                return
+            except RequestError as e:
+                print("Bulk loading of EPGs and contracts failed, falling back to per-EPG queries: {}".format(e))
+
+        self.load_epgs_and_contracts_per_epg()
+
+    def reload_epgs_and_contracts(self):
+        """
+        Reload all EPGs and contracts, merging reloads requested by concurrent subscription callbacks into one.
+        :return:
+        """
+        self.adapter.session.run_once("load-epgs-and-contracts", self.load_epgs_and_contracts)
+
+    def load_epgs_and_contracts_per_epg(self):
         # Load EPGs and contracts
-        self.epgs = self.adapter.get_epgs(self.sub_cb)
-        for epg in self.epgs:
-            epg.consumes = self.adapter.get_consumed_contracts(epg.name, callback=self.sub_cb)
-            epg.provides = self.adapter.get_provided_contracts(epg.name, callback=self.sub_cb)
+        epgs = self.adapter.get_epgs(self.sub_cb)
+        self.adapter.get_contracts_for_epgs(epgs, callback=self.sub_cb)
+        with self.lock:
+            self.store.load(epgs)
 
     def get_contracts(self, origin, destination):
         """
@@ -71,20 +122,21 @@ class PSA:
         :return:                List of contracts
         """
         contracts = []
+        snapshot = self.store.snapshot
+        origin_epg = self.resolve_epg(origin, snapshot)
+        destination_epg = self.resolve_epg(destination, snapshot)
+        if origin_epg is None or destination_epg is None:
+            return contracts
 
         # Find contracts consumed by origin and provided by destination
-        if origin.epg is not None:
-            for cons in origin.epg.consumes:
-                for prov in destination.epg.provides:
-                    if cons.uid == prov.uid:
-                        contracts.append(cons)
+        uids = snapshot.get_shared_uids(origin_epg.dn, destination_epg.dn)
+        if uids:
+            contracts.extend(con for con in origin_epg.consumes if con.uid in uids)
 
         # Find contracts provided by origin and consumed by destination
-        if destination.epg is not None:
-            for prov in origin.epg.provides:
-                for cons in destination.epg.consumes:
-                    if prov.uid == cons.uid:
-                        contracts.append(prov)
+        uids = snapshot.get_shared_uids(destination_epg.dn, origin_epg.dn)
+        if uids:
+            contracts.extend(con for con in origin_epg.provides if con.uid in uids)
 
         return contracts
 
@@ -93,37 +145,67 @@ class PSA:
 
     def validate_certificate(self, cvr):
         """
-        Validate a certificate based on a Certificate Validation Request (CVR).
+        Validate a certificate based on a Certificate Validation Request (CVR). Decisions are cached by the subject OU of
+        the certificate, origin and destination until the EPGs, contracts or OUs change.
         :param cvr:     The CVR to validate
-        :return:        True if valid, False otherwise
+        :return:        PolicyDecision, which is true if valid
         """
+        if self.decisions is None:
+            return self.make_decision(cvr)
+
+        # The generation is read before the decision is made, so a decision is never cached for a newer generation
+        key = DecisionCache.make_key(cvr.cert.get_subject().OU, cvr.origin, cvr.destination)
+        generation = self.get_generation()
+        decision = self.decisions.get(key, generation)
+        if decision is None:
+            decision = self.make_decision(cvr)
+            self.decisions.put(key, generation, decision)
+        return decision
+
+    def make_decision(self, cvr):
+        snapshot = self.store.snapshot
 
         # Check contract between EPGs
-        if not self.connection_allowed(cvr.origin, cvr.destination):
-            return False
+        if not self.check_connection(cvr.origin, cvr.destination, snapshot):
+            return PolicyDecision(False, snapshot.version)
 
-        # Check OU
+        # Check that the OU was registered for the origin and destination
         subject = cvr.cert.get_subject()
-        valid_ous = []
+        return PolicyDecision(self.ous.get(subject.OU) == (cvr.origin.name, cvr.destination.name), snapshot.version)
 
-        # Load valid OUs from dictionary
-        for key, val in self.ous.iteritems():
-            if val == (cvr.origin.name, cvr.destination.name):
-                valid_ous.append(key)
-
-        subj_ou = subject.OU
-        valid = subj_ou in valid_ous
+    def get_generation(self):
+        """
+        Get the policy generation, which changes whenever an EPG, contract or OU changes.
+        :return:    Tuple of the policy snapshot version and the OU registry version
+        """
+        return self.store.version, self.ous.version
 
-        return valid
+    def get_decision_cache_stats(self):
+        """
+        Get statistics for the certificate validation cache, including its hit rate and size.
+        :return:    Dictionary of statistics, or None if the cache is disabled
+        """
+        if self.decisions is None:
+            return None
+        return self.decisions.get_stats()
 
     def connection_allowed(self, origin, destination):
         """
         Connection is allowed if there exists one or more contracts between the origin and destination EPG.
         :param origin:          The origin endpoint for communications
         :param destination:     The destination endpoint for communications
-        :return:                True if allowed, False otherwise
+        :return:                PolicyDecision, which is true if allowed
         """
-        return len(self.get_contracts(origin, destination)) > 0
+        snapshot = self.store.snapshot
+        return PolicyDecision(self.check_connection(origin, destination, snapshot), snapshot.version)
+
+    def check_connection(self, origin, destination, snapshot):
+        origin_epg = self.resolve_epg(origin, snapshot)
+        destination_epg = self.resolve_epg(destination, snapshot)
+        if origin_epg is None or destination_epg is None:
+            return False
+        return (snapshot.consumes_from(origin_epg.dn, destination_epg.dn) or
+                snapshot.consumes_from(destination_epg.dn, origin_epg.dn))
 
     def register_ou(self, eps):
         """
@@ -136,142 +218,151 @@ class PSA:
         if not isinstance(eps, tuple) or len(eps) != 2:
             raise ValueError("Endpoint must be tuple of length 2.")
 
-        # Check if request is already registered
-        for key, val in self.ous.iteritems():
-            if val == eps:
-                if self.verbose:
-                    print("OU {0} already contained endpoints {1} and {2}".format(key, eps[0], eps[1]))
-                return key  # Return the OU for which the request was found
-
-        # Not found - create
-        ou = random_string(32)  # Generate random string, no need to check for duplicates... P(Collision) =~ 2.3e+57
-        self.ous[ou] = eps
-
-        # Save to file
-        with open(self.ous_file, "a") as f:
-            f.write("{0};{1};{2}\n".format(ou, eps[1], eps[2]))
+        # Register, or get the OU if the request is already registered
+        ou, created = self.ous.register(eps)
 
         # Print and return
         if self.verbose:
-            print("Registered new OU {0} between EPs {1} and {2}".format(ou, eps[0], eps[1]))
+            if created:
+                print("Registered new OU {0} between EPs {1} and {2}".format(ou, eps[0], eps[1]))
+            else:
+                print("OU {0} already contained endpoints {1} and {2}".format(ou, eps[0], eps[1]))
         return ou
 
+    def register_ous(self, eps_list, with_created=False):
+        """
+        Register OUs for several tuples of endpoints at once. See register_ou().
+        :param eps_list:        List of tuples containing the origin and destination endpoint, respectively
+        :param with_created:    Return a tuple of the OU and whether it was created for each tuple of endpoints
+        :return:                List of OUs in the same order as eps_list
+        """
+        for eps in eps_list:
+            if not isinstance(eps, tuple) or len(eps) != 2:
+                raise ValueError("Endpoint must be tuple of length 2.")
+
+        results = self.ous.register_many(eps_list)
+        if self.verbose:
+            created = sum(1 for _, new in results if new)
+            print("Registered {0} new OUs for {1} tuples of endpoints".format(created, len(eps_list)))
+        if with_created:
+            return results
+        return [ou for ou, _ in results]
+
     def remove_ou(self, ou):
         """
         Remove the given OU from dict.
         :param ou:      OU to delete
         :return:        True if OU was found, False otherwise
         """
-        return self.ous.pop(ou, None) is not None
+        return self.ous.remove(ou)
 
-    def sub_cb(self, opcode, data):
+    def sub_cb(self, opcode, events):
         """
-        Subscription callback method, which is called whenever a subscription receives a new update. The method will
-        forward the data to its corresponding sub callback method, e.g. for EPGs or contracts.
+        Subscription callback method, which is called whenever a subscription receives a new update. The events are
+        passed to the coalescer, which combines the events received within a short window and applies them as one batch.
         :param opcode:      Unique identifier that corresponds to the socket with which the callback was received
-        :param data:        JSON data with the item(s) that have been updated
+        :param events:      Events decoded from the subscription data, e.g. EPGUpdate and ContractUpdate objects
         :return:
         """
-        json_obj = json.loads(data)
-        subId = json_obj["subscriptionId"]
-
-        # Iterate through updates in subscription data and call specific callback method
-        for item in json_obj["imdata"]:
-            if "fvAEPg" in item:
-                # Endpoint groups updated
-                self.epg_cb(item["fvAEPg"]["attributes"])
-            elif "fvRsProv" in item:
-                # Provided contracts updated
-                self.contract_cb("prov", item["fvRsProv"]["attributes"])
-            elif "fvRsCons" in item:
-                # Consumed contracts updated
-                self.contract_cb("cons", item["fvRsCons"]["attributes"])
-            else:
-                print("Unknown subscription callback: {}".format(item))
+        self.coalescer.add(events)
 
-    def epg_cb(self, attrs):
+    def apply_events(self, events):
+        """
+        Apply a batch of events, forwarding each event to its corresponding sub callback method, e.g. for EPGs or
+        contracts. The changes are published as one policy snapshot. An event that cannot be applied is skipped, and
+        the changes it made before it failed are reverted, so that the other events of the batch are still applied.
+        :param events:      List of events
+        :return:            Number of events applied
+        """
+        applied = 0
+        with self.lock, self.store.batch():
+            for event in events:
+                handler = self.handlers.get(type(event))
+                if handler is None:
+                    print("Unknown subscription callback: {0} {1}".format(event.cls, event.dn))
+                    continue
+                try:
+                    with self.store.savepoint():
+                        handler(event)
+                    applied += 1
+                except Exception as e:
+                    print("Could not apply subscription event for {0}: {1}".format(event.dn, e))
+        return applied
+
+    def fetch_epg(self, epg_dn):
+        """
+        Fetch an EPG and its contracts from the APIC after events for it have been held without the EPG arriving. The
+        held events are replayed on the fetched EPG, or discarded if the EPG does not exist.
+        :param epg_dn:      DN of the EPG
+        :return:
+        """
+        epg = self.adapter.get_epg_subtree(epg_dn)
+        with self.lock, self.store.batch():
+            # If the EPG was created or deleted while it was fetched, its events have already been popped
+            events = self.pending.pop(epg_dn, replay=epg is not None)
+            if not events:
+                return
+            if epg is None:
+                print("EPG {} was not found. Discarded its contract events.".format(epg_dn))
+                return
+            self.store.put_epg(epg)
+            if self.verbose:
+                print("Endpoint group \"{0}\" was fetched from the APIC.".format(epg.name))
+            for event in events:
+                self.contract_cb(event)
+
+    def epg_cb(self, event):
         """
         This callback method is called if a subscription callback concerns an EPG, and will create, modify or delete an
         existing endpoint in the local self.epgs list.
-        :param attrs:   The attributes received from the JSON object in the subscription
+        :param event:   The EPGUpdate received from the subscription
         :return:
         """
-        if attrs["status"] == "created":
-            # Add EPG to local list
-            epg = EPG(attrs["dn"], attrs["name"])
+        if event.status == "created":
+            # Add EPG to the store, and replay contract events received before the EPG
+            epg = EPG(event.dn, event.name)
+            self.store.add_epg(epg)
             if self.verbose:
                 print("Endpoint group \"{0}\" was added to the PSA.".format(epg.name))
-            self.epgs.append(epg)
-        elif attrs["status"] == "modified":
-            # Modify existing EPG
-            name = attrs["name"] if "name" in attrs else None
-            epg = EPG(attrs["dn"], name)
-            for i, epg_local in enumerate(self.epgs):
-                if epg_local.equals(epg):
-                    if epg.name is None:
-                        epg.name = self.epgs[i].name  # Workaround for when the name is not sent along with the EPG
-                    self.epgs[i] = epg
-                    if self.verbose:
-                        print("Endpoint group \"{0}\" was modified.".format(epg.name))
-                    break
-        elif attrs["status"] == "deleted":
-            # Delete EPG from local list
-            for i, epg_local in enumerate(self.epgs):
-                if epg_local.dn == attrs["dn"]:
-                    name = self.epgs[i].name
-                    del self.epgs[i]
-                    if self.verbose:
-                        print("Endpoint group \"{0}\" was deleted.".format(name))
-                    break
+            for pending in self.pending.pop(epg.dn):
+                self.contract_cb(pending)
+        elif event.status == "modified":
+            # Modify existing EPG, the name is not always sent along with the EPG
+            epg = self.store.update_epg(event.dn, event.name)
+            if epg is not None and self.verbose:
+                print("Endpoint group \"{0}\" was modified.".format(epg.name))
+        elif event.status == "deleted":
+            # Delete EPG from the store, along with contract events held for it
+            self.pending.pop(event.dn, replay=False)
+            epg = self.store.remove_epg(event.dn)
+            if epg is not None and self.verbose:
+                print("Endpoint group \"{0}\" was deleted.".format(epg.name))
         elif self.verbose:
             # Unknown status
-            print("Skipped unknown operation \"{0}\" for EPG: {1}".format(attrs["status"], attrs["dn"]))
+            print("Skipped unknown operation \"{0}\" for EPG: {1}".format(event.status, event.dn))
 
-    def contract_cb(self, action, attrs):
-        if attrs["status"] == "created":
+    def contract_cb(self, event):
+        """
+        This callback method is called if a subscription callback concerns a provided or consumed contract.
+        :param event:   The ContractUpdate received from the subscription
+        :return:
+        """
+        if event.status == "created":
             # Create contract
-            con = Contract(attrs["uid"], attrs["tnVzBrCPName"], attrs["dn"])
-            epg_name = attrs["dn"].split("/")[3][4:]  # Workaround to extract the EPG name from contract DN
-            found = False
-            for epg in self.epgs:
-                if epg.name == epg_name:
-                    found = True
-                    if action == "prov":
-                        epg.provides.append(con)
-                    else:
-                        epg.consumes.append(con)
-            if not found:
-                # Reload EPGs and contracts
-                print("Error! Could not find EPG {} and could therefore not append new contract from callback."
-                      .format(epg_name))
-                self.load_epgs_and_contracts()
-        elif attrs["status"] == "deleted":
-            # Delete contract
-            con_dn = attrs["dn"]  # On deletion contracts only have DN set and not "tnVzBrCPName"
-            epg_name = con_dn.split("/")[3][4:]  # Workaround to extract EPG name from contract DN
-            found = False
-            for epg in self.epgs:
-                if epg.name == epg_name:
-                    # Found the correct EPG
-                    if action == "cons":
-                        # Delete consumed contract
-                        for i, con in enumerate(epg.consumes):
-                            if con.dn == con_dn:
-                                found = True
-                                epg.consumes.pop(i)
-                    else:
-                        # Delete provided contract
-                        for i, con in enumerate(epg.provides):
-                            if con.dn == con_dn:
-                                found = True
-                                epg.provides.pop(i)
-
-            if not found:
-                print("Deleting contract from EPG {} failed because it was not found.".format(epg_name))
-        elif attrs["updated"]:
+            con = Contract(event.uid, event.name, event.dn)
+            if not self.store.add_contract(event.epg_dn, event.action, con):
+                # Hold the event until the EPG arrives, or is fetched after a timeout
+                if self.verbose:
+                    print("EPG {} is not known yet. Holding contract event until it arrives.".format(event.epg_dn))
+                self.pending.add(event.epg_dn, event)
+        elif event.status == "deleted":
+            # Delete contract, on deletion contracts only have DN set and not "tnVzBrCPName"
+            if self.store.remove_contract(event.dn) is None and not self.pending.remove(event.epg_dn, event.dn):
+                print("Deleting contract {} failed because it was not found.".format(event.dn))
+        elif event.status == "modified":
             pass  # No action required
         else:
-            print("Unknown status skipped for contract callback: {}".format(attrs["status"]))
+            print("Unknown status skipped for contract callback: {}".format(event.status))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,139 @@
+import time
+from threading import Thread, Condition
+
+
+class PendingEvents:
+    """
+    Holds subscription events for EPGs that are not known yet, keyed by the DN of the EPG. The events are replayed when
+    the EPG arrives. If the EPG has not arrived within the timeout, timeout_cb is called so that the EPG can be fetched
+    on its own, without reloading every EPG.
+    """
+    def __init__(self, timeout_cb, timeout=2.0, start=True):
+        """
+        :param timeout_cb:  Method called with the DN of an EPG whose events have been held for longer than the timeout.
+                            The method should pop the events, otherwise they are held for another timeout.
+        :param timeout:     Seconds events are held before timeout_cb is called
+        :param start:       Whether to start the timeout thread upon creation
+        """
+        self.timeout_cb = timeout_cb
+        self.timeout = timeout
+
+        self.cond = Condition()
+        self.events = {}        # EPG DN -> list of events
+        self.deadlines = {}     # EPG DN -> time timeout_cb is called
+        self.running = False
+        self.thread = None
+
+        # Statistics
+        self.buffered = 0
+        self.replayed = 0
+        self.discarded = 0
+        self.timeouts = 0
+
+        if start:
+            self.start()
+
+    def start(self):
+        with self.cond:
+            if self.running:
+                return
+            self.running = True
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+    def add(self, epg_dn, event):
+        """
+        Hold an event until the EPG arrives.
+        :param epg_dn:  DN of the unknown EPG
+        :param event:   The event, e.g. a ContractUpdate
+        :return:
+        """
+        with self.cond:
+            events = self.events.get(epg_dn)
+            if events is None:
+                events = self.events[epg_dn] = []
+                self.deadlines[epg_dn] = time.time() + self.timeout
+                self.cond.notify_all()
+            events.append(event)
+            self.buffered += 1
+
+    def remove(self, epg_dn, dn):
+        """
+        Discard the held events of an object, e.g. when a contract is deleted before its EPG arrives.
+        :param epg_dn:  DN of the EPG
+        :param dn:      DN of the object
+        :return:        True if any events were discarded, False otherwise
+        """
+        with self.cond:
+            events = self.events.get(epg_dn)
+            if events is None:
+                return False
+            kept = [event for event in events if event.dn != dn]
+            if len(kept) == len(events):
+                return False
+            self.discarded += len(events) - len(kept)
+            if kept:
+                self.events[epg_dn] = kept
+            else:
+                del self.events[epg_dn]
+                del self.deadlines[epg_dn]
+            return True
+
+    def pop(self, epg_dn, replay=True):
+        """
+        Remove and return the held events of an EPG.
+        :param epg_dn:  DN of the EPG
+        :param replay:  True if the events will be replayed, False if they are discarded
+        :return:        List of events in the order they were received
+        """
+        with self.cond:
+            events = self.events.pop(epg_dn, None)
+            if events is None:
+                return []
+            del self.deadlines[epg_dn]
+            if replay:
+                self.replayed += len(events)
+            else:
+                self.discarded += len(events)
+            return events
+
+    def run(self):
+        while True:
+            with self.cond:
+                expired = []
+                while self.running:
+                    now = time.time()
+                    expired = [dn for dn, deadline in self.deadlines.iteritems() if deadline <= now]
+                    if expired:
+                        break
+                    wait = min(self.deadlines.itervalues()) - now if self.deadlines else None
+                    self.cond.wait(wait)
+                if not self.running:
+                    return
+                for epg_dn in expired:
+                    # Held for another timeout unless timeout_cb pops the events
+                    self.deadlines[epg_dn] = now + self.timeout
+                    self.timeouts += 1
+
+            for epg_dn in expired:
+                try:
+                    self.timeout_cb(epg_dn)
+                except Exception as e:
+                    print("Could not fetch EPG {0}: {1}".format(epg_dn, e))
+
+    def get_stats(self):
+        with self.cond:
+            return {
+                "epgs": len(self.events),
+                "events": sum(len(events) for events in self.events.itervalues()),
+                "buffered": self.buffered,
+                "replayed": self.replayed,
+                "discarded": self.discarded,
+                "timeouts": self.timeouts,
+            }
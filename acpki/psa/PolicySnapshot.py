@@ -0,0 +1,86 @@
+class PolicySnapshot(object):
+    """
+    Immutable, versioned view of the EPGs and contracts known by the PSA. A snapshot is never changed after it has been
+    published by the PolicyStore, so it can be read from any thread without locking. EPGs are indexed by DN and name,
+    and contracts are indexed by DN and UID. An inverted index from contract UID to the providing and consuming EPGs
+    makes connection checks set-membership checks.
+    """
+    def __init__(self, version=0):
+        self.version = version
+        self.epgs_by_dn = {}
+        self.epgs_by_name = {}
+        self.contracts_by_dn = {}   # Contract DN -> (EPG DN, action, contract)
+        self.contracts_by_uid = {}  # Contract UID -> {contract DN: contract}
+        self.epgs_by_uid = {"prov": {}, "cons": {}}  # Action -> contract UID -> {EPG DN: number of contracts}
+        self.uids_by_epg = {"prov": {}, "cons": {}}  # Action -> EPG DN -> {contract UID: number of contracts}
+
+    def copy(self):
+        """
+        Get a new snapshot with the next version, which shares all indexes with this snapshot.
+        :return:    The new PolicySnapshot
+        """
+        snapshot = PolicySnapshot(self.version + 1)
+        snapshot.epgs_by_dn = self.epgs_by_dn
+        snapshot.epgs_by_name = self.epgs_by_name
+        snapshot.contracts_by_dn = self.contracts_by_dn
+        snapshot.contracts_by_uid = self.contracts_by_uid
+        snapshot.epgs_by_uid = self.epgs_by_uid
+        snapshot.uids_by_epg = self.uids_by_epg
+        return snapshot
+
+    def get_epgs(self):
+        return self.epgs_by_dn.values()
+
+    def get_epg(self, dn):
+        return self.epgs_by_dn.get(dn)
+
+    def get_epg_by_name(self, name):
+        return self.epgs_by_name.get(name)
+
+    def get_contract(self, dn):
+        entry = self.contracts_by_dn.get(dn)
+        return entry[2] if entry is not None else None
+
+    def get_contracts_by_uid(self, uid):
+        return self.contracts_by_uid.get(uid, {}).values()
+
+    def get_uids(self, epg_dn, action):
+        """
+        Get the UIDs of the contracts provided or consumed by an EPG.
+        :param epg_dn:      DN of the EPG
+        :param action:      "prov" for provided contracts or "cons" for consumed contracts
+        :return:            Dictionary with the UIDs as keys
+        """
+        return self.uids_by_epg[action].get(epg_dn, {})
+
+    def get_providers(self, uid):
+        return self.epgs_by_uid["prov"].get(uid, {}).keys()
+
+    def get_consumers(self, uid):
+        return self.epgs_by_uid["cons"].get(uid, {}).keys()
+
+    def consumes_from(self, consumer_dn, provider_dn):
+        """
+        Check whether an EPG consumes one or more contracts provided by another EPG.
+        :param consumer_dn:     DN of the consuming EPG
+        :param provider_dn:     DN of the providing EPG
+        :return:                True if a contract exists, False otherwise
+        """
+        providers = self.epgs_by_uid["prov"]
+        for uid in self.get_uids(consumer_dn, "cons"):
+            if provider_dn in providers.get(uid, ()):
+                return True
+        return False
+
+    def get_shared_uids(self, consumer_dn, provider_dn):
+        """
+        Get the UIDs of the contracts consumed by one EPG and provided by another.
+        :param consumer_dn:     DN of the consuming EPG
+        :param provider_dn:     DN of the providing EPG
+        :return:                Set of contract UIDs
+        """
+        consumed = self.get_uids(consumer_dn, "cons")
+        provided = self.get_uids(provider_dn, "prov")
+        if len(consumed) > len(provided):
+            consumed, provided = provided, consumed
+        return set(uid for uid in consumed if uid in provided)
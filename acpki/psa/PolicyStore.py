@@ -0,0 +1,296 @@
+from contextlib import contextmanager
+from acpki.psa import PolicySnapshot
+from acpki.util.exceptions import IllegalStateError
+
+
+class PolicyStore:
+    """
+    Copy-on-write store for the EPGs and contracts known by the PSA. Readers use the current PolicySnapshot, which is
+    never changed, so they do not need to lock. Changes are made to a draft of the next snapshot, which shares every
+    index and EPG with the current snapshot until it is changed, so that only the changed parts are copied. The draft
+    is published as the new snapshot when the batch of changes is done. Changes must be made from one thread at a time.
+    """
+    def __init__(self):
+        self.snapshot = PolicySnapshot()
+        self.draft = None
+        self.owned = {}     # ID -> object, for the dictionaries and EPGs created for the draft
+        self.undo = None    # List of (method, arguments) that revert the changes made since the current savepoint
+        self.fresh = None   # ID -> object, for the dictionaries and EPGs created since the current savepoint
+        self.depth = 0
+        self.changed = False
+
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    @contextmanager
+    def batch(self):
+        """
+        Make several changes that are published as one snapshot. Batches may be nested, and the snapshot is published
+        when the outermost batch is done. If an exception is raised, the changes of the batch are discarded.
+        """
+        if self.depth == 0:
+            self.draft = self.snapshot.copy()
+            self.owned = {}
+            self.changed = False
+        self.depth += 1
+        done = False
+        try:
+            yield self
+            done = True
+        finally:
+            self.depth -= 1
+            if self.depth == 0:
+                if done and self.changed:
+                    self.snapshot = self.draft
+                self.draft = None
+                self.owned = {}
+
+    @contextmanager
+    def savepoint(self):
+        """
+        Make changes within a batch that are reverted if an exception is raised, while the earlier changes of the batch
+        are kept. Every change made to the draft within the savepoint is recorded in an undo log, so that the draft
+        does not have to be copied. Savepoints may be nested.
+        """
+        if self.depth == 0:
+            raise IllegalStateError("A savepoint can only be made within a batch.")
+        undo, fresh, draft, changed = self.undo, self.fresh, self.draft, self.changed
+        self.undo, self.fresh = [], {}
+        try:
+            yield self
+        except BaseException:
+            for method, args in reversed(self.undo):
+                method(*args)
+            self.undo, self.fresh, self.draft, self.changed = undo, fresh, draft, changed
+            raise
+        if undo is not None:
+            # Nested savepoint, the changes are reverted if the outer savepoint fails
+            undo.extend(self.undo)
+            fresh.update(self.fresh)
+        self.undo, self.fresh = undo, fresh
+
+    def set_item(self, d, key, value):
+        undo = self.undo
+        if undo is not None:
+            undo.append((d.__setitem__, (key, d[key])) if key in d else (d.pop, (key, None)))
+        d[key] = value
+
+    def pop_item(self, d, key, *default):
+        if self.undo is not None and key in d:
+            self.undo.append((d.__setitem__, (key, d[key])))
+        return d.pop(key, *default)
+
+    def own(self, obj):
+        self.owned[id(obj)] = obj
+        if self.fresh is not None:
+            self.fresh[id(obj)] = obj
+        return obj
+
+    def index(self, name):
+        """
+        Get an index of the draft that may be changed, copying it if it is shared with the current snapshot.
+        :param name:    Name of the index, e.g. "epgs_by_dn"
+        :return:        The dictionary
+        """
+        d = getattr(self.draft, name)
+        if id(d) not in self.owned:
+            if self.undo is not None:
+                self.undo.append((setattr, (self.draft, name, d)))
+            d = self.own(dict(d))
+            setattr(self.draft, name, d)
+        self.changed = True
+        return d
+
+    def child(self, parent, key):
+        """
+        Get a dictionary nested in a dictionary of the draft that may be changed, copying it if it is shared with the
+        current snapshot. The parent must already be owned by the draft.
+        :param parent:  The parent dictionary
+        :param key:     Key of the nested dictionary, which is created if it does not exist
+        :return:        The dictionary
+        """
+        d = parent.get(key)
+        if d is None:
+            d = self.own({})
+            self.set_item(parent, key, d)
+        elif id(d) not in self.owned:
+            d = self.own(dict(d))
+            self.set_item(parent, key, d)
+        return d
+
+    def writable_epg(self, dn):
+        """
+        Get an EPG of the draft that may be changed, copying it if it is shared with the current snapshot. Within a
+        savepoint an EPG created before the savepoint is copied as well, so that it is kept if the savepoint is
+        reverted.
+        :param dn:      DN of the EPG
+        :return:        The EPG, or None if it was not found
+        """
+        epg = self.draft.epgs_by_dn.get(dn)
+        if epg is None or id(epg) in (self.owned if self.fresh is None else self.fresh):
+            return epg
+        copy = self.own(epg.copy())
+        self.set_item(self.index("epgs_by_dn"), dn, copy)
+        if self.draft.epgs_by_name.get(epg.name) is epg:
+            self.set_item(self.index("epgs_by_name"), epg.name, copy)
+        return copy
+
+    def load(self, epgs):
+        """
+        Replace the content of the store with the EPGs provided, including their provided and consumed contracts.
+        :param epgs:    List of EPGs
+        :return:
+        """
+        with self.batch():
+            self.clear()
+            for epg in epgs:
+                self.put_epg(epg)
+
+    def clear(self):
+        with self.batch():
+            self.draft = PolicySnapshot(self.draft.version)
+            for name in ("epgs_by_dn", "epgs_by_name", "contracts_by_dn", "contracts_by_uid"):
+                self.own(getattr(self.draft, name))
+            for name in ("epgs_by_uid", "uids_by_epg"):
+                for d in [getattr(self.draft, name)] + getattr(self.draft, name).values():
+                    self.own(d)
+            self.changed = True
+
+    def put_epg(self, epg):
+        """
+        Add an EPG to the store along with its provided and consumed contracts. An existing EPG with the same DN is
+        replaced, along with its contracts.
+        :param epg:     The EPG to add
+        :return:
+        """
+        with self.batch():
+            provides, consumes = epg.provides, epg.consumes
+            epg.provides, epg.consumes = [], []
+            self.add_epg(epg)
+            for con in provides:
+                self.add_contract(epg.dn, "prov", con)
+            for con in consumes:
+                self.add_contract(epg.dn, "cons", con)
+
+    def add_epg(self, epg):
+        """
+        Add an EPG to the store. An existing EPG with the same DN is replaced, along with its contracts. The store takes
+        ownership of the EPG, which must not be changed by the caller afterwards.
+        :param epg:     The EPG to add
+        :return:
+        """
+        with self.batch():
+            if epg.dn in self.draft.epgs_by_dn:
+                self.remove_epg(epg.dn)
+            self.own(epg)
+            self.set_item(self.index("epgs_by_dn"), epg.dn, epg)
+            if epg.name is not None:
+                self.set_item(self.index("epgs_by_name"), epg.name, epg)
+
+    def update_epg(self, dn, name=None):
+        """
+        Update the attributes of an existing EPG.
+        :param dn:      DN of the EPG
+        :param name:    New name of the EPG, or None to keep the current name
+        :return:        The updated EPG, or None if it was not found
+        """
+        epg = self.draft.epgs_by_dn.get(dn) if self.draft is not None else self.snapshot.get_epg(dn)
+        if epg is None or name is None or name == epg.name:
+            return epg
+        with self.batch():
+            epg = self.writable_epg(dn)
+            epgs_by_name = self.index("epgs_by_name")
+            if epgs_by_name.get(epg.name) is epg:
+                self.pop_item(epgs_by_name, epg.name)
+            epg.name = name
+            self.set_item(epgs_by_name, name, epg)
+        return epg
+
+    def remove_epg(self, dn):
+        """
+        Remove an EPG and all of its contracts from the store.
+        :param dn:      DN of the EPG
+        :return:        The removed EPG, or None if it was not found
+        """
+        with self.batch():
+            if dn not in self.draft.epgs_by_dn:
+                return None
+            epg = self.pop_item(self.index("epgs_by_dn"), dn)
+            if self.draft.epgs_by_name.get(epg.name) is epg:
+                self.pop_item(self.index("epgs_by_name"), epg.name)
+            for action, contracts in (("prov", epg.provides), ("cons", epg.consumes)):
+                for con in contracts:
+                    self.pop_item(self.index("contracts_by_dn"), con.dn, None)
+                    self.unindex_contract(dn, action, con)
+        return epg
+
+    def add_contract(self, epg_dn, action, contract):
+        """
+        Add a contract to the EPG with the given DN.
+        :param epg_dn:      DN of the providing or consuming EPG
+        :param action:      "prov" for provided contracts or "cons" for consumed contracts
+        :param contract:    The contract to add
+        :return:            True if the contract was added, False if the EPG was not found
+        """
+        with self.batch():
+            if epg_dn not in self.draft.epgs_by_dn:
+                return False
+            if contract.dn in self.draft.contracts_by_dn:
+                self.remove_contract(contract.dn)
+
+            epg = self.writable_epg(epg_dn)
+            if action == "prov":
+                epg.provides.append(contract)
+            else:
+                epg.consumes.append(contract)
+            self.set_item(self.index("contracts_by_dn"), contract.dn, (epg_dn, action, contract))
+            self.set_item(self.child(self.index("contracts_by_uid"), contract.uid), contract.dn, contract)
+            self.increment("epgs_by_uid", action, contract.uid, epg_dn)
+            self.increment("uids_by_epg", action, epg_dn, contract.uid)
+        return True
+
+    def remove_contract(self, dn):
+        """
+        Remove a contract from the EPG that provides or consumes it.
+        :param dn:      DN of the contract
+        :return:        The removed contract, or None if it was not found
+        """
+        with self.batch():
+            if dn not in self.draft.contracts_by_dn:
+                return None
+            epg_dn, action, contract = self.pop_item(self.index("contracts_by_dn"), dn)
+
+            epg = self.writable_epg(epg_dn)
+            if epg is not None:
+                contracts = epg.provides if action == "prov" else epg.consumes
+                contracts.remove(contract)
+            self.unindex_contract(epg_dn, action, contract)
+        return contract
+
+    def unindex_contract(self, epg_dn, action, contract):
+        by_dn = self.draft.contracts_by_uid.get(contract.uid)
+        if by_dn is not None and contract.dn in by_dn:
+            contracts_by_uid = self.index("contracts_by_uid")
+            if len(by_dn) == 1:
+                self.pop_item(contracts_by_uid, contract.uid)
+            else:
+                self.pop_item(self.child(contracts_by_uid, contract.uid), contract.dn)
+        self.decrement("epgs_by_uid", action, contract.uid, epg_dn)
+        self.decrement("uids_by_epg", action, epg_dn, contract.uid)
+
+    def increment(self, name, action, outer_key, key):
+        counts = self.child(self.child(self.index(name), action), outer_key)
+        self.set_item(counts, key, counts.get(key, 0) + 1)
+
+    def decrement(self, name, action, outer_key, key):
+        counts = getattr(self.draft, name)[action].get(outer_key)
+        if counts is None or key not in counts:
+            return
+        by_action = self.child(self.index(name), action)
+        if counts[key] > 1:
+            self.set_item(self.child(by_action, outer_key), key, counts[key] - 1)
+        elif len(counts) == 1:
+            self.pop_item(by_action, outer_key)
+        else:
+            self.pop_item(self.child(by_action, outer_key), key)
@@ -1 +1,7 @@
-from PSA import PSA
\ No newline at end of file
+from PolicySnapshot import PolicySnapshot
+from PolicyStore import PolicyStore
+from OURegistry import OURegistry
+from EventCoalescer import EventCoalescer
+from PendingEvents import PendingEvents
+from DecisionCache import DecisionCache
+from PSA import PSA
@@ -0,0 +1,335 @@
+import random, time
+from threading import RLock
+
+
+class Fabric:
+    """
+    Synthetic Cisco ACI fabric served by the FakeAPIC. Managed objects are kept in memory by DN, and every change is
+    reported to the listeners, which the FakeAPIC uses to push subscription events. The fabric is generated with a
+    tenant, an AP, a number of contracts and a number of EPGs that provide and consume randomly chosen contracts.
+    """
+    # Relative names of the supported classes, formatted with the attributes of the object
+    rn_formats = {
+        "fvTenant": "tn-{name}",
+        "fvAp": "ap-{name}",
+        "fvAEPg": "epg-{name}",
+        "vzBrCP": "brc-{name}",
+        "fvRsProv": "rsprov-{tnVzBrCPName}",
+        "fvRsCons": "rscons-{tnVzBrCPName}",
+    }
+
+    def __init__(self, tenant_name, ap_name, epgs=100, contracts=50, relations=4, seed=None):
+        """
+        :param tenant_name:     Name of the generated tenant
+        :param ap_name:         Name of the generated AP
+        :param epgs:            Number of generated EPGs
+        :param contracts:       Number of generated contracts
+        :param relations:       Number of contracts provided and consumed by each EPG, half of each
+        :param seed:            Seed of the random generator, to generate the same fabric every time
+        """
+        self.tenant_name = tenant_name
+        self.ap_name = ap_name
+        self.tenant_dn = "uni/tn-{0}".format(tenant_name)
+        self.ap_dn = "{0}/ap-{1}".format(self.tenant_dn, ap_name)
+
+        self.objects = {}       # DN -> (class, attributes)
+        self.children = {}      # DN -> set of child DNs
+        self.by_class = {}      # Class -> DNSet
+        self.protected = set()  # DNs that are never changed by random events
+        self.listeners = []     # Methods called with (class, attributes) when an object changes
+        self.lock = RLock()
+        self.random = random.Random(seed)
+        self.next_uid = 15000
+        self.next_epg = 0
+
+        self.add("polUni", {"dn": "uni", "name": ""}, notify=False)
+        self.populate(epgs, contracts, relations)
+
+    def populate(self, epgs, contracts, relations):
+        self.add("fvTenant", {"name": self.tenant_name}, "uni", notify=False)
+        self.add("fvAp", {"name": self.ap_name}, self.tenant_dn, notify=False)
+        self.protected.update(["uni", self.tenant_dn, self.ap_dn])
+
+        names = ["con-{0}".format(i) for i in range(contracts)]
+        for name in names:
+            self.add_contract(name, notify=False)
+        for i in range(epgs):
+            provides = self.random.sample(names, min(len(names), relations // 2))
+            consumes = self.random.sample(names, min(len(names), relations - relations // 2))
+            self.add_epg("epg-{0}".format(i), provides, consumes, notify=False)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def notify(self, cls, attrs):
+        for listener in self.listeners:
+            listener(cls, attrs)
+
+    def get_rn(self, cls, attrs):
+        rn_format = self.rn_formats.get(cls)
+        if rn_format is None:
+            raise ValueError("Unsupported class {0}".format(cls))
+        return rn_format.format(**attrs)
+
+    @staticmethod
+    def get_parent_dn(dn):
+        return dn.rsplit("/", 1)[0] if "/" in dn else None
+
+    def add(self, cls, attrs, parent_dn=None, notify=True):
+        """
+        Add or replace an object.
+        :param cls:         Class of the object, e.g. fvAEPg
+        :param attrs:       Attributes of the object. The DN is derived from the parent DN if not given.
+        :param parent_dn:   DN of the parent object
+        :param notify:      Report the change to the listeners
+        :return:            The attributes of the object
+        """
+        attrs = dict(attrs)
+        attrs.pop("status", None)
+        if "dn" not in attrs:
+            attrs["dn"] = parent_dn + "/" + self.get_rn(cls, attrs)
+        dn = attrs["dn"]
+        attrs["modTs"] = self.get_timestamp()
+
+        with self.lock:
+            # Relations get the UID of their contract, so that providers and consumers of a contract can be matched
+            if cls in ("fvRsProv", "fvRsCons") and "uid" not in attrs:
+                contract = self.objects.get("{0}/brc-{1}".format(self.tenant_dn, attrs["tnVzBrCPName"]))
+                attrs["uid"] = contract[1]["uid"] if contract is not None else "0"
+            if cls == "vzBrCP" and "uid" not in attrs:
+                attrs["uid"] = str(self.next_uid)
+                self.next_uid += 1
+
+            created = dn not in self.objects
+            if not created:
+                merged = dict(self.objects[dn][1])
+                merged.update(attrs)
+                attrs = merged
+            self.objects[dn] = (cls, attrs)
+            self.by_class.setdefault(cls, DNSet()).add(dn)
+            parent = self.get_parent_dn(dn)
+            if parent is not None:
+                self.children.setdefault(parent, set()).add(dn)
+            if notify:
+                event = dict(attrs)
+                event["status"] = "created" if created else "modified"
+                self.notify(cls, event)
+        return attrs
+
+    def modify(self, dn, attrs, notify=True):
+        """
+        Modify the attributes of an object.
+        :param dn:          DN of the object
+        :param attrs:       Attributes to change
+        :param notify:      Report the change to the listeners
+        :return:            True if the object was found, False otherwise
+        """
+        with self.lock:
+            obj = self.objects.get(dn)
+            if obj is None:
+                return False
+            cls, old = obj
+            changes = dict(attrs)
+            changes.pop("status", None)
+            changes["dn"] = dn
+            changes["modTs"] = self.get_timestamp()
+            old.update(changes)
+            if notify:
+                changes["status"] = "modified"
+                self.notify(cls, changes)
+            return True
+
+    def remove(self, dn, notify=True):
+        """
+        Remove an object and all of its descendants. Descendants are reported as deleted before their parents.
+        :param dn:          DN of the object
+        :param notify:      Report the change to the listeners
+        :return:            True if the object was found, False otherwise
+        """
+        with self.lock:
+            if dn not in self.objects:
+                return False
+            for child in list(self.children.get(dn, ())):
+                self.remove(child, notify)
+            cls, attrs = self.objects.pop(dn)
+            self.by_class[cls].remove(dn)
+            self.children.pop(dn, None)
+            parent = self.get_parent_dn(dn)
+            if parent in self.children:
+                self.children[parent].discard(dn)
+            if notify:
+                self.notify(cls, {"dn": dn, "status": "deleted", "modTs": self.get_timestamp()})
+            return True
+
+    def apply(self, parent_dn, body):
+        """
+        Apply a POST request body, e.g. {"fvTenant": {"attributes": {"name": ...}, "children": [...]}}. Objects with
+        the status "deleted" are removed, others are created or modified.
+        :param parent_dn:   DN the request was posted to
+        :param body:        Parsed JSON body
+        :return:            Number of changed objects
+        """
+        changed = 0
+        with self.lock:
+            for cls, obj in body.iteritems():
+                attrs = obj.get("attributes", {})
+                dn = attrs.get("dn")
+                if dn is None:
+                    rn = self.get_rn(cls, attrs)
+                    # The request may be posted to the DN of the object itself or to its parent
+                    dn = parent_dn if parent_dn.endswith("/" + rn) else parent_dn + "/" + rn
+                if attrs.get("status") == "deleted":
+                    changed += 1 if self.remove(dn) else 0
+                    continue
+                attrs = dict(attrs)
+                attrs["dn"] = dn
+                self.add(cls, attrs)
+                changed += 1
+                for child in obj.get("children", []):
+                    changed += self.apply(dn, child)
+        return changed
+
+    def add_contract(self, name, notify=True):
+        return self.add("vzBrCP", {"name": name}, self.tenant_dn, notify)
+
+    def add_epg(self, name, provides=(), consumes=(), notify=True, protected=False):
+        """
+        Add an EPG to the AP together with its contract relations.
+        :param name:        Name of the EPG
+        :param provides:    Names of contracts provided by the EPG
+        :param consumes:    Names of contracts consumed by the EPG
+        :param notify:      Report the changes to the listeners
+        :param protected:   Never change the EPG or its relations by random events
+        :return:            DN of the EPG
+        """
+        with self.lock:
+            dn = self.add("fvAEPg", {"name": name}, self.ap_dn, notify)["dn"]
+            relations = [self.add("fvRsProv", {"tnVzBrCPName": con}, dn, notify)["dn"] for con in provides]
+            relations += [self.add("fvRsCons", {"tnVzBrCPName": con}, dn, notify)["dn"] for con in consumes]
+            if protected:
+                self.protected.add(dn)
+                self.protected.update(relations)
+        return dn
+
+    def get(self, dn):
+        with self.lock:
+            return self.objects.get(dn)
+
+    def query(self, dn, target="self", classes=None):
+        """
+        Query objects like the APIC does for mo queries.
+        :param dn:          DN of the queried object
+        :param target:      Query target, either "self", "children" or "subtree"
+        :param classes:     Collection of classes to include (Default: None, which includes all classes)
+        :return:            List of (class, attributes) tuples, sorted by DN
+        """
+        with self.lock:
+            if dn not in self.objects:
+                return []
+            if target == "children":
+                dns = list(self.children.get(dn, ()))
+            elif target == "subtree":
+                dns = []
+                stack = [dn]
+                while stack:
+                    current = stack.pop()
+                    dns.append(current)
+                    stack.extend(self.children.get(current, ()))
+            else:
+                dns = [dn]
+            result = [self.objects[d] for d in dns]
+        if classes:
+            result = [obj for obj in result if obj[0] in classes]
+        return sorted(result, key=lambda obj: obj[1]["dn"])
+
+    def query_class(self, cls):
+        with self.lock:
+            dns = list(self.by_class.get(cls, ()))
+            return sorted((self.objects[dn] for dn in dns), key=lambda obj: obj[1]["dn"])
+
+    @staticmethod
+    def matches(dn, target, classes, obj_cls, obj_dn):
+        """
+        Check whether a changed object is covered by a query, i.e. whether a subscription for the query is notified.
+        """
+        if classes and obj_cls not in classes:
+            return False
+        if target == "children":
+            return obj_dn.rsplit("/", 1)[0] == dn
+        if target == "subtree":
+            return obj_dn == dn or obj_dn.startswith(dn + "/")
+        return obj_dn == dn
+
+    def random_event(self):
+        """
+        Make a random change to the fabric: an EPG is created, modified or deleted, or a contract relation is added or
+        removed. Protected objects are never changed.
+        :return:
+        """
+        with self.lock:
+            epgs = self.by_class.get("fvAEPg", DNSet())
+            contracts = self.by_class.get("vzBrCP", DNSet())
+            action = self.random.random()
+            if action < 0.2 or len(epgs) == 0:
+                self.next_epg += 1
+                name = "epg-sim-{0}".format(self.next_epg)
+                provides = [self.objects[contracts.choice(self.random)][1]["name"]] if contracts else []
+                self.add_epg(name, provides)
+            elif action < 0.35:
+                dn = epgs.choice(self.random)
+                if dn not in self.protected:
+                    self.remove(dn)
+            elif action < 0.55:
+                self.modify(epgs.choice(self.random), {"descr": "modified {0}".format(time.time())})
+            elif action < 0.8 and contracts:
+                epg_dn = epgs.choice(self.random)
+                if epg_dn not in self.protected:
+                    cls = self.random.choice(("fvRsProv", "fvRsCons"))
+                    name = self.objects[contracts.choice(self.random)][1]["name"]
+                    self.add(cls, {"tnVzBrCPName": name}, epg_dn)
+            else:
+                relations = self.by_class.get(self.random.choice(("fvRsProv", "fvRsCons")))
+                if relations:
+                    dn = relations.choice(self.random)
+                    if dn not in self.protected:
+                        self.remove(dn)
+
+    def __len__(self):
+        return len(self.objects)
+
+    @staticmethod
+    def get_timestamp():
+        return time.strftime("%Y-%m-%dT%H:%M:%S.000+00:00", time.gmtime())
+
+
+class DNSet:
+    """
+    Set of DNs that supports picking a random DN in constant time.
+    """
+    def __init__(self):
+        self.items = []
+        self.positions = {}
+
+    def add(self, dn):
+        if dn not in self.positions:
+            self.positions[dn] = len(self.items)
+            self.items.append(dn)
+
+    def remove(self, dn):
+        pos = self.positions.pop(dn)
+        last = self.items.pop()
+        if pos < len(self.items):
+            self.items[pos] = last
+            self.positions[last] = pos
+
+    def choice(self, rnd):
+        return rnd.choice(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __contains__(self, dn):
+        return dn in self.positions
@@ -0,0 +1,533 @@
+import json, time, random, ssl, socket, urlparse, uuid, Cookie
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from threading import Thread, Lock, Event
+from acpki.sim import Fabric
+from acpki.sim import wsframes
+from acpki.config import CONFIG
+
+
+class FakeAPIC:
+    """
+    Local stand-in for the Cisco APIC, serving a synthetic Fabric over the REST API and the WebSocket push channel, so
+    that ACISession, ACIAdapter and PSA can be run and benchmarked on one machine. The following is supported:
+    aaaLogin, aaaRefresh and aaaLogout, mo, node/mo, class and node/class queries with query-target,
+    target-subtree-class, order-by, page and page-size, subscriptions with subscriptionRefresh, POST requests to mo and
+    the /socket<token> WebSocket. Latency can be added to every request, and random changes can be made to the fabric
+    at a given rate to generate subscription events.
+    """
+    def __init__(self, fabric=None, host=None, port=None, latency=None, jitter=None, event_rate=None,
+                 username=None, password=None, token_timeout=None, subscription_timeout=None, cert_file=None,
+                 key_file=None):
+        """
+        All parameters default to the values in the "sim" section of the configuration.
+        :param fabric:                  The Fabric to serve (Default: A fabric generated from the configuration)
+        :param host:                    Host to listen on
+        :param port:                    Port to listen on, 0 picks a free port
+        :param latency:                 Seconds added to every request
+        :param jitter:                  Maximum random number of seconds added to the latency
+        :param event_rate:              Random changes made to the fabric per second, 0 disables random changes
+        :param username:                Username accepted by aaaLogin
+        :param password:                Password accepted by aaaLogin
+        :param token_timeout:           Seconds a token is valid unless it is refreshed
+        :param subscription_timeout:    Seconds a subscription is kept unless it is refreshed
+        :param cert_file:               Certificate file, enables TLS together with key_file
+        :param key_file:                Private key file
+        """
+        config = CONFIG["sim"]
+        if fabric is None:
+            fabric = Fabric(CONFIG["apic"]["tn-name"], CONFIG["apic"]["ap-name"], epgs=config["epgs"],
+                            contracts=config["contracts"], relations=config["relations-per-epg"],
+                            seed=config["seed"])
+            self.add_endpoint_epgs(fabric)
+        self.fabric = fabric
+        self.host = config["host"] if host is None else host
+        self.port = config["port"] if port is None else port
+        self.latency = config["latency"] if latency is None else latency
+        self.jitter = config["latency-jitter"] if jitter is None else jitter
+        self.event_rate = config["event-rate"] if event_rate is None else event_rate
+        self.username = CONFIG["apic"]["username"] if username is None else username
+        self.password = CONFIG["apic"]["password"] if password is None else password
+        self.token_timeout = config["token-timeout"] if token_timeout is None else token_timeout
+        self.subscription_timeout = (config["subscription-timeout"] if subscription_timeout is None
+                                     else subscription_timeout)
+        self.cert_file = cert_file
+        self.key_file = key_file
+
+        self.tokens = {}            # Token -> APICSession
+        self.subscriptions = {}     # Subscription ID -> FakeSubscription
+        self.lock = Lock()
+        self.next_subscription = 1
+
+        # Statistics
+        self.requests = 0
+        self.events = 0
+
+        self.server = None
+        self.server_thread = None
+        self.event_thread = None
+        self.fabric.add_listener(self.on_change)
+
+    @staticmethod
+    def add_endpoint_epgs(fabric):
+        """
+        Add the EPGs of the client and server endpoints in the configuration, where the server provides a contract that
+        is consumed by the client.
+        :param fabric:      The Fabric
+        :return:
+        """
+        fabric.add_contract("con-endpoints", notify=False)
+        fabric.add_epg(CONFIG["endpoints"]["server-epg"], provides=["con-endpoints"], notify=False, protected=True)
+        fabric.add_epg(CONFIG["endpoints"]["client-epg"], consumes=["con-endpoints"], notify=False, protected=True)
+
+    @property
+    def secure(self):
+        return self.cert_file is not None
+
+    @property
+    def base_url(self):
+        return "{0}:{1}".format(self.host, self.port)
+
+    def start(self):
+        """
+        Start serving in background threads.
+        :return:
+        """
+        self.server = APICServer((self.host, self.port), APICRequestHandler, self)
+        if self.secure:
+            self.server.socket = ssl.wrap_socket(self.server.socket, certfile=self.cert_file, keyfile=self.key_file,
+                                                 server_side=True)
+        self.port = self.server.server_address[1]
+        self.server_thread = Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+
+        if self.event_rate:
+            self.event_thread = EventThread(self.fabric, self.event_rate)
+            self.event_thread.start()
+        print("Fake APIC listening on {0} with {1} objects".format(self.base_url, len(self.fabric)))
+
+    def stop(self):
+        if self.event_thread is not None:
+            self.event_thread.stop()
+            self.event_thread = None
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        with self.lock:
+            sessions = set(self.tokens.values())
+        for session in sessions:
+            session.close_channels()
+
+    def configure(self):
+        """
+        Point the APIC configuration at this server, so that sessions created afterwards connect to it.
+        :return:
+        """
+        CONFIG["apic"]["base-url"] = self.base_url
+        CONFIG["apic"]["use-tls"] = self.secure
+        CONFIG["apic"]["username"] = self.username
+        CONFIG["apic"]["password"] = self.password
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+    def login(self, username, password):
+        """
+        Create a session for a user.
+        :return:    The APICSession, or None if the credentials are wrong
+        """
+        if username != self.username or password != self.password:
+            return None
+        session = APICSession(username)
+        return self.refresh_token(session)
+
+    def refresh_token(self, session):
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens[token] = session
+            session.token = token
+            session.expires = time.time() + self.token_timeout
+        return session
+
+    def logout(self, session):
+        with self.lock:
+            for token in [t for t, s in self.tokens.iteritems() if s is session]:
+                del self.tokens[token]
+            for sub_id in [i for i, sub in self.subscriptions.iteritems() if sub.session is session]:
+                del self.subscriptions[sub_id]
+        session.close_channels()
+
+    def get_session(self, token):
+        """
+        Get the session of a token. Earlier tokens of the session stay valid until the session expires.
+        :return:    The APICSession, or None if the token is unknown or expired
+        """
+        with self.lock:
+            session = self.tokens.get(token)
+            if session is None:
+                return None
+            if session.expires < time.time():
+                del self.tokens[token]
+                return None
+            return session
+
+    def subscribe(self, session, dn, cls, target, classes):
+        with self.lock:
+            sub_id = str(self.next_subscription)
+            self.next_subscription += 1
+            self.subscriptions[sub_id] = FakeSubscription(sub_id, session, dn, cls, target, classes,
+                                                          time.time() + self.subscription_timeout)
+            return sub_id
+
+    def refresh_subscription(self, session, sub_id):
+        with self.lock:
+            sub = self.subscriptions.get(sub_id)
+            if sub is None or sub.session is not session or sub.expires < time.time():
+                return False
+            sub.expires = time.time() + self.subscription_timeout
+            return True
+
+    def on_change(self, cls, attrs):
+        """
+        Push a change in the fabric to the WebSocket of every session with a subscription that covers it.
+        :param cls:     Class of the changed object
+        :param attrs:   Attributes of the change, including the status
+        :return:
+        """
+        now = time.time()
+        by_session = {}
+        with self.lock:
+            for sub_id, sub in self.subscriptions.items():
+                if sub.expires < now:
+                    del self.subscriptions[sub_id]
+                elif sub.matches(cls, attrs["dn"]):
+                    by_session.setdefault(sub.session, []).append(sub_id)
+
+        for session, sub_ids in by_session.iteritems():
+            message = json.dumps({"subscriptionId": sub_ids, "imdata": [{cls: {"attributes": attrs}}]})
+            if session.send(message):
+                with self.lock:
+                    self.events += 1
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "objects": len(self.fabric),
+                "sessions": len(set(self.tokens.values())),
+                "subscriptions": len(self.subscriptions),
+                "requests": self.requests,
+                "events": self.events,
+            }
+
+
+class APICServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, handler, apic):
+        HTTPServer.__init__(self, address, handler)
+        self.apic = apic
+
+
+class APICSession:
+    """
+    Session of a logged in user, which may be connected to any number of WebSockets.
+    """
+    def __init__(self, username):
+        self.username = username
+        self.token = None
+        self.expires = 0
+        self.channels = []
+        self.lock = Lock()
+
+    def add_channel(self, channel):
+        with self.lock:
+            self.channels.append(channel)
+
+    def remove_channel(self, channel):
+        with self.lock:
+            if channel in self.channels:
+                self.channels.remove(channel)
+
+    def send(self, message):
+        with self.lock:
+            channels = list(self.channels)
+        sent = False
+        for channel in channels:
+            if channel.send(wsframes.OPCODE_TEXT, message):
+                sent = True
+            else:
+                self.remove_channel(channel)
+        return sent
+
+    def close_channels(self):
+        with self.lock:
+            channels, self.channels = self.channels, []
+        for channel in channels:
+            channel.close()
+
+
+class WSChannel:
+    def __init__(self, connection, wfile):
+        self.connection = connection
+        self.wfile = wfile
+        self.lock = Lock()
+        self.closed = False
+
+    def send(self, opcode, payload=""):
+        with self.lock:
+            if self.closed:
+                return False
+            try:
+                self.wfile.write(wsframes.encode_frame(opcode, payload))
+                self.wfile.flush()
+                return True
+            except (socket.error, ValueError):
+                self.closed = True
+                return False
+
+    def close(self):
+        self.send(wsframes.OPCODE_CLOSE)
+        with self.lock:
+            self.closed = True
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+
+class FakeSubscription:
+    def __init__(self, sub_id, session, dn, cls, target, classes, expires):
+        self.sub_id = sub_id
+        self.session = session
+        self.dn = dn
+        self.cls = cls
+        self.target = target
+        self.classes = classes
+        self.expires = expires
+
+    def matches(self, cls, dn):
+        if self.cls is not None:
+            return cls == self.cls
+        return Fabric.matches(self.dn, self.target, self.classes, cls, dn)
+
+
+class APICRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep connections alive, like the APIC
+
+    @property
+    def apic(self):
+        return self.server.apic
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.handle_request("GET")
+
+    def do_POST(self):
+        self.handle_request("POST")
+
+    def handle_request(self, method):
+        url = urlparse.urlparse(self.path)
+        params = dict(urlparse.parse_qsl(url.query, keep_blank_values=True))
+        body = None
+        if method == "POST":
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length) if length else ""
+
+        with self.apic.lock:
+            self.apic.requests += 1
+
+        if url.path.startswith("/socket"):
+            return self.handle_websocket(url.path[len("/socket"):])
+
+        self.apic.delay()
+        if not url.path.startswith("/api/"):
+            return self.send_error_json(404, "Unknown path {0}".format(url.path))
+        api_method, _, file_format = url.path[len("/api/"):].rpartition(".")
+        if file_format != "json":
+            return self.send_error_json(400, "Only JSON is supported by the fake APIC")
+
+        if api_method == "aaaLogin" and method == "POST":
+            return self.handle_login(body)
+
+        session = self.get_session()
+        if session is None:
+            return self.send_error_json(403, "Token was invalid (Error: Token timeout)")
+
+        if api_method == "aaaRefresh":
+            return self.send_login(self.apic.refresh_token(session))
+        if api_method == "aaaLogout":
+            self.apic.logout(session)
+            return self.send_json({"totalCount": "0", "imdata": []})
+        if api_method == "subscriptionRefresh":
+            if self.apic.refresh_subscription(session, params.get("id")):
+                return self.send_json({"totalCount": "0", "imdata": []})
+            return self.send_error_json(400, "Subscription {0} does not exist".format(params.get("id")))
+
+        if api_method.startswith("node/"):
+            api_method = api_method[len("node/"):]
+        if api_method.startswith("mo/"):
+            dn = api_method[len("mo/"):]
+            if method == "POST":
+                return self.handle_post(dn, body)
+            return self.handle_query(session, params, dn=dn)
+        if api_method.startswith("class/") and method == "GET":
+            return self.handle_query(session, params, cls=api_method[len("class/"):])
+        return self.send_error_json(400, "Unsupported method {0} {1}".format(method, api_method))
+
+    def get_session(self):
+        cookie = Cookie.SimpleCookie(self.headers.get("Cookie", ""))
+        if "APIC-cookie" not in cookie:
+            return None
+        return self.apic.get_session(cookie["APIC-cookie"].value)
+
+    def handle_login(self, body):
+        try:
+            attrs = json.loads(body)["aaaUser"]["attributes"]
+        except (ValueError, KeyError, TypeError):
+            return self.send_error_json(400, "Invalid aaaLogin request")
+        session = self.apic.login(attrs.get("name"), attrs.get("pwd"))
+        if session is None:
+            return self.send_error_json(401, "Username or password is incorrect")
+        return self.send_login(session)
+
+    def send_login(self, session):
+        attrs = {
+            "token": session.token,
+            "userName": session.username,
+            "refreshTimeoutSeconds": str(self.apic.token_timeout),
+            "maximumLifetimeSeconds": "86400",
+            "creationTime": str(int(time.time())),
+        }
+        content = {"totalCount": "1", "imdata": [{"aaaLogin": {"attributes": attrs}}]}
+        return self.send_json(content, cookie="APIC-cookie={0}; path=/".format(session.token))
+
+    def handle_query(self, session, params, dn=None, cls=None):
+        classes = None
+        if params.get("target-subtree-class"):
+            classes = set(params["target-subtree-class"].split(","))
+        target = params.get("query-target", "self")
+
+        if cls is not None:
+            objects = self.apic.fabric.query_class(cls)
+        else:
+            objects = self.apic.fabric.query(dn, target, classes)
+
+        # Sort, e.g. by fvAEPg.name|asc or fvAEPg.dn|asc,fvRsProv.dn|asc. The class of each term is ignored.
+        order = params.get("order-by")
+        if order:
+            for term in reversed(order.split(",")):
+                field, _, direction = term.partition("|")
+                attr = field.split(".", 1)[-1]
+                objects = sorted(objects, key=lambda obj: obj[1].get(attr), reverse=direction == "desc")
+
+        total = len(objects)
+        if "page-size" in params:
+            size = int(params["page-size"])
+            page = int(params.get("page", 0))
+            objects = objects[page * size:(page + 1) * size]
+
+        content = {
+            "totalCount": str(total),
+            "imdata": [{obj_cls: {"attributes": dict(attrs, status="")}} for obj_cls, attrs in objects],
+        }
+        if params.get("subscription") == "yes":
+            content["subscriptionId"] = self.apic.subscribe(session, dn, cls, target, classes)
+        return self.send_json(content)
+
+    def handle_post(self, dn, body):
+        try:
+            changed = self.apic.fabric.apply(dn, json.loads(body))
+        except (ValueError, KeyError, AttributeError) as e:
+            return self.send_error_json(400, "Invalid request: {0}".format(e))
+        return self.send_json({"totalCount": "0", "imdata": [], "changed": changed})
+
+    def handle_websocket(self, token):
+        session = self.apic.get_session(token)
+        key = self.headers.get("Sec-WebSocket-Key")
+        if session is None or key is None or self.headers.get("Upgrade", "").lower() != "websocket":
+            return self.send_error_json(403, "Invalid WebSocket request")
+
+        self.send_response(101, "Switching Protocols")
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", wsframes.accept_key(key))
+        self.end_headers()
+        self.wfile.flush()
+
+        channel = WSChannel(self.connection, self.wfile)
+        session.add_channel(channel)
+        try:
+            while True:
+                frame = wsframes.read_frame(self.rfile)
+                if frame is None:
+                    break
+                fin, opcode, payload = frame
+                if opcode == wsframes.OPCODE_CLOSE:
+                    channel.send(wsframes.OPCODE_CLOSE, payload[:2])
+                    break
+                if opcode == wsframes.OPCODE_PING:
+                    channel.send(wsframes.OPCODE_PONG, payload)
+        except socket.error:
+            pass
+        finally:
+            session.remove_channel(channel)
+            channel.closed = True
+            self.close_connection = 1
+
+    def send_json(self, content, status=200, cookie=None):
+        data = json.dumps(content)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if cookie is not None:
+            self.send_header("Set-Cookie", cookie)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status, text):
+        content = {"totalCount": "1", "imdata": [{"error": {"attributes": {"code": str(status), "text": text}}}]}
+        return self.send_json(content, status)
+
+
+class EventThread(Thread):
+    """
+    Makes random changes to the fabric at a fixed rate, which are pushed to subscribers as events.
+    """
+    def __init__(self, fabric, rate):
+        super(EventThread, self).__init__()
+        self.daemon = True
+        self.fabric = fabric
+        self.interval = 1.0 / rate
+        self.stopped = Event()
+
+    def run(self):
+        next_event = time.time()
+        while not self.stopped.is_set():
+            self.fabric.random_event()
+            next_event += self.interval
+            delay = next_event - time.time()
+            if delay > 0:
+                self.stopped.wait(delay)
+            elif delay < -1:
+                next_event = time.time()  # Do not try to catch up when falling far behind
+
+    def stop(self):
+        self.stopped.set()
+
+
+if __name__ == "__main__":
+    apic = FakeAPIC()
+    apic.start()
+    try:
+        while True:
+            time.sleep(10)
+            print("Fake APIC: {0}".format(apic.get_stats()))
+    except KeyboardInterrupt:
+        print("Keyboard interrupt. Shutting down...")
+        apic.stop()
@@ -0,0 +1,2 @@
+from Fabric import Fabric
+from FakeAPIC import FakeAPIC
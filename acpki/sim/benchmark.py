@@ -0,0 +1,319 @@
+"""
+End-to-end benchmark of the PSA against the fake APIC. For every fabric size, a fake APIC with N EPGs and M contracts is
+started in its own process, and a PSA is started in another process so that its peak memory use can be measured. The
+following is measured for each size:
+- Cold start: the time to create the PSA, i.e. connect, prepare_environment and load_epgs_and_contracts. Note that
+  the connect phase includes the fixed delay after connecting in ACIAdapter.connect.
+- Peak resident set size (RSS) of the PSA process
+- Subscription events per second decoded and applied through PSA.sub_cb
+- Latency percentiles of PSA.validate_certificate
+The results are written as JSON, so that they can be compared between releases.
+
+Usage: python -m acpki.sim.benchmark --epgs 100,1000 --contracts 50,500 --output results.json
+"""
+import argparse, json, os, sys, time, timeit, resource, platform, tempfile, shutil, random
+from multiprocessing import Process, Queue
+from OpenSSL import crypto
+from acpki.config import CONFIG
+
+
+def run_fake_apic(settings, queue):
+    """
+    Run a fake APIC until the process is terminated. The port is put in the queue once the server is listening.
+    """
+    from acpki.sim import FakeAPIC
+    CONFIG["apic"]["tn-name"] = settings["tenant"]
+    CONFIG["sim"].update({
+        "epgs": settings["epgs"],
+        "contracts": settings["contracts"],
+        "relations-per-epg": settings["relations"],
+        "seed": settings["seed"],
+    })
+    with Quiet():
+        apic = FakeAPIC(port=0, latency=settings["latency"], event_rate=settings["event-rate"])
+        apic.start()
+    queue.put(apic.port)
+    while True:
+        time.sleep(60)
+
+
+def run_case(settings, queue):
+    """
+    Run the benchmark for one fabric size and put the results in the queue.
+    """
+    work_dir = tempfile.mkdtemp(prefix="acpki-benchmark-")
+    apic_queue = Queue()
+    apic = Process(target=run_fake_apic, args=(settings, apic_queue))
+    apic.daemon = True
+    apic.start()
+    try:
+        port = apic_queue.get(timeout=600)
+        CONFIG["verbose"] = False
+        CONFIG["apic"].update({
+            "base-url": "127.0.0.1:{0}".format(port),
+            "use-tls": False,
+            "tn-name": settings["tenant"],
+            "token-file": os.path.join(work_dir, "token.json"),
+        })
+        CONFIG["psa"]["ous-file"] = os.path.join(work_dir, "ous.txt")
+        queue.put(benchmark_psa(settings))
+    except Exception as e:
+        queue.put({"error": "{0}: {1}".format(type(e).__name__, e)})
+    finally:
+        apic.terminate()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def benchmark_psa(settings):
+    from acpki.aci import ACIAdapter
+    from acpki.psa import PSA
+
+    # Time the phases of the cold start
+    timings = {}
+    timed(ACIAdapter, "connect", timings)
+    timed(ACIAdapter, "prepare_environment", timings)
+    timed(PSA, "load_epgs_and_contracts", timings)
+
+    rss_before = get_peak_rss()
+    start = timeit.default_timer()
+    with Quiet():
+        psa = PSA()
+    cold_start = timeit.default_timer() - start
+    rss_loaded = get_peak_rss()
+
+    results = {
+        "epgs-loaded": len(psa.epgs),
+        "cold-start": cold_start,
+        "connect": timings.get("connect", 0.0) - timings.get("prepare_environment", 0.0),
+        "prepare-environment": timings.get("prepare_environment", 0.0),
+        "load-epgs-and-contracts": timings.get("load_epgs_and_contracts", 0.0),
+    }
+
+    with Quiet():
+        results["validate-certificate"] = benchmark_validation(psa, settings["validations"], settings["seed"])
+        results["events"] = benchmark_events(psa, settings["events"])
+
+    results["peak-rss-kb"] = get_peak_rss()
+    results["loaded-rss-kb"] = rss_loaded
+    results["baseline-rss-kb"] = rss_before
+
+    with Quiet():
+        psa.coalescer.stop()
+        psa.adapter.disconnect()
+    return results
+
+
+def benchmark_validation(psa, count, seed):
+    """
+    Measure the latency of validate_certificate for a mix of allowed and denied connections between random EPGs.
+    """
+    from acpki.models import EP, CertificateValidationRequest
+    rnd = random.Random(seed)
+    epgs = psa.epgs
+    if len(epgs) < 2:
+        return None
+
+    # Find pairs of EPGs that share a contract, and register OUs for them
+    allowed = []
+    snapshot = psa.store.snapshot
+    for epg in epgs:
+        for uid in snapshot.get_uids(epg.dn, "cons"):
+            for provider_dn in snapshot.get_providers(uid):
+                provider = snapshot.get_epg(provider_dn)
+                if provider is not None and provider is not epg:
+                    allowed.append((epg, provider))
+    requests = []
+    for i in range(count):
+        if allowed and i % 2 == 0:
+            origin, destination = rnd.choice(allowed)
+        else:
+            origin, destination = rnd.sample(epgs, 2)
+        requests.append(make_cvr(psa, EP(origin.name, epg=origin.name), EP(destination.name, epg=destination.name),
+                                 CertificateValidationRequest))
+
+    latencies = []
+    accepted = 0
+    for cvr in requests:
+        start = timeit.default_timer()
+        if psa.validate_certificate(cvr):
+            accepted += 1
+        latencies.append(timeit.default_timer() - start)
+
+    result = get_percentiles(latencies)
+    result["count"] = count
+    result["accepted"] = accepted
+    result["decision-cache"] = psa.get_decision_cache_stats()
+    return result
+
+
+def make_cvr(psa, origin, destination, cvr_class):
+    ou = psa.register_ou((origin.name, destination.name))
+    cert = crypto.X509()
+    cert.get_subject().CN = origin.name
+    cert.get_subject().OU = ou
+    return cvr_class(origin, destination, cert)
+
+
+def benchmark_events(psa, count):
+    """
+    Measure how many subscription events per second are decoded and applied through PSA.sub_cb, as in
+    ACISession.callback. The events arrive in rounds that each change every EPG once: the EPGs are created, provided
+    and consumed contracts are added to them, the EPGs are renamed, and the contracts and EPGs are deleted again. The
+    coalescer is flushed after each round, so that no events are combined and every event is applied.
+    """
+    from acpki.aci.events import decode_frame, codec
+    ap_dn = "uni/tn-{0}/ap-{1}".format(CONFIG["apic"]["tn-name"], CONFIG["apic"]["ap-name"])
+    rounds = [
+        lambda i, dn: ("fvAEPg", {"dn": dn, "name": "bench-{0}".format(i), "status": "created"}),
+        lambda i, dn: ("fvRsProv", {"dn": dn + "/rsprov-con-0", "tnVzBrCPName": "con-0", "uid": "15000",
+                                    "status": "created"}),
+        lambda i, dn: ("fvRsCons", {"dn": dn + "/rscons-con-1", "tnVzBrCPName": "con-1", "uid": "15001",
+                                    "status": "created"}),
+        lambda i, dn: ("fvAEPg", {"dn": dn, "name": "bench-{0}-renamed".format(i), "status": "modified"}),
+        lambda i, dn: ("fvRsProv", {"dn": dn + "/rsprov-con-0", "status": "deleted"}),
+        lambda i, dn: ("fvRsCons", {"dn": dn + "/rscons-con-1", "status": "deleted"}),
+        lambda i, dn: ("fvAEPg", {"dn": dn, "status": "deleted"}),
+    ]
+    epgs = max(1, (count + len(rounds) - 1) // len(rounds))
+    batches = []
+    total = 0
+    for make_item in rounds:
+        batch = []
+        for i in range(min(epgs, count - total)):
+            cls, attrs = make_item(i, "{0}/epg-bench-{1}".format(ap_dn, i))
+            batch.append(json.dumps({"subscriptionId": ["1"], "imdata": [{cls: {"attributes": attrs}}]}))
+        batches.append(batch)
+        total += len(batch)
+
+    applied = psa.coalescer.get_stats()["applied"]
+    start = timeit.default_timer()
+    for batch in batches:
+        for data in batch:
+            psa.sub_cb(1, decode_frame(data)[1])
+        psa.coalescer.flush()
+    elapsed = timeit.default_timer() - start
+    applied = psa.coalescer.get_stats()["applied"] - applied
+    return {
+        "codec": codec.__name__,
+        "coalescer": psa.coalescer.get_stats(),
+        "count": total,
+        "applied": applied,
+        "seconds": elapsed,
+        "per-second": applied / elapsed if elapsed else None,
+    }
+
+
+def timed(cls, name, timings):
+    """
+    Replace a method of a class with a wrapper that adds the time spent in the method to timings[name].
+    """
+    method = getattr(cls, name)
+
+    def wrapper(*args, **kwargs):
+        start = timeit.default_timer()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            timings[name] = timings.get(name, 0.0) + timeit.default_timer() - start
+    setattr(cls, name, wrapper)
+
+
+def get_percentiles(values, percentiles=(50, 90, 99)):
+    """
+    Get percentiles of a list of values using the nearest rank method, as well as the mean and maximum.
+    """
+    values = sorted(values)
+    result = {"mean": sum(values) / len(values), "max": values[-1]}
+    for p in percentiles:
+        rank = max(0, int(round(p / 100.0 * len(values))) - 1)
+        result["p{0}".format(p)] = values[rank]
+    return result
+
+
+def get_peak_rss():
+    """
+    Get the peak resident set size of this process in kilobytes.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        rss //= 1024  # Reported in bytes on macOS
+    return rss
+
+
+class Quiet:
+    """
+    Context manager that discards output, since the PSA prints on every request and event.
+    """
+    def __enter__(self):
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+        return False
+
+
+def parse_sizes(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the PSA against a local fake APIC.")
+    parser.add_argument("--epgs", type=parse_sizes, default=[100, 1000], help="Comma separated numbers of EPGs")
+    parser.add_argument("--contracts", type=parse_sizes, default=None,
+                        help="Comma separated numbers of contracts, one per EPG size (Default: Half the EPGs)")
+    parser.add_argument("--relations", type=int, default=4, help="Contracts provided and consumed by each EPG")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every APIC request")
+    parser.add_argument("--event-rate", type=float, default=0.0,
+                        help="Random changes per second pushed by the fake APIC while benchmarking")
+    parser.add_argument("--events", type=int, default=10000, help="Events applied through PSA.sub_cb")
+    parser.add_argument("--validations", type=int, default=10000, help="Calls to PSA.validate_certificate")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for generating the fabric and requests")
+    parser.add_argument("--output", default="benchmark-results.json", help="File to write the results to")
+    args = parser.parse_args()
+
+    contracts = args.contracts or [max(1, n // 2) for n in args.epgs]
+    if len(contracts) != len(args.epgs):
+        parser.error("--contracts must have one value per value of --epgs")
+
+    cases = []
+    for epgs, cons in zip(args.epgs, contracts):
+        settings = {
+            "tenant": "acpki_benchmark",
+            "epgs": epgs,
+            "contracts": cons,
+            "relations": args.relations,
+            "latency": args.latency,
+            "event-rate": args.event_rate,
+            "events": args.events,
+            "validations": args.validations,
+            "seed": args.seed,
+        }
+        print("Benchmarking {0} EPGs and {1} contracts...".format(epgs, cons))
+
+        # Every size is run in a new process, so that the peak RSS is measured for that size only
+        queue = Queue()
+        process = Process(target=run_case, args=(settings, queue))
+        process.start()
+        results = queue.get()
+        process.join()
+
+        cases.append({"settings": settings, "results": results})
+        print(json.dumps(results, indent=4, sort_keys=True))
+
+    report = {
+        "suite": "psa",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cases": cases,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=4, sort_keys=True)
+    print("Results written to {0}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import struct, hashlib, base64
+
+GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+
+def accept_key(key):
+    """
+    Get the value of the Sec-WebSocket-Accept header for a WebSocket handshake.
+    :param key:     Value of the Sec-WebSocket-Key header sent by the client
+    :return:        The accept key
+    """
+    return base64.b64encode(hashlib.sha1(key.strip() + GUID).digest())
+
+
+def encode_frame(opcode, payload=""):
+    """
+    Encode a single, unmasked WebSocket frame as sent by a server.
+    :param opcode:      Opcode of the frame, e.g. OPCODE_TEXT
+    :param payload:     Payload of the frame
+    :return:            The frame as a string
+    """
+    if isinstance(payload, unicode):
+        payload = payload.encode("utf-8")
+    header = chr(0x80 | opcode)
+    length = len(payload)
+    if length < 126:
+        header += chr(length)
+    elif length < 2 ** 16:
+        header += chr(126) + struct.pack("!H", length)
+    else:
+        header += chr(127) + struct.pack("!Q", length)
+    return header + payload
+
+
+def read_frame(rfile):
+    """
+    Read a single WebSocket frame sent by a client. Frames from clients are masked.
+    :param rfile:       File-like object to read from
+    :return:            Tuple of (fin, opcode, payload), or None if the connection was closed
+    """
+    header = read_exactly(rfile, 2)
+    if header is None:
+        return None
+    fin = ord(header[0]) & 0x80 != 0
+    opcode = ord(header[0]) & 0x0F
+    masked = ord(header[1]) & 0x80 != 0
+    length = ord(header[1]) & 0x7F
+    if length == 126:
+        data = read_exactly(rfile, 2)
+        if data is None:
+            return None
+        length = struct.unpack("!H", data)[0]
+    elif length == 127:
+        data = read_exactly(rfile, 8)
+        if data is None:
+            return None
+        length = struct.unpack("!Q", data)[0]
+
+    mask = None
+    if masked:
+        mask = read_exactly(rfile, 4)
+        if mask is None:
+            return None
+    payload = read_exactly(rfile, length)
+    if payload is None:
+        return None
+    if mask is not None:
+        mask = [ord(c) for c in mask]
+        payload = "".join(chr(ord(c) ^ mask[i % 4]) for i, c in enumerate(payload))
+    return fin, opcode, payload
+
+
+def read_exactly(rfile, size):
+    data = ""
+    while len(data) < size:
+        chunk = rfile.read(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
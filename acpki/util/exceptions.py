@@ -68,3 +68,11 @@ class CertificateExpiredError(StandardError):
 
     def __str__(self):
         return repr(self.value)
+
+
+class RateLimitError(StandardError):
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return repr(self.value)
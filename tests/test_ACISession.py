@@ -0,0 +1,74 @@
+import time, unittest
+from threading import Thread, Event, Lock
+from acpki.aci import ACISession
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.ok = status_code == 200
+        self.reason = "OK" if self.ok else "Forbidden"
+        self.content = '{"totalCount":"0","imdata":[]}'
+
+    def close(self):
+        pass
+
+
+class RenewTokenTest(unittest.TestCase):
+    def setUp(self):
+        self.session = ACISession()
+        self.session.tokens.token = "token-0"
+        self.session.cache = None
+        self.session.send_get = self.send_get
+        self.session.relogin = self.relogin
+        self.lock = Lock()
+        self.logins = 0
+        self.sent = Event()
+        self.release = Event()
+        self.block_next = False  # The next request waits for release before its response is returned
+
+    def send_get(self, path, endpoint, priority, shared, stream, retry=None):
+        token = self.session.token
+        if self.block_next:
+            self.block_next = False
+            self.sent.set()
+            self.release.wait()
+        return FakeResponse(200 if token == self.session.token and self.logins > 0 else 403)
+
+    def relogin(self):
+        with self.lock:
+            time.sleep(0.05)  # Concurrent requests are refused while logging in
+            self.logins += 1
+            self.session.tokens.token = "token-{0}".format(self.logins)
+        return FakeResponse(200)
+
+    def get(self, results):
+        results.append(self.session.get("node/mo/uni/tn-common").status_code)
+
+    def test_concurrent_refused_requests_log_in_once(self):
+        results = []
+        threads = [Thread(target=self.get, args=(results,)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([200] * 8, results)
+        self.assertEqual(1, self.logins)
+
+    def test_request_refused_after_login_does_not_log_in_again(self):
+        # The first request is refused after the second request has logged in again
+        results = []
+        self.block_next = True
+        first = Thread(target=self.get, args=(results,))
+        first.start()
+        self.sent.wait()
+        self.get(results)
+        self.assertEqual(1, self.logins)
+        self.release.set()
+        first.join()
+        self.assertEqual([200, 200], results)
+        self.assertEqual(1, self.logins)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+from acpki.models import EPGUpdate, ContractUpdate
+from acpki.psa import EventCoalescer
+
+EPG_DN = "uni/tn-test/ap-test/epg-web"
+
+
+def epg_event(status, name=None, dn=EPG_DN, mod_ts=None, sub_ids=("1",)):
+    return EPGUpdate(dn, name, mod_ts, status, sub_ids)
+
+
+def contract_event(status, name="con-1", epg_dn=EPG_DN, uid=None, sub_ids=("2",)):
+    return ContractUpdate(epg_dn + "/rsprov-" + name, "fvRsProv", uid, name, None, status, sub_ids)
+
+
+def describe(events):
+    return [(type(event).__name__, event.dn, event.status) for event in events]
+
+
+class EventCoalescerTest(unittest.TestCase):
+    def setUp(self):
+        self.batches = []
+        self.coalescer = EventCoalescer(self.batches.append, window=0, start=False)
+
+    def test_created_and_deleted_cancel(self):
+        events = self.coalescer.combine([epg_event("created", "web"), epg_event("modified", "web2"),
+                                         epg_event("deleted")])
+        self.assertEqual([], events)
+        self.assertEqual(1, self.coalescer.get_stats()["cancelled"])
+
+    def test_modifications_are_merged(self):
+        events = self.coalescer.combine([epg_event("modified", "web", mod_ts="1"),
+                                         epg_event("modified", None, mod_ts="2", sub_ids=("3",))])
+        self.assertEqual(1, len(events))
+        event = events[0]
+        self.assertEqual(("modified", "web", "2", ("1", "3")),
+                         (event.status, event.name, event.mod_ts, event.sub_ids))
+
+    def test_modification_is_merged_into_creation(self):
+        events = self.coalescer.combine([contract_event("created", uid="10"),
+                                         contract_event("modified", uid=None, sub_ids=("4",))])
+        self.assertEqual(1, len(events))
+        self.assertEqual(("created", "10", ("2", "4")), (events[0].status, events[0].uid, events[0].sub_ids))
+
+    def test_modification_after_deletion_is_ignored(self):
+        events = self.coalescer.combine([epg_event("modified", "web"), epg_event("deleted"),
+                                         epg_event("modified", "web2")])
+        self.assertEqual([("EPGUpdate", EPG_DN, "deleted")], describe(events))
+
+    def test_order(self):
+        other = "uni/tn-test/ap-test/epg-db"
+        events = self.coalescer.combine([
+            contract_event("created", "new", epg_dn=other),
+            epg_event("created", "db", dn=other),
+            epg_event("deleted"),
+            contract_event("deleted", "old"),
+            epg_event("modified", "app", dn="uni/tn-test/ap-test/epg-app"),
+        ])
+        self.assertEqual([
+            ("ContractUpdate", EPG_DN + "/rsprov-old", "deleted"),
+            ("EPGUpdate", EPG_DN, "deleted"),
+            ("EPGUpdate", other, "created"),
+            ("EPGUpdate", "uni/tn-test/ap-test/epg-app", "modified"),
+            ("ContractUpdate", other + "/rsprov-new", "created"),
+        ], describe(events))
+
+    def test_epg_deleted_and_created_again(self):
+        events = self.coalescer.combine([
+            contract_event("created", "old"),
+            epg_event("deleted"),
+            contract_event("deleted", "old"),
+            epg_event("created", "web2"),
+            contract_event("created", "new"),
+            epg_event("modified", None, mod_ts="5"),
+        ])
+        # The old EPG is deleted before it is created again, and the modification is merged into the creation
+        self.assertEqual([
+            ("EPGUpdate", EPG_DN, "deleted"),
+            ("EPGUpdate", EPG_DN, "created"),
+            ("ContractUpdate", EPG_DN + "/rsprov-new", "created"),
+        ], describe(events))
+        self.assertEqual(("web2", "5"), (events[1].name, events[1].mod_ts))
+        self.assertEqual(1, self.coalescer.get_stats()["cancelled"])
+
+    def test_deleted_created_and_deleted_again(self):
+        events = self.coalescer.combine([epg_event("deleted"), epg_event("created", "web"), epg_event("deleted")])
+        self.assertEqual([("EPGUpdate", EPG_DN, "deleted")], describe(events))
+
+    def test_immediate_mode_applies_each_add(self):
+        self.coalescer.add([epg_event("created", "web"), contract_event("created")])
+        self.coalescer.add([epg_event("deleted")])
+        self.assertEqual([["EPGUpdate", "ContractUpdate"], ["EPGUpdate"]],
+                         [[type(event).__name__ for event in batch] for batch in self.batches])
+        self.assertEqual(3, self.coalescer.get_stats()["applied"])
+
+
+class WindowTest(unittest.TestCase):
+    def test_events_are_combined_until_flushed(self):
+        batches = []
+        coalescer = EventCoalescer(batches.append, window=60)
+        try:
+            coalescer.add([contract_event("created")])
+            coalescer.add([epg_event("created", "web")])
+            coalescer.add([contract_event("modified")])
+            self.assertEqual([], batches)
+            self.assertEqual(2, coalescer.get_stats()["pending"])
+            self.assertEqual(2, coalescer.flush())
+        finally:
+            coalescer.stop()
+        self.assertEqual([[("EPGUpdate", EPG_DN, "created"), ("ContractUpdate", EPG_DN + "/rsprov-con-1", "created")]],
+                         [describe(batch) for batch in batches])
+
+
+if __name__ == "__main__":
+    unittest.main()
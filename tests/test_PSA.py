@@ -0,0 +1,57 @@
+import unittest
+from threading import RLock
+from acpki.models import EPG, EPGUpdate, ContractUpdate
+from acpki.psa import PSA, PolicyStore, PendingEvents
+
+AP_DN = "uni/tn-test/ap-test"
+
+
+class StorePSA(PSA):
+    def __init__(self):
+        # The PSA is created without connecting to the APIC
+        self.verbose = False
+        self.store = PolicyStore()
+        self.lock = RLock()
+        self.handlers = {
+            EPGUpdate: self.epg_cb,
+            ContractUpdate: self.contract_cb,
+        }
+        self.pending = PendingEvents(None, start=False)
+
+
+class ApplyEventsTest(unittest.TestCase):
+    def setUp(self):
+        self.psa = StorePSA()
+        self.psa.store.load([EPG(AP_DN + "/epg-web", "web")])
+
+    def test_failed_event_is_reverted(self):
+        # The held event fails when it is replayed, after the EPG has been added to the draft
+        new = AP_DN + "/epg-new"
+        self.psa.pending.add(new, ContractUpdate(new + "/rsbad-con", "fvRsBad", "1", "con", None, "created", ()))
+        old = self.psa.store.snapshot
+
+        applied = self.psa.apply_events([
+            EPGUpdate(AP_DN + "/epg-web", "web-renamed", None, "modified", ()),
+            EPGUpdate(new, "new", None, "created", ()),
+            EPGUpdate(AP_DN + "/epg-db", "db", None, "created", ()),
+        ])
+        self.assertEqual(2, applied)
+
+        snapshot = self.psa.store.snapshot
+        self.assertEqual(old.version + 1, snapshot.version)
+        self.assertEqual("web-renamed", snapshot.get_epg(AP_DN + "/epg-web").name)
+        self.assertIsNotNone(snapshot.get_epg(AP_DN + "/epg-db"))
+        self.assertIsNone(snapshot.get_epg(new))
+        self.assertIsNone(snapshot.get_epg_by_name("new"))
+        self.assertEqual(2, len(snapshot.get_epgs()))
+
+    def test_only_failed_events(self):
+        old = self.psa.store.snapshot
+        new = AP_DN + "/epg-new"
+        self.psa.pending.add(new, ContractUpdate(new + "/rsbad-con", "fvRsBad", "1", "con", None, "created", ()))
+        self.assertEqual(0, self.psa.apply_events([EPGUpdate(new, "new", None, "created", ())]))
+        self.assertIs(old, self.psa.store.snapshot)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,205 @@
+import unittest
+from acpki.models import EPG, Contract
+from acpki.psa import PolicyStore
+from acpki.util.exceptions import IllegalStateError
+
+AP_DN = "uni/tn-test/ap-test"
+
+
+def make_epg(name, provides=(), consumes=()):
+    dn = "{0}/epg-{1}".format(AP_DN, name)
+    epg = EPG(dn, name)
+    epg.provides = [Contract(uid, "con-" + uid, "{0}/rsprov-con-{1}".format(dn, uid)) for uid in provides]
+    epg.consumes = [Contract(uid, "con-" + uid, "{0}/rscons-con-{1}".format(dn, uid)) for uid in consumes]
+    return epg
+
+
+def dump(snapshot):
+    """
+    Get the content of every index of a snapshot as plain values that can be compared.
+    """
+    epgs = dict((dn, (epg.name, [con.dn for con in epg.provides], [con.dn for con in epg.consumes]))
+                for dn, epg in snapshot.epgs_by_dn.items())
+    return (epgs, sorted((name, epg.dn) for name, epg in snapshot.epgs_by_name.items()),
+            dict((dn, (epg_dn, action, con.dn)) for dn, (epg_dn, action, con) in snapshot.contracts_by_dn.items()),
+            dict((uid, sorted(by_dn)) for uid, by_dn in snapshot.contracts_by_uid.items()),
+            snapshot.epgs_by_uid, snapshot.uids_by_epg)
+
+
+class PolicyStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.store = PolicyStore()
+        self.store.load([make_epg("web", provides=["1"]), make_epg("app", consumes=["1"], provides=["2"]),
+                         make_epg("db", consumes=["2"])])
+        self.web = "{0}/epg-web".format(AP_DN)
+        self.app = "{0}/epg-app".format(AP_DN)
+        self.db = "{0}/epg-db".format(AP_DN)
+
+    def test_load(self):
+        snapshot = self.store.snapshot
+        self.assertEqual(3, len(snapshot.get_epgs()))
+        self.assertTrue(snapshot.consumes_from(self.app, self.web))
+        self.assertTrue(snapshot.consumes_from(self.db, self.app))
+        self.assertFalse(snapshot.consumes_from(self.db, self.web))
+
+    def test_old_snapshot_unchanged_after_batch(self):
+        old = self.store.snapshot
+        old_web = old.get_epg(self.web)
+        with self.store.batch():
+            self.store.update_epg(self.web, "web-renamed")
+            self.store.add_contract(self.db, "cons", Contract("1", "con-1", self.db + "/rscons-con-1"))
+            self.store.remove_epg(self.app)
+
+        new = self.store.snapshot
+        self.assertEqual(old.version + 1, new.version)
+
+        # The old snapshot still shows the policy before the batch
+        self.assertIs(old_web, old.get_epg(self.web))
+        self.assertEqual("web", old_web.name)
+        self.assertIs(old_web, old.get_epg_by_name("web"))
+        self.assertIsNotNone(old.get_epg(self.app))
+        self.assertFalse(old.consumes_from(self.db, self.web))
+        self.assertTrue(old.consumes_from(self.app, self.web))
+        self.assertEqual(1, len(old.get_epg(self.db).consumes))
+
+        # The new snapshot shows the changes
+        self.assertEqual("web-renamed", new.get_epg(self.web).name)
+        self.assertIsNone(new.get_epg_by_name("web"))
+        self.assertIsNone(new.get_epg(self.app))
+        self.assertTrue(new.consumes_from(self.db, self.web))
+        self.assertFalse(new.consumes_from(self.db, self.app))
+
+    def test_unchanged_parts_are_shared(self):
+        old = self.store.snapshot
+        with self.store.batch():
+            self.store.update_epg(self.web, "web-renamed")
+        new = self.store.snapshot
+        self.assertIsNot(old.get_epg(self.web), new.get_epg(self.web))
+        self.assertIs(old.get_epg(self.app), new.get_epg(self.app))
+        self.assertIs(old.contracts_by_dn, new.contracts_by_dn)
+        self.assertIs(old.epgs_by_uid, new.epgs_by_uid)
+
+    def test_raising_batch_publishes_nothing(self):
+        old = self.store.snapshot
+        with self.assertRaises(ValueError):
+            with self.store.batch():
+                self.store.remove_epg(self.app)
+                self.store.update_epg(self.web, "web-renamed")
+                raise ValueError("Failed")
+        self.assertIs(old, self.store.snapshot)
+        self.assertIsNotNone(self.store.snapshot.get_epg(self.app))
+        self.assertEqual("web", self.store.snapshot.get_epg(self.web).name)
+        self.assertTrue(self.store.snapshot.consumes_from(self.app, self.web))
+
+        # The store can still be changed afterwards
+        self.store.remove_epg(self.app)
+        self.assertEqual(old.version + 1, self.store.snapshot.version)
+        self.assertIsNone(self.store.snapshot.get_epg(self.app))
+
+    def test_nested_batches_publish_once(self):
+        old = self.store.snapshot
+        with self.store.batch():
+            with self.store.batch():
+                self.store.update_epg(self.web, "web-renamed")
+            self.assertIs(old, self.store.snapshot)  # Not published by the inner batch
+            self.store.remove_epg(self.db)
+            self.assertIs(old, self.store.snapshot)
+        self.assertEqual(old.version + 1, self.store.snapshot.version)
+        self.assertEqual("web-renamed", self.store.snapshot.get_epg(self.web).name)
+        self.assertIsNone(self.store.snapshot.get_epg(self.db))
+
+    def test_raising_nested_batch_discards_outer_batch(self):
+        old = self.store.snapshot
+        with self.assertRaises(ValueError):
+            with self.store.batch():
+                self.store.update_epg(self.web, "web-renamed")
+                with self.store.batch():
+                    self.store.remove_epg(self.db)
+                    raise ValueError("Failed")
+        self.assertIs(old, self.store.snapshot)
+
+    def test_batch_without_changes_keeps_version(self):
+        old = self.store.snapshot
+        with self.store.batch():
+            self.store.remove_epg("{0}/epg-missing".format(AP_DN))
+        self.assertIs(old, self.store.snapshot)
+
+
+class SavepointTest(unittest.TestCase):
+    def setUp(self):
+        self.store = PolicyStore()
+        self.store.load([make_epg("web", provides=["1"]), make_epg("app", consumes=["1"], provides=["2"]),
+                         make_epg("db", consumes=["2"])])
+        self.web = "{0}/epg-web".format(AP_DN)
+        self.app = "{0}/epg-app".format(AP_DN)
+        self.db = "{0}/epg-db".format(AP_DN)
+
+    def change_before(self):
+        # Changes every index before the savepoint, so that the draft owns them and they are changed in place
+        self.store.update_epg(self.web, "web-renamed")
+        self.store.add_contract(self.db, "cons", Contract("1", "con-1", self.db + "/rscons-con-1"))
+        self.store.add_epg(make_epg("new"))
+
+    def change_and_fail(self):
+        self.store.remove_epg(self.app)
+        self.store.update_epg(self.db, "db-renamed")
+        self.store.add_contract(self.web, "prov", Contract("3", "con-3", self.web + "/rsprov-con-3"))
+        self.store.remove_contract(self.db + "/rscons-con-1")
+        self.store.put_epg(make_epg("web", provides=["4"]))
+        self.store.clear()
+        raise ValueError("Failed")
+
+    def test_failed_savepoint_is_reverted(self):
+        with self.store.batch():
+            self.change_before()
+        expected = dump(self.store.snapshot)
+
+        self.setUp()
+        with self.store.batch():
+            self.change_before()
+            with self.assertRaises(ValueError):
+                with self.store.savepoint():
+                    self.change_and_fail()
+        self.assertEqual(expected, dump(self.store.snapshot))
+
+    def test_failed_savepoint_in_savepoint(self):
+        old = dump(self.store.snapshot)
+        with self.store.batch():
+            with self.assertRaises(ValueError):
+                with self.store.savepoint():
+                    self.change_before()
+                    with self.store.savepoint():
+                        self.store.remove_epg(self.db)
+                    self.change_and_fail()
+        self.assertEqual(old, dump(self.store.snapshot))
+
+    def test_savepoint_is_kept_with_later_changes(self):
+        with self.store.batch():
+            with self.store.savepoint():
+                self.change_before()
+            self.store.remove_epg(self.db)
+        with_savepoint = dump(self.store.snapshot)
+
+        self.setUp()
+        with self.store.batch():
+            self.change_before()
+            self.store.remove_epg(self.db)
+        self.assertEqual(dump(self.store.snapshot), with_savepoint)
+
+    def test_savepoint_outside_batch(self):
+        with self.assertRaises(IllegalStateError):
+            with self.store.savepoint():
+                self.store.remove_epg(self.db)
+        self.assertIsNotNone(self.store.snapshot.get_epg(self.db))
+
+    def test_failed_savepoint_without_other_changes_publishes_nothing(self):
+        old = self.store.snapshot
+        with self.store.batch():
+            with self.assertRaises(ValueError):
+                with self.store.savepoint():
+                    self.change_and_fail()
+        self.assertIs(old, self.store.snapshot)
+
+
+if __name__ == "__main__":
+    unittest.main()
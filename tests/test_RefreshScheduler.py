@@ -0,0 +1,72 @@
+import time, threading, unittest
+from acpki.aci import RefreshScheduler, QueryExecutor, Subscription
+from acpki.util.exceptions import IllegalStateError
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.001)
+
+
+class QueryExecutorTest(unittest.TestCase):
+    def test_submit_after_close_raises(self):
+        executor = QueryExecutor(2)
+        self.assertEqual([1, 4], executor.map(lambda x: x * x, [1, 2]))
+        executor.close()
+        self.assertIsNone(executor.pool)
+        with self.assertRaises(IllegalStateError):
+            executor.submit(len, "a")
+        self.assertIsNone(executor.pool)
+
+
+class RefreshSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.retry_interval = RefreshScheduler.retry_interval
+        RefreshScheduler.retry_interval = 0.01
+
+    def tearDown(self):
+        RefreshScheduler.retry_interval = self.retry_interval
+
+    def test_dropped_after_max_failures(self):
+        dropped = []
+        scheduler = RefreshScheduler(lambda sub: False, timeout=5, interval=0.01, jitter=0, max_failures=3,
+                                     dropped_cb=lambda sub, error: dropped.append((sub, error)))
+        subscription = Subscription(None, "1", "node/class/fvAEPg")
+        scheduler.add(subscription)
+        wait_for(lambda: dropped)
+        scheduler.stop()
+
+        self.assertIs(subscription, dropped[0][0])
+        self.assertFalse(subscription.active)
+        stats = scheduler.get_stats()
+        self.assertEqual((3, 1, 0), (stats["failed"], stats["dropped"], stats["subscriptions"]))
+
+    def test_failures_are_reset_by_a_refresh(self):
+        results = [False, False, True, False, False, True]
+        scheduler = RefreshScheduler(lambda sub: results.pop(0) if results else True, timeout=5, interval=0.01,
+                                     jitter=0, max_failures=3)
+        subscription = Subscription(None, "1", "node/class/fvAEPg")
+        scheduler.add(subscription)
+        wait_for(lambda: not results)
+        scheduler.stop()
+        self.assertTrue(subscription.active)
+        self.assertEqual(0, scheduler.get_stats()["dropped"])
+
+    def test_stop_closes_the_executor(self):
+        threads = threading.active_count()
+        for _ in range(5):
+            scheduler = RefreshScheduler(lambda sub: True, timeout=5, interval=0.001, jitter=0, workers=2)
+            for i in range(10):
+                scheduler.add(Subscription(None, str(i), "node/class/fvAEPg"))
+            wait_for(lambda: scheduler.get_stats()["refreshed"] >= 10)
+            scheduler.stop()
+            self.assertFalse(scheduler.thread.is_alive())
+            self.assertIsNone(scheduler.executor.pool)
+        wait_for(lambda: threading.active_count() <= threads)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import time, unittest
+from threading import Thread, Event, Lock
+from acpki.aci import SingleFlight
+
+
+def run_threads(count, target):
+    results = [None] * count
+
+    def run(i):
+        try:
+            results[i] = ("result", target())
+        except Exception as e:
+            results[i] = ("error", e)
+    threads = [Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.001)
+
+
+class SingleFlightTest(unittest.TestCase):
+    def setUp(self):
+        self.single_flight = SingleFlight()
+        self.release = Event()
+        self.calls = 0
+        self.lock = Lock()
+
+    def blocking(self, result=None, error=None):
+        with self.lock:
+            self.calls += 1
+            call = self.calls
+        self.release.wait()
+        if error is not None:
+            raise error
+        return result if result is not None else call
+
+    def test_concurrent_calls_share_one_call(self):
+        threads, results = run_threads(8, lambda: self.single_flight.do("key", self.blocking))
+        wait_for(lambda: self.single_flight.get_stats()["coalesced"] == 7)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, self.calls)
+        self.assertEqual([("result", 1)] * 8, results)
+        self.assertEqual({"executed": 1, "coalesced": 7, "in-flight": 0}, self.single_flight.get_stats())
+
+    def test_exception_is_raised_to_all_callers(self):
+        error = ValueError("Failed")
+        threads, results = run_threads(4, lambda: self.single_flight.do("key", self.blocking, error=error))
+        wait_for(lambda: self.single_flight.get_stats()["coalesced"] == 3)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(1, self.calls)
+        self.assertEqual([("error", error)] * 4, results)
+
+        # The failed call is not shared with later callers
+        self.assertEqual(2, self.single_flight.do("key", self.blocking))
+
+    def test_different_keys_are_not_shared(self):
+        self.release.set()
+        self.assertEqual(1, self.single_flight.do("a", self.blocking))
+        self.assertEqual(2, self.single_flight.do("b", self.blocking))
+        self.assertEqual(3, self.single_flight.do("a", self.blocking))
+
+    def test_do_fresh_runs_after_the_running_call(self):
+        first, first_results = run_threads(1, lambda: self.single_flight.do_fresh("key", self.blocking))
+        wait_for(lambda: self.calls == 1)
+
+        # Callers arriving while the first call runs share one more call, which runs after it
+        threads, results = run_threads(5, lambda: self.single_flight.do_fresh("key", self.blocking))
+        wait_for(lambda: self.single_flight.get_stats()["coalesced"] == 4)
+        self.assertEqual(1, self.calls)
+        self.release.set()
+        for thread in first + threads:
+            thread.join()
+        self.assertEqual(2, self.calls)
+        self.assertEqual([("result", 1)], first_results)
+        self.assertEqual([("result", 2)] * 5, results)
+        self.assertEqual(0, self.single_flight.get_stats()["in-flight"])
+
+
+if __name__ == "__main__":
+    unittest.main()
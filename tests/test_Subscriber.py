@@ -0,0 +1,23 @@
+import unittest
+from acpki.aci import Subscriber
+from acpki.util.exceptions import SubscriptionError
+
+
+class DisconnectedSubscriber(Subscriber):
+    def __init__(self):
+        # The Subscriber is not connected, as after disconnect() while it is reconnecting
+        self.scheduler = None
+        self.connected = False
+        self.subscriptions = []
+
+
+class SubscribeTest(unittest.TestCase):
+    def test_subscribe_while_disconnected(self):
+        subscriber = DisconnectedSubscriber()
+        with self.assertRaises(SubscriptionError):
+            subscriber.subscribe("7205", "/api/mo/uni.json")
+        self.assertEqual([], subscriber.subscriptions)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import requests
+from acpki.aci import Transport, RateLimiter
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = {}
+
+    def close(self):
+        pass
+
+
+class FakeSession:
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.requests = 0
+
+    def request(self, method, url, **kwargs):
+        self.requests += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return FakeResponse(outcome)
+
+
+class TransportTest(unittest.TestCase):
+    def setUp(self):
+        self.limiter = RateLimiter(rate=1000, burst=1000, max_limit=2, max_wait=0.1)
+        self.transport = Transport(retries=2, backoff=0, backoff_max=0, limiter=self.limiter)
+
+    def request(self, outcomes, method="GET", **kwargs):
+        self.transport.session = FakeSession(outcomes)
+        return self.transport.request(method, "http://apic/api/node/mo/uni.json", **kwargs)
+
+    def test_other_errors_release_the_limiter(self):
+        errors = [requests.exceptions.TooManyRedirects("Redirects"), requests.exceptions.InvalidURL("URL"),
+                  requests.exceptions.ChunkedEncodingError("Chunks"), KeyboardInterrupt()]
+        for error in errors * 2:  # More errors than the limit of requests in flight
+            with self.assertRaises(type(error)):
+                self.request([error])
+            self.assertEqual(1, self.transport.session.requests)  # Not retried
+            self.assertEqual(0, self.limiter.get_stats()["in-flight"])
+        self.assertEqual(200, self.request([200]).status_code)
+
+    def test_connection_errors_are_retried(self):
+        resp = self.request([requests.exceptions.ConnectionError("Refused"), 503, 200])
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(3, self.transport.session.requests)
+        self.assertEqual(0, self.limiter.get_stats()["in-flight"])
+
+    def test_retry_disabled(self):
+        with self.assertRaises(requests.exceptions.Timeout):
+            self.request([requests.exceptions.Timeout("Timeout"), 200], retry=False)
+        self.assertEqual(503, self.request([503, 200], retry=False).status_code)
+        self.assertEqual(503, self.request([503, 200], method="POST").status_code)
+        self.assertEqual(0, self.limiter.get_stats()["in-flight"])
+
+
+if __name__ == "__main__":
+    unittest.main()
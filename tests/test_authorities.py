@@ -0,0 +1,106 @@
+import os, shutil, tempfile, unittest
+from OpenSSL import crypto
+from acpki.models import EP, EPG, CertificateRequest
+from acpki.pki import CertificateManager
+from acpki.pki.authorities import RA
+from acpki.psa import OURegistry
+
+
+class FakePSA:
+    def __init__(self, ous_file):
+        self.ous = OURegistry(ous_file)
+        self.denied = set()
+
+    def connection_allowed(self, origin, destination):
+        if origin.name == "error":
+            raise ValueError("Connection check failed")
+        return origin.name not in self.denied
+
+    def register_ous(self, eps_list, with_created=False):
+        results = self.ous.register_many(eps_list)
+        return results if with_created else [ou for ou, _ in results]
+
+    def remove_ou(self, ou):
+        return self.ous.remove(ou)
+
+
+class BatchRA(RA):
+    def __init__(self, ca, psa):
+        # The RA is created without its own certificates, which are not used for batch requests
+        self.ca = ca
+        self.psa = psa
+        self.verbose = False
+        self.signing_workers = 0
+        self.signing_pool = None
+
+
+class FakeCA:
+    def get_issuer(self):
+        return crypto.X509()
+
+    def get_keys(self):
+        return None
+
+
+class RequestCertificatesTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.psa = FakePSA(os.path.join(self.dir, "ous.txt"))
+        self.ra = BatchRA(FakeCA(), self.psa)
+
+        self.create_cert = CertificateManager.create_cert
+        CertificateManager.create_cert = staticmethod(self.fake_create_cert)
+
+    def tearDown(self):
+        CertificateManager.create_cert = staticmethod(self.create_cert)
+        self.psa.ous.close()
+        shutil.rmtree(self.dir)
+
+    @staticmethod
+    def fake_create_cert(csr, serial, issuer, key):
+        if csr.get_subject().CN == "unsigned":
+            raise ValueError("Signing failed")
+        cert = crypto.X509()
+        cert.set_serial_number(serial)
+        cert.set_subject(csr.get_subject())
+        return cert
+
+    @staticmethod
+    def make_request(name, destination="server"):
+        origin = EP(name, epg=EPG("uni/tn-test/ap-test/epg-" + name, "epg-" + name))
+        destination = EP(destination, epg=EPG("uni/tn-test/ap-test/epg-" + destination, "epg-" + destination))
+        return CertificateRequest(origin, destination, crypto.X509Req())
+
+    def test_errors_are_recorded_per_request(self):
+        self.psa.denied.add("denied")
+        names = ["client", "error", "denied", "unsigned", "other"]
+        responses = self.ra.request_certificates([self.make_request(name) for name in names])
+        by_name = dict(zip(names, responses))
+
+        self.assertIsNotNone(by_name["client"].cert)
+        self.assertIsNotNone(by_name["other"].cert)
+        self.assertIsInstance(by_name["error"].error, ValueError)
+        self.assertTrue(by_name["denied"].refused)
+        self.assertIsNone(by_name["denied"].error)
+        self.assertIsInstance(by_name["unsigned"].error, ValueError)
+        self.assertIsNone(by_name["unsigned"].cert)
+
+    def test_ous_of_failed_requests_are_removed(self):
+        responses = self.ra.request_certificates([self.make_request("client"), self.make_request("unsigned")])
+        self.assertIsNotNone(responses[0].cert)
+        self.assertIsNone(responses[1].cert)
+
+        # Only the OU of the issued certificate is registered
+        self.assertEqual(1, len(self.psa.ous))
+        self.assertIn(responses[0].cert.get_subject().OU, self.psa.ous)
+        self.assertIsNone(self.psa.ous.get_ou(("epg-unsigned", "epg-server")))
+
+    def test_existing_ous_are_kept(self):
+        ou = self.psa.register_ous([("epg-unsigned", "epg-server")])[0]
+        responses = self.ra.request_certificates([self.make_request("unsigned")])
+        self.assertIsNotNone(responses[0].error)
+        self.assertIn(ou, self.psa.ous)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import os, time, shutil, tempfile, datetime, unittest
+from OpenSSL import crypto
+from cryptography.x509 import ocsp
+from acpki.pki import CertificateManager, RevocationList
+from acpki.pki.ocsp import OCSPResponder
+
+
+def make_certificate(serial, key, issuer=None, issuer_key=None):
+    cert = crypto.X509()
+    cert.set_serial_number(serial)
+    cert.get_subject().CN = "test-{0}".format(serial)
+    cert.set_issuer(issuer.get_subject() if issuer is not None else cert.get_subject())
+    cert.set_pubkey(key)
+    cert.gmtime_adj_notBefore(0)
+    cert.gmtime_adj_notAfter(3600)
+    cert.sign(issuer_key or key, "sha256")
+    return cert
+
+
+class RevocationListTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "revoked.txt")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_revocation_time_is_kept(self):
+        revoked = RevocationList(self.path)
+        before = datetime.datetime.utcfromtimestamp(int(time.time()))
+        self.assertTrue(revoked.add(1234))
+        self.assertFalse(revoked.add(1234))
+        revoked_at = revoked.get_revocation_time(1234)
+        self.assertTrue(before <= revoked_at <= datetime.datetime.utcnow())
+        self.assertIsNone(revoked.get_revocation_time(5678))
+        revoked.close()
+
+        # The time is loaded from file, also after compaction
+        revoked = RevocationList(self.path)
+        self.assertEqual(revoked_at, revoked.get_revocation_time(1234))
+        revoked.compact()
+        revoked.close()
+        self.assertEqual(revoked_at, RevocationList(self.path).get_revocation_time("1234"))
+
+    def test_unrevoke(self):
+        revoked = RevocationList(self.path)
+        revoked.add(1234)
+        self.assertTrue(revoked.remove(1234))
+        self.assertFalse(revoked.remove(1234))
+        self.assertNotIn(1234, revoked)
+        revoked.close()
+        self.assertEqual(0, len(RevocationList(self.path)))
+
+    def test_file_without_times(self):
+        with open(self.path, "w") as f:
+            f.write("1234\n5678\n-5678\n")
+        revoked = RevocationList(self.path)
+        self.assertIn(1234, revoked)
+        self.assertNotIn(5678, revoked)
+        revoked_at = revoked.get_revocation_time(1234)
+        revoked.close()
+
+        # The time recorded on the first load is kept
+        self.assertEqual(revoked_at, RevocationList(self.path).get_revocation_time(1234))
+
+
+class OCSPResponderTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.certs_dir = CertificateManager.certs_dir
+        CertificateManager.certs_dir = self.dir
+
+        self.key = crypto.PKey()
+        self.key.generate_key(crypto.TYPE_RSA, 2048)
+        self.ca_cert = make_certificate(1, self.key)
+        self.responder = OCSPResponder(self.ca_cert, self.key)
+
+    def tearDown(self):
+        self.responder.stop()
+        self.responder.revoked.close()
+        CertificateManager.certs_dir = self.certs_dir
+        shutil.rmtree(self.dir)
+
+    def test_revocation_time_does_not_change_on_refresh(self):
+        cert = make_certificate(1234, self.key, self.ca_cert, self.key)
+        good = ocsp.load_der_ocsp_response(self.responder.get_response(cert))
+        self.assertEqual(ocsp.OCSPCertStatus.GOOD, good.certificate_status)
+
+        self.responder.revoke_certificate(cert)
+        first = ocsp.load_der_ocsp_response(self.responder.get_response(cert))
+        self.assertEqual(ocsp.OCSPCertStatus.REVOKED, first.certificate_status)
+        self.assertEqual(self.responder.revoked.get_revocation_time(1234), first.revocation_time)
+
+        time.sleep(1.1)
+        second = ocsp.load_der_ocsp_response(self.responder.refresh("1234"))
+        self.assertGreater(second.this_update, first.this_update)
+        self.assertEqual(first.revocation_time, second.revocation_time)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import json, unittest
+from collections import OrderedDict
+from acpki.aci.streaming import iter_imdata, parse_fields
+
+
+def split(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def make_body(imdata, fields, imdata_first=False):
+    items = [("imdata", imdata)] + fields if imdata_first else fields + [("imdata", imdata)]
+    return json.dumps(OrderedDict(items))
+
+
+class IterImdataTest(unittest.TestCase):
+    imdata = [
+        {"fvAEPg": {"attributes": {"dn": "uni/tn-test/ap-test/epg-web", "name": "web", "descr": "a \"quoted\" ] name"}}},
+        {"fvRsProv": {"attributes": {"dn": "uni/tn-test/ap-test/epg-web/rsprov-con-1", "tnVzBrCPName": "con-1",
+                                     "descr": "escapes \\ \\\" \\n and {braces} [brackets], commas"}}},
+        {"fvAEPg": {"attributes": {"dn": "uni/tn-test/ap-test/epg-db", "name": u"blåbær",
+                                   "descr": u"☃ snow"}}},
+    ]
+
+    def parse(self, chunks):
+        fields = []
+        items = list(iter_imdata(chunks, fields.append))
+        return items, fields
+
+    def test_every_chunk_size(self):
+        body = make_body(self.imdata, [("totalCount", "3"), ("subscriptionId", "72057594037927937")])
+        for size in range(1, len(body) + 1):
+            items, fields = self.parse(split(body, size))
+            self.assertEqual(self.imdata, items, "Chunk size {0}".format(size))
+            self.assertEqual([{"totalCount": "3", "subscriptionId": "72057594037927937"}], fields)
+
+    def test_utf8_split_inside_characters(self):
+        body = json.dumps({"imdata": self.imdata}, ensure_ascii=False).encode("utf-8")
+        for size in range(1, 12):
+            items, _ = self.parse(split(body, size))
+            self.assertEqual(self.imdata, items, "Chunk size {0}".format(size))
+
+    def test_fields_after_imdata(self):
+        body = make_body(self.imdata, [("totalCount", "3"), ("subscriptionId", "7205")], imdata_first=True)
+        for size in (1, 2, 7, 64, len(body)):
+            items, fields = self.parse(split(body, size))
+            self.assertEqual(self.imdata, items)
+            self.assertEqual([{}, {"totalCount": "3", "subscriptionId": "7205"}], fields)
+
+    def test_subscription_id_after_objects_is_reported_after_them(self):
+        body = make_body(self.imdata, [("subscriptionId", "7205")], imdata_first=True)
+        seen = []
+
+        def fields_cb(fields):
+            if "subscriptionId" in fields:
+                seen.append(len(items))
+
+        items = []
+        for item in iter_imdata(split(body, 5), fields_cb):
+            items.append(item)
+        self.assertEqual([3], seen)
+
+    def test_empty_imdata(self):
+        for body in ('{"totalCount":"0","imdata":[]}', '{"totalCount":"0","subscriptionId":"7205","imdata":[ ]}',
+                     '{"imdata":[],"subscriptionId":"7205"}', '{ "imdata" : [\n] }'):
+            for size in (1, 3, len(body)):
+                items, fields = self.parse(split(body, size))
+                self.assertEqual([], items)
+            self.assertEqual("7205" in body, any("subscriptionId" in f for f in fields))
+
+    def test_incomplete_response(self):
+        body = make_body(self.imdata, [("totalCount", "3")])
+        with self.assertRaises(ValueError):
+            list(iter_imdata(split(body[:len(body) // 2], 10)))
+        with self.assertRaises(ValueError):
+            list(iter_imdata(['{"totalCount":"3"}']))
+
+    def test_without_fields_cb(self):
+        body = make_body(self.imdata, [("subscriptionId", "7205")], imdata_first=True)
+        self.assertEqual(self.imdata, list(iter_imdata(split(body, 4))))
+
+
+class ParseFieldsTest(unittest.TestCase):
+    def test_parse_fields(self):
+        self.assertEqual({"totalCount": "2", "subscriptionId": "7205", "count": 2, "escaped": 'a "b"'},
+                         parse_fields('{"totalCount": "2", "subscriptionId":"7205","count":2,"escaped":"a \\"b\\"",'))
+        self.assertEqual({}, parse_fields("{"))
+
+
+if __name__ == "__main__":
+    unittest.main()